@@ -7,8 +7,10 @@
 - /api/v1/exercise: 演習問題
 - /api/v1/song-analysis: 楽曲解析（Spotify + Basic Pitch）
 """
+import asyncio
 import os
-from fastapi import FastAPI
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Response
 from fastapi.middleware.cors import CORSMiddleware
 from dotenv import load_dotenv
 
@@ -17,11 +19,31 @@ load_dotenv()
 
 # Routerのインポート
 from app.routers import theory, tts, exercise, song_analysis
+from app.services import get_job_manager, get_warmup_service
+from app.services.executors import shutdown_executors
+from app.services.youtube import close_youtube_service
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """起動・終了処理"""
+    # 起動時: ウォームアップ（有効な場合）をバックグラウンドで開始
+    # 完了するまで /ready は503を返す（/health は即座に応答）
+    warmup_task = asyncio.create_task(get_warmup_service().run())
+    yield
+    # 終了時: ジョブワーカーとエグゼキューターを停止
+    warmup_task.cancel()
+    await asyncio.gather(warmup_task, return_exceptions=True)
+    await get_job_manager().shutdown()
+    await close_youtube_service()
+    shutdown_executors()
+
 
 app = FastAPI(
     title="アニソン作曲学習API",
     description="音楽理論解説、演習、楽曲解析を提供するAPI",
     version="0.1.0",
+    lifespan=lifespan,
 )
 
 # CORS設定（開発環境では全オリジンを許可）
@@ -50,3 +72,12 @@ async def root():
 async def health():
     """ヘルスチェック"""
     return {"status": "healthy"}
+
+
+@app.get("/ready")
+async def ready(response: Response):
+    """レディネスチェック（ウォームアップが終わるまで503）"""
+    warmup = get_warmup_service()
+    if not warmup.ready:
+        response.status_code = 503
+    return warmup.to_dict()
@@ -15,11 +15,55 @@ from app.services import (
     get_audio_downloader_service,
     get_magenta_service,
     get_gemini_service,
+    get_audio_separator_service,
+    get_analysis_cache_service,
+    get_single_flight,
+    get_job_manager,
 )
+from app.services.executors import run_in_thread
+from app.services.job_queue import JobQueueFullError
+from app.services.notes import NoteArray, as_note_array
+from app.services.single_flight import Flight
 
 router = APIRouter()
 
 
+def _single_track_cache_params(
+    magenta,
+    generate_ai_analysis: bool,
+    section: Optional[tuple[float, Optional[float]]] = None,
+    chords_only: bool = False,
+) -> dict:
+    """フル楽曲解析のキャッシュキー用パラメータ"""
+    params = magenta.get_pipeline_params("chords" if chords_only else "single")
+    params["generate_ai_analysis"] = generate_ai_analysis
+    if section is not None:
+        params["section"] = list(section)
+    return params
+
+
+def _resolve_section(
+    start: Optional[float], end: Optional[float]
+) -> Optional[tuple[float, Optional[float]]]:
+    """
+    解析する区間を検証（start / end ともに省略なら曲全体でNone）
+
+    Returns:
+        (開始秒, 終了秒)。end省略時は曲の最後まで（終了秒はNone）
+
+    Raises:
+        HTTPException: 区間が不正な場合（400）
+    """
+    if start is None and end is None:
+        return None
+    start = start or 0.0
+    if start < 0:
+        raise HTTPException(status_code=400, detail="start は0以上を指定してください")
+    if end is not None and end <= start:
+        raise HTTPException(status_code=400, detail="end は start より後を指定してください")
+    return (start, end)
+
+
 class ChordInfo(BaseModel):
     """コード情報"""
     time: float
@@ -42,6 +86,13 @@ class AnalysisResult(BaseModel):
     thumbnail: Optional[str] = None
     url: Optional[str] = None
 
+    # 解析した区間（曲全体の場合はNone。ノート・コードの時刻は曲の先頭から）
+    start: Optional[float] = None
+    end: Optional[float] = None
+
+    # コードのみの解析か（Trueならノートは含まない）
+    chords_only: bool = False
+
     # 解析データ
     tempo: Optional[int] = None
     duration: Optional[float] = None
@@ -63,8 +114,16 @@ async def get_song_analysis_info():
             "endpoints": {
                 "/search": "曲を検索（クエリ必須）",
                 "/video/{video_id}": "動画詳細を取得",
+                "/videos?ids=...": "複数の動画詳細をまとめて取得（カンマ区切り）",
                 "/analyze/{video_id}": "曲を解析（フル楽曲）",
                 "/analyze/{video_id}/stream": "曲を解析（進捗ストリーミング）",
+                "/analyze/{video_id}?chords_only=true": "コード進行のみを高速に解析（ノート変換なし）",
+                "/analyze-4tracks/{video_id}": "曲を4トラックに分離して解析",
+                "/analyze-4tracks/{video_id}/stream": "曲を4トラックに分離して解析（進捗・トラックごとの結果をストリーミング）",
+                "POST /jobs/analyze/{video_id}": "解析ジョブを投入",
+                "POST /jobs/analyze-4tracks/{video_id}": "4トラック解析ジョブを投入",
+                "/jobs/{job_id}": "ジョブの状態を取得",
+                "/jobs/{job_id}/result": "ジョブの結果を取得",
             },
             "features": {
                 "full_song_analysis": True,
@@ -95,7 +154,7 @@ async def search_songs(query: str, limit: int = 10):
 
     try:
         youtube = get_youtube_service()
-        videos = youtube.search_music(query, limit)
+        videos = await youtube.search_music_async(query, limit)
 
         return {
             "success": True,
@@ -119,7 +178,7 @@ async def get_video(video_id: str):
     """
     try:
         youtube = get_youtube_service()
-        video = youtube.get_video(video_id)
+        video = await youtube.get_video_async(video_id)
 
         if not video:
             raise HTTPException(status_code=404, detail="動画が見つかりません")
@@ -134,92 +193,191 @@ async def get_video(video_id: str):
         raise HTTPException(status_code=500, detail=f"取得エラー: {str(e)}")
 
 
-async def analyze_with_progress(video_id: str, generate_ai_analysis: bool = True) -> AsyncGenerator[str, None]:
+@router.get("/videos")
+async def get_videos(ids: str):
     """
-    解析を実行し、進捗をSSEでストリーミング
+    複数の動画詳細をまとめて取得（一覧ページ用）
+
+    Args:
+        ids: YouTubeの動画ID（カンマ区切り、最大100件）
     """
-    audio_path = None
-    midi_path = None
+    video_ids = [video_id.strip() for video_id in ids.split(",") if video_id.strip()]
+    if not video_ids:
+        raise HTTPException(status_code=400, detail="動画IDを指定してください")
+    if len(video_ids) > 100:
+        raise HTTPException(status_code=400, detail="動画IDは100件まで指定できます")
 
-    def send_event(stage: str, progress: int, message: str, data: dict = None):
-        event_data = {
-            "stage": stage,
-            "progress": progress,
-            "message": message,
+    try:
+        youtube = get_youtube_service()
+        videos = await youtube.get_videos_async(video_ids)
+
+        return {
+            "success": True,
+            "data": {
+                "total": len(videos),
+                "results": videos,
+            }
         }
-        if data:
-            event_data["data"] = data
-        return f"data: {json.dumps(event_data, ensure_ascii=False)}\n\n"
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"取得エラー: {str(e)}")
+
+
+def _event(stage: str, progress: int, message: str, data: dict = None, status_code: int = None) -> dict:
+    """進捗イベントを生成"""
+    event = {
+        "stage": stage,
+        "progress": progress,
+        "message": message,
+    }
+    if data:
+        event["data"] = data
+    if status_code:
+        event["status_code"] = status_code
+    return event
+
+
+def _format_sse(event: dict) -> str:
+    """進捗イベントをSSE形式に変換"""
+    event = {k: v for k, v in event.items() if k != "status_code"}
+    return f"data: {json.dumps(event, ensure_ascii=False)}\n\n"
+
+
+def _raise_for_error(event: Optional[dict]) -> dict:
+    """最終イベントがエラーならHTTPExceptionに変換し、結果データを返す"""
+    if event is None:
+        raise HTTPException(status_code=500, detail="解析エラー: 結果がありません")
+    if event["stage"] == "error":
+        raise HTTPException(status_code=event.get("status_code", 500), detail=event["message"])
+    if event["stage"] != "complete":
+        raise HTTPException(status_code=500, detail="解析エラー: 解析が完了しませんでした")
+    return event["data"]
+
+
+async def _iterate_in_thread(iterator) -> AsyncGenerator:
+    """同期ジェネレータをスレッドで1件ずつ進める（イベントループを止めない）"""
+    done = object()
+    while True:
+        item = await run_in_thread(next, iterator, done)
+        if item is done:
+            return
+        yield item
+
+
+async def _single_track_pipeline(
+    video_id: str,
+    generate_ai_analysis: bool,
+    cache_params: dict,
+    section: Optional[tuple[float, Optional[float]]] = None,
+    chords_only: bool = False,
+) -> AsyncGenerator[dict, None]:
+    """
+    フル楽曲解析パイプライン（yt-dlp → Basic Pitch → コード認識 → AI解説）
+
+    section を指定した場合はその区間だけをダウンロード・解析する（ノートの時刻は曲の先頭から）
+    chords_only の場合はBasic Pitchを使わず、音声のクロマから直接コード進行だけを推定する
+    進捗イベントを順に返し、最後に complete（結果付き）または error を返す
+    """
+    audio_path = None
+    midi_path = None
 
     try:
+        # 0. キャッシュを確認（同じ動画・同じパラメータなら即座に返す）
+        cache = get_analysis_cache_service()
+        cached = await run_in_thread(cache.get, video_id, cache_params)
+        if cached:
+            yield _event("complete", 100, "解析完了（キャッシュ）", cached)
+            return
+
         # 1. YouTubeから動画情報を取得
-        yield send_event("init", 0, "動画情報を取得中...")
+        yield _event("init", 0, "動画情報を取得中...")
         await asyncio.sleep(0)
 
         youtube = get_youtube_service()
-        video = youtube.get_video(video_id)
+        video = await youtube.get_video_async(video_id)
 
         if not video:
-            yield send_event("error", 0, "動画が見つかりません")
+            yield _event("error", 0, "動画が見つかりません", status_code=404)
             return
 
         video_url = video["url"]
-        yield send_event("init", 5, f"「{video['title']}」を解析します")
+        yield _event("init", 5, f"「{video['title']}」を解析します")
         await asyncio.sleep(0)
 
         # 2. yt-dlpで音声をダウンロード（進捗付き）
         downloader = get_audio_downloader_service()
 
-        for progress_event in downloader.download_audio_with_progress(video_url):
+        async for progress_event in downloader.download_audio_with_progress_async(
+            video_url, video_id=video_id, section=section
+        ):
             stage = progress_event["stage"]
             progress = progress_event["progress"]
             message = progress_event["message"]
 
             if stage == "error":
-                yield send_event("error", 0, message)
+                yield _event("error", 0, f"音声ダウンロードエラー: {message}", status_code=500)
                 return
             elif stage == "complete":
                 audio_path = progress_event["file_path"]
-                yield send_event("download", 100, "ダウンロード完了")
+                yield _event("download", 100, "ダウンロード完了")
                 await asyncio.sleep(0)
             else:
                 # ダウンロード進捗を0-40%にマッピング
                 mapped_progress = int(progress * 0.4)
-                yield send_event("download", mapped_progress, message)
+                yield _event("download", mapped_progress, message)
                 await asyncio.sleep(0)
 
-        # 3. Basic Pitchで音声を解析（MIDI変換）
-        yield send_event("convert", 45, "音声を解析中（Basic Pitch）...")
-        await asyncio.sleep(0)
-
         magenta = get_magenta_service()
-        midi_result = magenta.audio_to_midi(audio_path)
+        # 重い処理はMagentaService内でCPUワーカーに投げられる（ここでは完了を待つだけ）
+        offset = section[0] if section else 0.0
 
-        if not midi_result["success"]:
-            yield send_event("error", 0, f"音声解析エラー: {midi_result['error']}")
-            return
+        if chords_only:
+            # 3-4. 音声から直接コード進行を推定（ビート同期クロマ + HMM）
+            yield _event("analyze", 45, "コード進行を解析中（クロマ + HMM）...")
+            await asyncio.sleep(0)
 
-        midi_path = midi_result["midi_path"]
-        notes = midi_result.get("notes", [])
-        tempo = midi_result.get("tempo", 120)
+            chords_result = await run_in_thread(magenta.audio_to_chords, audio_path, offset)
+            if not chords_result["success"]:
+                yield _event("error", 0, f"音声解析エラー: {chords_result['error']}", status_code=500)
+                return
 
-        yield send_event("convert", 70, f"音声解析完了: {len(notes)}ノート検出")
-        await asyncio.sleep(0)
+            notes = NoteArray()
+            chords = chords_result["chords"]
+            tempo = chords_result["tempo"]
+            duration = chords_result["duration"]
+        else:
+            # 3. Basic Pitchで音声を解析（MIDI変換）
+            yield _event("convert", 45, "音声を解析中（Basic Pitch）...")
+            await asyncio.sleep(0)
 
-        # 4. コード進行を抽出
-        yield send_event("analyze", 75, "コード進行を抽出中...")
-        await asyncio.sleep(0)
+            midi_result = await run_in_thread(magenta.audio_to_midi, audio_path, offset)
+
+            if not midi_result["success"]:
+                yield _event("error", 0, f"音声解析エラー: {midi_result['error']}", status_code=500)
+                return
+
+            midi_path = midi_result["midi_path"]
+            notes = as_note_array(midi_result.get("notes", []))
+            tempo = midi_result.get("tempo", 120)
+
+            yield _event("convert", 70, f"音声解析完了: {len(notes)}ノート検出")
+            await asyncio.sleep(0)
+
+            # 4. コード進行を抽出
+            yield _event("analyze", 75, "コード進行を抽出中...")
+            await asyncio.sleep(0)
 
-        chords_data = magenta.extract_chords_from_notes(notes)
-        chords = [{"time": c["time"], "chord": c["chord"]} for c in chords_data]
+            chords_data = await run_in_thread(magenta.extract_chords_from_notes, notes)
+            chords = [{"time": c["time"], "chord": c["chord"]} for c in chords_data]
+            duration = notes.end_time
 
-        yield send_event("analyze", 85, f"{len(chords)}個のコードを検出")
+        yield _event("analyze", 85, f"{len(chords)}個のコードを検出")
         await asyncio.sleep(0)
 
         # 5. AI解説生成（オプション）
         analysis_text = None
+        ai_failed = False
         if generate_ai_analysis and chords:
-            yield send_event("ai", 90, "AI解説を生成中...")
+            yield _event("ai", 90, "AI解説を生成中...")
             await asyncio.sleep(0)
             try:
                 gemini = get_gemini_service()
@@ -235,44 +393,45 @@ async def analyze_with_progress(video_id: str, generate_ai_analysis: bool = True
                 )
             except Exception as e:
                 analysis_text = f"AI解説の生成に失敗しました: {str(e)}"
+                ai_failed = True
 
-        yield send_event("ai", 95, "AI解説完了")
+        yield _event("ai", 95, "AI解説完了")
         await asyncio.sleep(0)
 
-        # 6. 曲の長さを計算
-        duration = max((n.get("end", 0) for n in notes), default=0) if notes else 0
-
-        # 7. 結果を送信（最初の500ノートのみ）
-        notes_for_response = [
-            {"pitch": n["pitch"], "start": n["start"], "end": n["end"], "velocity": n.get("velocity", 80)}
-            for n in notes[:500]
-        ]
-        result = {
-            "video_id": video_id,
-            "title": video["title"],
-            "channel": video["channel"],
-            "thumbnail": video.get("thumbnail"),
-            "url": video["url"],
-            "tempo": tempo,
-            "duration": round(duration, 2),
-            "notes_count": len(notes),
-            "notes": notes_for_response,
-            "chords": chords[:50],
-            "analysis_text": analysis_text,
-        }
+        # 6. 結果を送信（最初の500ノートのみ）
+        notes_for_response = notes[:500].to_dicts(confidence=False)
+        result = AnalysisResult(
+            video_id=video_id,
+            title=video["title"],
+            channel=video["channel"],
+            thumbnail=video.get("thumbnail"),
+            url=video["url"],
+            start=section[0] if section else None,
+            end=section[1] if section else None,
+            chords_only=chords_only,
+            tempo=tempo,
+            duration=round(duration, 2),
+            notes_count=len(notes),
+            notes=notes_for_response,
+            chords=chords[:50],
+            analysis_text=analysis_text,
+        ).model_dump()
 
-        yield send_event("complete", 100, "解析完了", result)
-        await asyncio.sleep(0)
+        # AI解説が失敗した結果はキャッシュしない（次回再生成させる）
+        if not ai_failed:
+            await run_in_thread(cache.set, video_id, cache_params, result)
+
+        yield _event("complete", 100, "解析完了", result)
 
     except Exception as e:
-        yield send_event("error", 0, f"解析エラー: {str(e)}")
+        yield _event("error", 0, f"解析エラー: {str(e)}", status_code=500)
 
     finally:
         # クリーンアップ
         try:
             if audio_path:
                 downloader = get_audio_downloader_service()
-                downloader.cleanup(audio_path)
+                downloader.release(audio_path)
             if midi_path:
                 magenta = get_magenta_service()
                 magenta.cleanup(midi_path)
@@ -280,6 +439,42 @@ async def analyze_with_progress(video_id: str, generate_ai_analysis: bool = True
             pass
 
 
+def _join_single_track(
+    video_id: str,
+    generate_ai_analysis: bool,
+    section: Optional[tuple[float, Optional[float]]] = None,
+    chords_only: bool = False,
+) -> Flight:
+    """
+    フル楽曲解析を開始（同じ動画・同じパラメータの解析が実行中なら合流）
+    """
+    cache_params = _single_track_cache_params(
+        get_magenta_service(), generate_ai_analysis, section, chords_only
+    )
+    key = get_analysis_cache_service().make_key(video_id, cache_params)
+    return get_single_flight().join(
+        key,
+        lambda: _single_track_pipeline(video_id, generate_ai_analysis, cache_params, section, chords_only),
+    )
+
+
+async def analyze_with_progress(
+    video_id: str,
+    generate_ai_analysis: bool = True,
+    section: Optional[tuple[float, Optional[float]]] = None,
+    chords_only: bool = False,
+) -> AsyncGenerator[str, None]:
+    """
+    解析を実行し、進捗をSSEでストリーミング
+    """
+    try:
+        flight = _join_single_track(video_id, generate_ai_analysis, section, chords_only)
+        async for event in flight.subscribe():
+            yield _format_sse(event)
+    except Exception as e:
+        yield _format_sse(_event("error", 0, f"解析エラー: {str(e)}"))
+
+
 async def simple_sse_test():
     """シンプルなSSEテスト"""
     for i in range(5):
@@ -303,19 +498,29 @@ async def sse_test():
 
 
 @router.get("/analyze/{video_id}/stream")
-async def analyze_video_stream(video_id: str, generate_ai_analysis: bool = True):
+async def analyze_video_stream(
+    video_id: str,
+    generate_ai_analysis: bool = True,
+    start: Optional[float] = None,
+    end: Optional[float] = None,
+    chords_only: bool = False,
+):
     """
     曲を解析する（SSEストリーミング）
 
     Args:
         video_id: YouTubeの動画ID
         generate_ai_analysis: AI解説を生成するか（デフォルト: True）
+        start: 解析する区間の開始（秒）。省略時は曲の先頭から
+        end: 解析する区間の終了（秒）。省略時は曲の最後まで
+        chords_only: コード進行だけを高速に解析するか（ノート変換を行わない。デフォルト: False）
 
     Returns:
         Server-Sent Events ストリーム
     """
+    section = _resolve_section(start, end)
     return StreamingResponse(
-        analyze_with_progress(video_id, generate_ai_analysis),
+        analyze_with_progress(video_id, generate_ai_analysis, section, chords_only),
         media_type="text/event-stream",
         headers={
             "Cache-Control": "no-cache",
@@ -326,95 +531,34 @@ async def analyze_video_stream(video_id: str, generate_ai_analysis: bool = True)
 
 
 @router.get("/analyze/{video_id}")
-async def analyze_video(video_id: str, generate_ai_analysis: bool = True):
+async def analyze_video(
+    video_id: str,
+    generate_ai_analysis: bool = True,
+    start: Optional[float] = None,
+    end: Optional[float] = None,
+    chords_only: bool = False,
+):
     """
     曲を解析する（yt-dlp → Basic Pitch → コード認識 → AI解説）
 
+    同じ動画の解析（SSE含む）が実行中の場合はその結果を待つ。
+    start / end を指定した場合はその区間だけをダウンロードして解析する
+
     Args:
         video_id: YouTubeの動画ID
         generate_ai_analysis: AI解説を生成するか（デフォルト: True）
+        start: 解析する区間の開始（秒）。省略時は曲の先頭から
+        end: 解析する区間の終了（秒）。省略時は曲の最後まで
+        chords_only: コード進行だけを高速に解析するか（ノート変換を行わない。デフォルト: False）
     """
-    audio_path = None
-    midi_path = None
-
+    section = _resolve_section(start, end)
     try:
-        # 1. YouTubeから動画情報を取得
-        youtube = get_youtube_service()
-        video = youtube.get_video(video_id)
-
-        if not video:
-            raise HTTPException(status_code=404, detail="動画が見つかりません")
-
-        video_url = video["url"]
-
-        # 2. yt-dlpで音声をダウンロード
-        downloader = get_audio_downloader_service()
-        download_result = downloader.download_audio(video_url)
-
-        if not download_result["success"]:
-            raise HTTPException(
-                status_code=500,
-                detail=f"音声ダウンロードエラー: {download_result['error']}"
-            )
-
-        audio_path = download_result["file_path"]
-
-        # 3. Basic Pitchで音声を解析
-        magenta = get_magenta_service()
-        midi_result = magenta.audio_to_midi(audio_path)
-
-        if not midi_result["success"]:
-            raise HTTPException(
-                status_code=500,
-                detail=f"音声解析エラー: {midi_result['error']}"
-            )
-
-        midi_path = midi_result["midi_path"]
-        notes = midi_result.get("notes", [])
-        tempo = midi_result.get("tempo", 120)
-
-        # 4. コード進行を抽出
-        chords_data = magenta.extract_chords_from_notes(notes)
-        chords = [ChordInfo(time=c["time"], chord=c["chord"]) for c in chords_data]
-
-        # 5. AI解説生成（オプション）
-        analysis_text = None
-        if generate_ai_analysis and chords:
-            try:
-                gemini = get_gemini_service()
-                chord_list = [{"chord": c.chord, "time": c.time} for c in chords[:20]]
-                analysis_text = await gemini.generate_song_analysis(
-                    track_name=video["title"],
-                    artist=video["channel"],
-                    key="",
-                    mode="",
-                    tempo=tempo,
-                    chords=chord_list,
-                    notes_count=len(notes),
-                )
-            except Exception as e:
-                analysis_text = f"AI解説の生成に失敗しました: {str(e)}"
-
-        # 曲の長さを計算
-        duration = max((n.get("end", 0) for n in notes), default=0) if notes else 0
-
-        # 結果を返す
-        result = AnalysisResult(
-            video_id=video_id,
-            title=video["title"],
-            channel=video["channel"],
-            thumbnail=video.get("thumbnail"),
-            url=video["url"],
-            tempo=tempo,
-            duration=round(duration, 2),
-            notes_count=len(notes),
-            chords=chords[:50],
-            analysis_text=analysis_text,
-        )
+        flight = _join_single_track(video_id, generate_ai_analysis, section, chords_only)
+        result = _raise_for_error(await flight.result())
 
         return {
             "success": True,
-            "data": result,
+            "data": AnalysisResult(**result),
         }
 
     except HTTPException:
@@ -422,18 +566,6 @@ async def analyze_video(video_id: str, generate_ai_analysis: bool = True):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"解析エラー: {str(e)}")
 
-    finally:
-        # 一時ファイルをクリーンアップ
-        try:
-            if audio_path:
-                downloader = get_audio_downloader_service()
-                downloader.cleanup(audio_path)
-            if midi_path:
-                magenta = get_magenta_service()
-                magenta.cleanup(midi_path)
-        except Exception:
-            pass
-
 
 class TrackNotes(BaseModel):
     """トラックのノート情報"""
@@ -442,6 +574,15 @@ class TrackNotes(BaseModel):
     error: Optional[str] = None
 
 
+def _track_notes(track_data: dict) -> TrackNotes:
+    """MagentaServiceのトラックの変換結果を応答用に変換"""
+    return TrackNotes(
+        notes=as_note_array(track_data.get("notes", [])).to_dicts(),
+        midi_path=track_data.get("midi_path"),
+        error=track_data.get("error"),
+    )
+
+
 class FourTrackResult(BaseModel):
     """4トラック解析結果"""
     video_id: str
@@ -449,74 +590,136 @@ class FourTrackResult(BaseModel):
     channel: str
     thumbnail: Optional[str] = None
     url: Optional[str] = None
+    start: Optional[float] = None
+    end: Optional[float] = None
     tempo: int = 120
     tracks: dict[str, TrackNotes] = {}
     chords: list[ChordInfo] = []
     analysis_text: Optional[str] = None
 
 
-@router.get("/analyze-4tracks/{video_id}")
-async def analyze_4tracks(video_id: str):
+async def _four_track_pipeline(
+    video_id: str,
+    cache_params: dict,
+    profile: Optional[str] = None,
+    section: Optional[tuple[float, Optional[float]]] = None,
+) -> AsyncGenerator[dict, None]:
     """
-    曲を4トラックに分離して解析
-
-    Demucsで楽器分離 → 各パートをMIDI変換 → コード進行解説
+    4トラック解析パイプライン（yt-dlp → Demucs → 各パートMIDI変換 → コード認識 → AI解説）
 
-    Args:
-        video_id: YouTubeの動画ID
+    section を指定した場合はその区間だけをダウンロード・分離・変換する（ノートの時刻は曲の先頭から）
 
-    Returns:
-        4トラック（drums, bass, other, vocals）のノート情報とコード解説
+    進捗イベントを順に返し、最後に complete（結果付き）または error を返す
     """
     audio_path = None
 
     try:
+        # 0. キャッシュを確認（同じ動画・同じパラメータなら即座に返す）
+        cache = get_analysis_cache_service()
+        cached = await run_in_thread(cache.get, video_id, cache_params)
+        if cached:
+            yield _event("complete", 100, "解析完了（キャッシュ）", cached)
+            return
+
         # 1. YouTubeから動画情報を取得
+        yield _event("init", 0, "動画情報を取得中...")
+        await asyncio.sleep(0)
+
         youtube = get_youtube_service()
-        video = youtube.get_video(video_id)
+        video = await youtube.get_video_async(video_id)
 
         if not video:
-            raise HTTPException(status_code=404, detail="動画が見つかりません")
+            yield _event("error", 0, "動画が見つかりません", status_code=404)
+            return
 
         video_url = video["url"]
 
-        # 2. yt-dlpで音声をダウンロード
+        # 2. yt-dlpで音声をダウンロード（進捗付き）
         downloader = get_audio_downloader_service()
-        download_result = downloader.download_audio(video_url)
 
-        if not download_result["success"]:
-            raise HTTPException(
-                status_code=500,
-                detail=f"音声ダウンロードエラー: {download_result['error']}"
-            )
+        async for progress_event in downloader.download_audio_with_progress_async(
+            video_url, video_id=video_id, section=section
+        ):
+            stage = progress_event["stage"]
+            progress = progress_event["progress"]
+            message = progress_event["message"]
 
-        audio_path = download_result["file_path"]
+            if stage == "error":
+                yield _event("error", 0, f"音声ダウンロードエラー: {message}", status_code=500)
+                return
+            elif stage == "complete":
+                audio_path = progress_event["file_path"]
+                yield _event("download", 20, "ダウンロード完了")
+                await asyncio.sleep(0)
+            else:
+                # ダウンロード進捗を0-20%にマッピング
+                mapped_progress = int(progress * 0.2)
+                yield _event("download", mapped_progress, message)
+                await asyncio.sleep(0)
 
-        # 3. 4トラック分離 → MIDI変換
+        # 3. 4トラック分離 → MIDI変換（変換が終わったトラックから順に返す）
         magenta = get_magenta_service()
-        result = magenta.audio_to_4tracks(audio_path)
+        result = None
+        track_results: dict[str, TrackNotes] = {}
 
-        if not result["success"]:
-            raise HTTPException(
-                status_code=500,
-                detail=f"4トラック変換エラー: {result['error']}"
+        # 重い処理はMagentaService内でCPUワーカーに投げられる（ここでは進捗を中継するだけ）
+        async for progress_event in _iterate_in_thread(
+            magenta.audio_to_4tracks_with_progress(
+                audio_path, profile=profile, offset=section[0] if section else 0.0
             )
+        ):
+            stage = progress_event["stage"]
+            # 分離・変換の進捗を20-85%にマッピング
+            mapped_progress = 20 + int(progress_event["progress"] * 0.65)
+
+            if stage in ("complete", "error"):
+                result = progress_event["result"]
+            elif stage == "track":
+                # 応答用のdictへの変換はトラックごとに1回だけ（最終結果でも使う）
+                track_notes = _track_notes(progress_event["data"])
+                track_results[progress_event["track"]] = track_notes
+                yield _event(
+                    "track",
+                    mapped_progress,
+                    progress_event["message"],
+                    {
+                        "track": progress_event["track"],
+                        "tempo": progress_event["tempo"],
+                        **track_notes.model_dump(),
+                    },
+                )
+                await asyncio.sleep(0)
+            else:
+                yield _event("separate", mapped_progress, progress_event["message"])
+                await asyncio.sleep(0)
+
+        if not result or not result["success"]:
+            error = result["error"] if result else "結果がありません"
+            yield _event("error", 0, f"4トラック変換エラー: {error}", status_code=500)
+            return
 
         tracks = result["tracks"]
         tempo = result["tempo"]
 
         # 4. コード進行を抽出（ベース + other から）
-        all_notes = []
-        for track_type in ["bass", "other"]:
-            if track_type in tracks and tracks[track_type].get("notes"):
-                all_notes.extend(tracks[track_type]["notes"])
+        yield _event("analyze", 85, "コード進行を抽出中...")
+        await asyncio.sleep(0)
 
-        chords_data = magenta.extract_chords_from_notes(all_notes)
+        all_notes = NoteArray.concatenate(
+            as_note_array(tracks[track_type].get("notes", []))
+            for track_type in ["bass", "other"]
+            if track_type in tracks
+        )
+
+        chords_data = await run_in_thread(magenta.extract_chords_from_notes, all_notes)
         chords = [ChordInfo(time=c["time"], chord=c["chord"]) for c in chords_data]
 
         # 5. AI解説生成（コード進行の解説）
         analysis_text = None
+        ai_failed = False
         if chords:
+            yield _event("ai", 90, "AI解説を生成中...")
+            await asyncio.sleep(0)
             try:
                 gemini = get_gemini_service()
                 chord_list = [{"chord": c.chord, "time": c.time} for c in chords[:20]]
@@ -531,46 +734,274 @@ async def analyze_4tracks(video_id: str):
                 )
             except Exception as e:
                 analysis_text = f"AI解説の生成に失敗しました: {str(e)}"
+                ai_failed = True
 
         # 結果を返す
-        track_results = {}
-        for track_type, track_data in tracks.items():
-            track_results[track_type] = TrackNotes(
-                notes=track_data.get("notes", []),
-                midi_path=track_data.get("midi_path"),
-                error=track_data.get("error"),
-            )
-
-        return {
-            "success": True,
-            "data": FourTrackResult(
-                video_id=video_id,
-                title=video["title"],
-                channel=video["channel"],
-                thumbnail=video.get("thumbnail"),
-                url=video["url"],
-                tempo=tempo,
-                tracks=track_results,
-                chords=chords[:50],
-                analysis_text=analysis_text,
-            ),
+        track_results = {
+            track_type: track_results.get(track_type) or _track_notes(track_data)
+            for track_type, track_data in tracks.items()
         }
 
-    except HTTPException:
-        raise
+        four_track_result = FourTrackResult(
+            video_id=video_id,
+            title=video["title"],
+            channel=video["channel"],
+            thumbnail=video.get("thumbnail"),
+            url=video["url"],
+            start=section[0] if section else None,
+            end=section[1] if section else None,
+            tempo=tempo,
+            tracks=track_results,
+            chords=chords[:50],
+            analysis_text=analysis_text,
+        ).model_dump()
+
+        # AI解説が失敗した結果はキャッシュしない（次回再生成させる）
+        if not ai_failed:
+            await run_in_thread(cache.set, video_id, cache_params, four_track_result)
+
+        yield _event("complete", 100, "解析完了", four_track_result)
+
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"解析エラー: {str(e)}")
+        yield _event("error", 0, f"解析エラー: {str(e)}", status_code=500)
 
     finally:
-        # 一時ファイルをクリーンアップ
+        # ダウンロードした音声を解放（キャッシュしていないファイルは削除）
         try:
             if audio_path:
                 downloader = get_audio_downloader_service()
-                downloader.cleanup(audio_path)
+                downloader.release(audio_path)
         except Exception:
             pass
 
 
+def _resolve_profile(profile: Optional[str]) -> str:
+    """
+    分離プロファイル名を検証（Noneなら既定のプロファイル）
+
+    Raises:
+        HTTPException: 存在しないプロファイル名の場合（400）
+    """
+    try:
+        return get_audio_separator_service().resolve_profile(profile)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+def _join_four_track(
+    video_id: str, profile: str, section: Optional[tuple[float, Optional[float]]] = None
+) -> Flight:
+    """
+    4トラック解析を開始（同じ動画・同じパラメータの解析が実行中なら合流）
+    """
+    cache_params = get_magenta_service().get_pipeline_params("4tracks", profile)
+    if section is not None:
+        cache_params["section"] = list(section)
+    key = get_analysis_cache_service().make_key(video_id, cache_params)
+    return get_single_flight().join(
+        key,
+        lambda: _four_track_pipeline(video_id, cache_params, profile, section),
+    )
+
+
+async def analyze_4tracks_with_progress(
+    video_id: str, profile: str, section: Optional[tuple[float, Optional[float]]] = None
+) -> AsyncGenerator[str, None]:
+    """
+    4トラック解析を実行し、進捗とトラックごとの結果をSSEでストリーミング
+    """
+    try:
+        flight = _join_four_track(video_id, profile, section)
+        async for event in flight.subscribe():
+            yield _format_sse(event)
+    except Exception as e:
+        yield _format_sse(_event("error", 0, f"解析エラー: {str(e)}"))
+
+
+@router.get("/analyze-4tracks/{video_id}/stream")
+async def analyze_4tracks_stream(
+    video_id: str,
+    profile: Optional[str] = None,
+    start: Optional[float] = None,
+    end: Optional[float] = None,
+):
+    """
+    曲を4トラックに分離して解析（SSEストリーミング）
+
+    ダウンロード・分離・各トラック変換の進捗を送信し、
+    各トラックのノートは変換が終わった時点で "track" イベントとして送信する
+
+    Args:
+        video_id: YouTubeの動画ID
+        profile: 分離プロファイル（fast / balanced / best。省略時は ANISONG_DEMUCS_PROFILE）
+        start: 解析する区間の開始（秒）。省略時は曲の先頭から
+        end: 解析する区間の終了（秒）。省略時は曲の最後まで
+
+    Returns:
+        Server-Sent Events ストリーム
+    """
+    profile = _resolve_profile(profile)
+    section = _resolve_section(start, end)
+    return StreamingResponse(
+        analyze_4tracks_with_progress(video_id, profile, section),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "Connection": "keep-alive",
+            "X-Accel-Buffering": "no",
+        }
+    )
+
+
+@router.get("/analyze-4tracks/{video_id}")
+async def analyze_4tracks(
+    video_id: str,
+    profile: Optional[str] = None,
+    start: Optional[float] = None,
+    end: Optional[float] = None,
+):
+    """
+    曲を4トラックに分離して解析
+
+    Demucsで楽器分離 → 各パートをMIDI変換 → コード進行解説
+    同じ動画の解析が実行中の場合はその結果を待つ
+
+    Args:
+        video_id: YouTubeの動画ID
+        profile: 分離プロファイル（fast / balanced / best。省略時は ANISONG_DEMUCS_PROFILE）
+        start: 解析する区間の開始（秒）。省略時は曲の先頭から
+        end: 解析する区間の終了（秒）。省略時は曲の最後まで
+
+    Returns:
+        4トラック（drums, bass, other, vocals）のノート情報とコード解説
+    """
+    profile = _resolve_profile(profile)
+    section = _resolve_section(start, end)
+    try:
+        flight = _join_four_track(video_id, profile, section)
+        result = _raise_for_error(await flight.result())
+
+        return {
+            "success": True,
+            "data": FourTrackResult(**result),
+        }
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"解析エラー: {str(e)}")
+
+
+# --- バックグラウンドジョブAPI ---
+
+def _submit_job(kind: str, video_id: str, flight_factory) -> dict:
+    """ジョブを投入してジョブ情報を返す"""
+    try:
+        job = get_job_manager().submit(
+            kind,
+            video_id,
+            lambda: flight_factory().subscribe(),
+        )
+    except JobQueueFullError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
+    return {
+        "success": True,
+        "data": job.to_dict(),
+    }
+
+
+@router.post("/jobs/analyze/{video_id}", status_code=202)
+async def submit_analyze_job(
+    video_id: str,
+    generate_ai_analysis: bool = True,
+    start: Optional[float] = None,
+    end: Optional[float] = None,
+    chords_only: bool = False,
+):
+    """
+    フル楽曲解析をジョブとして投入（すぐにジョブIDを返す）
+
+    Args:
+        video_id: YouTubeの動画ID
+        generate_ai_analysis: AI解説を生成するか（デフォルト: True）
+        start: 解析する区間の開始（秒）。省略時は曲の先頭から
+        end: 解析する区間の終了（秒）。省略時は曲の最後まで
+        chords_only: コード進行だけを高速に解析するか（ノート変換を行わない。デフォルト: False）
+    """
+    section = _resolve_section(start, end)
+    return _submit_job(
+        "analyze",
+        video_id,
+        lambda: _join_single_track(video_id, generate_ai_analysis, section, chords_only),
+    )
+
+
+@router.post("/jobs/analyze-4tracks/{video_id}", status_code=202)
+async def submit_analyze_4tracks_job(
+    video_id: str,
+    profile: Optional[str] = None,
+    start: Optional[float] = None,
+    end: Optional[float] = None,
+):
+    """
+    4トラック解析をジョブとして投入（すぐにジョブIDを返す）
+
+    Args:
+        video_id: YouTubeの動画ID
+        profile: 分離プロファイル（fast / balanced / best。省略時は ANISONG_DEMUCS_PROFILE）
+        start: 解析する区間の開始（秒）。省略時は曲の先頭から
+        end: 解析する区間の終了（秒）。省略時は曲の最後まで
+    """
+    profile = _resolve_profile(profile)
+    section = _resolve_section(start, end)
+    return _submit_job(
+        "analyze-4tracks",
+        video_id,
+        lambda: _join_four_track(video_id, profile, section),
+    )
+
+
+@router.get("/jobs/{job_id}")
+async def get_job_status(job_id: str):
+    """
+    ジョブの状態（ステージ・進捗率）を取得
+
+    Args:
+        job_id: ジョブID
+    """
+    job = get_job_manager().get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="ジョブが見つかりません（期限切れの可能性があります）")
+
+    return {
+        "success": True,
+        "data": job.to_dict(),
+    }
+
+
+@router.get("/jobs/{job_id}/result")
+async def get_job_result(job_id: str):
+    """
+    完了したジョブの解析結果を取得
+
+    Args:
+        job_id: ジョブID
+    """
+    job = get_job_manager().get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="ジョブが見つかりません（期限切れの可能性があります）")
+    if job.status == "failed":
+        raise HTTPException(status_code=job.status_code or 500, detail=job.error)
+    if job.status != "completed":
+        raise HTTPException(status_code=409, detail=f"解析が完了していません（{job.progress}%）")
+
+    return {
+        "success": True,
+        "data": job.result,
+    }
+
+
 # --- 範囲指定解説API ---
 
 class SectionAnalysisRequest(BaseModel):
@@ -11,6 +11,11 @@ __all__ = [
     "get_gemini_service",
     "get_audio_separator_service",
     "get_basic_pitch_service",
+    "get_stem_cache_service",
+    "get_analysis_cache_service",
+    "get_single_flight",
+    "get_job_manager",
+    "get_warmup_service",
 ]
 
 
@@ -48,3 +53,33 @@ def get_basic_pitch_service():
     """BasicPitchServiceを遅延インポートして取得"""
     from .basic_pitch_service import get_basic_pitch_service as _get_basic_pitch_service
     return _get_basic_pitch_service()
+
+
+def get_stem_cache_service():
+    """StemCacheServiceを遅延インポートして取得"""
+    from .stem_cache import get_stem_cache_service as _get_stem_cache_service
+    return _get_stem_cache_service()
+
+
+def get_analysis_cache_service():
+    """AnalysisCacheServiceを遅延インポートして取得"""
+    from .analysis_cache import get_analysis_cache_service as _get_analysis_cache_service
+    return _get_analysis_cache_service()
+
+
+def get_single_flight():
+    """SingleFlightを遅延インポートして取得"""
+    from .single_flight import get_single_flight as _get_single_flight
+    return _get_single_flight()
+
+
+def get_job_manager():
+    """JobManagerを遅延インポートして取得"""
+    from .job_queue import get_job_manager as _get_job_manager
+    return _get_job_manager()
+
+
+def get_warmup_service():
+    """WarmupServiceを遅延インポートして取得"""
+    from .warmup import get_warmup_service as _get_warmup_service
+    return _get_warmup_service()
@@ -0,0 +1,226 @@
+"""
+解析結果キャッシュサービス
+
+video_id + パイプラインパラメータのハッシュをキーに解析結果を保存
+- メモリ: LRU（直近に使った結果を保持）
+- ディスク: JSONファイル（再起動後も再利用）。容量が ANISONG_CACHE_MAX_MB を超えたら
+  最後に使った時刻が古いものから削除する
+
+パラメータ（しきい値・モデル等）が変わるとハッシュが変わるため、
+古い結果は自動的に使われなくなる
+"""
+import hashlib
+import json
+import os
+import re
+import tempfile
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional
+
+
+class AnalysisCacheService:
+    """ディスク永続化 + メモリLRUの解析結果キャッシュ"""
+
+    def __init__(self):
+        # キャッシュディレクトリ（共有ディレクトリを優先）
+        custom_dir = os.getenv("ANISONG_CACHE_DIR")
+        if custom_dir:
+            self.cache_dir = Path(custom_dir)
+        else:
+            self.cache_dir = Path(tempfile.gettempdir()) / "anisong_cache"
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+        # メモリに保持する最大件数
+        self.max_memory_entries = int(os.getenv("ANISONG_CACHE_MEMORY_ENTRIES", "64"))
+        # ディスクキャッシュの最大容量（MB）。0ならディスクに保存しない
+        self.max_disk_bytes = int(float(os.getenv("ANISONG_CACHE_MAX_MB", "512")) * 1024 * 1024)
+
+        self._memory: OrderedDict[str, dict] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def make_key(self, video_id: str, params: dict) -> str:
+        """
+        キャッシュキーを生成
+
+        Args:
+            video_id: YouTubeの動画ID
+            params: パイプラインパラメータ
+
+        Returns:
+            "{video_id}_{パラメータハッシュ}" 形式のキー
+        """
+        params_json = json.dumps(params, sort_keys=True, ensure_ascii=False, default=str)
+        digest = hashlib.sha256(params_json.encode("utf-8")).hexdigest()[:16]
+        return f"{self._safe_id(video_id)}_{digest}"
+
+    def get(self, video_id: str, params: dict) -> Optional[dict]:
+        """
+        キャッシュから解析結果を取得
+
+        Args:
+            video_id: YouTubeの動画ID
+            params: パイプラインパラメータ
+
+        Returns:
+            解析結果（キャッシュがない場合はNone）
+        """
+        key = self.make_key(video_id, params)
+
+        path = self._path_for(key)
+        with self._lock:
+            result = self._memory.get(key)
+            if result is not None:
+                self._memory.move_to_end(key)
+        if result is not None:
+            self._touch(path)
+            return result
+
+        if self.max_disk_bytes <= 0:
+            return None
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                result = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, json.JSONDecodeError) as e:
+            print(f"[AnalysisCache] Broken cache entry {path.name}: {e}")
+            self._unlink(path)
+            return None
+
+        self._touch(path)
+        self._remember(key, result)
+        return result
+
+    def set(self, video_id: str, params: dict, result: dict) -> None:
+        """
+        解析結果をキャッシュに保存
+
+        Args:
+            video_id: YouTubeの動画ID
+            params: パイプラインパラメータ
+            result: 解析結果（JSONシリアライズ可能なdict）
+        """
+        key = self.make_key(video_id, params)
+        self._remember(key, result)
+        if self.max_disk_bytes <= 0:
+            return
+
+        path = self._path_for(key)
+        tmp_path = None
+        try:
+            # 一時ファイルに書いてからリネーム（書き込み途中のファイルを読ませない）
+            fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(result, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            print(f"[AnalysisCache] Failed to write {path.name}: {e}")
+            if tmp_path:
+                self._unlink(Path(tmp_path))
+            return
+        self.evict()
+
+    def evict(self) -> int:
+        """
+        ディスクの容量の上限を超えていれば、最後に使った時刻が古いエントリから削除
+
+        Returns:
+            削除したエントリ数
+        """
+        entries = []
+        total = 0
+        for path in self.cache_dir.glob("*.json"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                # 他のワーカーが削除中
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+
+        count = 0
+        for _, size, path in sorted(entries):
+            if total <= self.max_disk_bytes:
+                break
+            if self._unlink(path):
+                count += 1
+            total -= size
+        return count
+
+    def invalidate(self, video_id: str) -> int:
+        """
+        指定した動画のキャッシュをすべて削除
+
+        Returns:
+            削除したエントリ数
+        """
+        prefix = f"{self._safe_id(video_id)}_"
+        with self._lock:
+            for key in [k for k in self._memory if k.startswith(prefix)]:
+                del self._memory[key]
+
+        count = 0
+        for path in self.cache_dir.glob(f"{prefix}*.json"):
+            # video_idが別IDの接頭辞になっている場合を除外
+            if len(path.stem) - len(prefix) == 16 and self._unlink(path):
+                count += 1
+        return count
+
+    def clear(self) -> int:
+        """
+        キャッシュをすべて削除
+
+        Returns:
+            削除したファイル数
+        """
+        with self._lock:
+            self._memory.clear()
+
+        count = 0
+        for path in self.cache_dir.glob("*.json"):
+            if self._unlink(path):
+                count += 1
+        return count
+
+    def _remember(self, key: str, result: dict) -> None:
+        """メモリLRUに追加（上限を超えたら古いものから破棄）"""
+        with self._lock:
+            self._memory[key] = result
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_memory_entries:
+                self._memory.popitem(last=False)
+
+    def _safe_id(self, video_id: str) -> str:
+        """ファイル名に使えない文字を除去（YouTubeのIDは英数字と-_のみ）"""
+        return re.sub(r"[^A-Za-z0-9_-]", "_", video_id)
+
+    def _path_for(self, key: str) -> Path:
+        return self.cache_dir / f"{key}.json"
+
+    def _touch(self, path: Path) -> None:
+        """最後に使った時刻を更新（ディスクのLRU）"""
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+    def _unlink(self, path: Path) -> bool:
+        try:
+            path.unlink()
+            return True
+        except Exception:
+            return False
+
+
+# シングルトンインスタンス
+_analysis_cache_service: Optional[AnalysisCacheService] = None
+
+
+def get_analysis_cache_service() -> AnalysisCacheService:
+    """AnalysisCacheServiceのシングルトンを取得"""
+    global _analysis_cache_service
+    if _analysis_cache_service is None:
+        _analysis_cache_service = AnalysisCacheService()
+    return _analysis_cache_service
@@ -0,0 +1,303 @@
+"""
+デコード済み音声バッファ
+
+1回の解析の中でテンポ検出・楽器分離・ノート変換がそれぞれ同じファイルを
+読み込み・リサンプルしていたため、デコード結果を1つのオブジェクトにまとめて
+各ステージに渡す
+
+- デコードは最初に使われた時に1回だけ行う
+- モノラル化・リサンプルしたビューはサンプルレートごとにキャッシュする
+
+分離したステムは SharedAudio（共有メモリ）でワーカープロセス間を受け渡し、
+WAVファイルへの書き出し・読み戻しを省く
+
+soundfileで読めない圧縮音声（YouTubeのOpus/M4Aなど）はffmpegのパイプで
+float32のまま直接NumPyにデコードする（WAVへの変換・一時ファイルを作らない）
+"""
+import subprocess
+from contextlib import contextmanager
+from multiprocessing import shared_memory
+from pathlib import Path
+from typing import Iterator, Optional, Union
+
+import numpy as np
+import librosa
+import soundfile as sf
+
+
+# 圧縮音声をffmpegでデコードする際の既定のサンプルレート（Demucsが必要とする44100Hz）
+FFMPEG_DECODE_SAMPLE_RATE = 44100
+
+
+class AudioBuffer:
+    """1回の解析で共有するデコード済み音声"""
+
+    def __init__(
+        self,
+        path: Optional[Union[str, Path]] = None,
+        samples: Optional[np.ndarray] = None,
+        sample_rate: Optional[int] = None,
+        decode_sample_rate: Optional[int] = None,
+    ):
+        """
+        Args:
+            path: 音声ファイルのパス（samplesを渡さない場合は初回アクセス時にデコード）
+            samples: デコード済みの音声 [channels, samples]（float32）
+            sample_rate: samplesのサンプルレート
+            decode_sample_rate: 圧縮音声をffmpegでデコードする際のサンプルレート
+                （使う側が必要とするレートで直接デコードする。WAV等はそのまま読む）
+        """
+        if path is None and samples is None:
+            raise ValueError("path または samples が必要です")
+        if samples is not None and sample_rate is None:
+            raise ValueError("samples を渡す場合は sample_rate が必要です")
+
+        self.path = Path(path) if path is not None else None
+        self._samples = self._to_channels_first(samples) if samples is not None else None
+        self._sample_rate = sample_rate
+        self._decode_sample_rate = decode_sample_rate or FFMPEG_DECODE_SAMPLE_RATE
+        # (sample_rate) -> モノラル波形
+        self._mono_views: dict[int, np.ndarray] = {}
+
+    @property
+    def name(self) -> str:
+        """出力ファイル名などに使う名前（ファイル名の拡張子なし部分）"""
+        return self.path.stem if self.path is not None else "audio"
+
+    @property
+    def samples(self) -> np.ndarray:
+        """元のサンプルレートの音声 [channels, samples]"""
+        if self._samples is None:
+            self._decode()
+        return self._samples
+
+    @property
+    def sample_rate(self) -> int:
+        """元のサンプルレート"""
+        if self._samples is None:
+            self._decode()
+        return self._sample_rate
+
+    @property
+    def duration(self) -> float:
+        """長さ（秒）"""
+        return self.samples.shape[1] / self.sample_rate
+
+    def mono(self, sample_rate: Optional[int] = None) -> np.ndarray:
+        """
+        モノラル化（必要ならリサンプル）した波形を取得
+
+        librosa.load(path, sr=sample_rate, mono=True) と同じ結果を返す
+
+        Args:
+            sample_rate: サンプルレート（Noneなら元のまま）
+
+        Returns:
+            モノラル波形（float32）
+        """
+        sr = sample_rate or self.sample_rate
+        if sr not in self._mono_views:
+            if self.sample_rate not in self._mono_views:
+                self._mono_views[self.sample_rate] = librosa.to_mono(self.samples)
+            if sr != self.sample_rate:
+                self._mono_views[sr] = librosa.resample(
+                    self._mono_views[self.sample_rate],
+                    orig_sr=self.sample_rate,
+                    target_sr=sr,
+                    res_type="soxr_hq",
+                )
+        return self._mono_views[sr]
+
+    def drop_views(self) -> None:
+        """モノラル化・リサンプルしたビューだけを解放（元の波形は残す）"""
+        self._mono_views.clear()
+
+    def release(self) -> None:
+        """保持している波形を解放（共有メモリを閉じる前に参照を外す）"""
+        self._samples = None
+        self._mono_views.clear()
+
+    def _decode(self) -> None:
+        """
+        ファイルをデコード
+
+        WAV/FLAC等はsoundfile、圧縮音声はffmpegのパイプ、
+        ffmpegがない環境ではlibrosa経由でデコードする
+        """
+        try:
+            data, sr = sf.read(str(self.path), dtype="float32", always_2d=True)
+            samples = data.T
+        except Exception:
+            try:
+                samples, sr = decode_with_ffmpeg(self.path, self._decode_sample_rate)
+            except FileNotFoundError:
+                if not self.path.exists():
+                    raise
+                samples, sr = librosa.load(str(self.path), sr=None, mono=False)
+        self._samples = self._to_channels_first(samples)
+        self._sample_rate = int(sr)
+
+    @staticmethod
+    def _to_channels_first(samples: np.ndarray) -> np.ndarray:
+        samples = np.asarray(samples, dtype=np.float32)
+        if samples.ndim == 1:
+            samples = samples[np.newaxis, :]
+        return np.ascontiguousarray(samples)
+
+
+class SharedAudio:
+    """
+    共有メモリ上の音声（プロセス間で受け渡すためのハンドル）
+
+    pickleされるのは名前・形状・サンプルレートだけなので、
+    プロセスプールに渡しても波形はコピーされない
+    """
+
+    def __init__(self, name: str, shape: tuple[int, int], sample_rate: int):
+        self.name = name
+        self.shape = shape
+        self.sample_rate = sample_rate
+        self._shm: Optional[shared_memory.SharedMemory] = None
+
+    @classmethod
+    def create(cls, samples: np.ndarray, sample_rate: int) -> "SharedAudio":
+        """
+        波形を共有メモリにコピーしてハンドルを作成
+
+        Args:
+            samples: 音声 [channels, samples]（1次元ならモノラル）
+            sample_rate: サンプルレート
+        """
+        samples = AudioBuffer._to_channels_first(samples)
+        shared = cls.allocate(samples.shape, sample_rate)
+        shared.write(0, samples)
+        return shared
+
+    @classmethod
+    def allocate(cls, shape: tuple[int, int], sample_rate: int) -> "SharedAudio":
+        """
+        空の共有メモリを確保（分離結果を区間ごとに書き込む場合に使う）
+
+        Args:
+            shape: [channels, samples]
+            sample_rate: サンプルレート
+        """
+        shape = (int(shape[0]), int(shape[1]))
+        size = shape[0] * shape[1] * np.dtype(np.float32).itemsize
+        shm = shared_memory.SharedMemory(create=True, size=max(1, size))
+
+        shared = cls(shm.name, shape, sample_rate)
+        shared._shm = shm
+        return shared
+
+    def write(self, offset: int, samples: np.ndarray) -> None:
+        """
+        波形を指定位置に書き込む（作成したプロセスからのみ）
+
+        Args:
+            offset: 書き込み開始位置（サンプル）
+            samples: 音声 [channels, samples]（1次元ならモノラル）
+        """
+        if self._shm is None:
+            raise RuntimeError("書き込みは共有メモリを作成したプロセスからのみ可能です")
+        samples = AudioBuffer._to_channels_first(samples)
+        view = np.ndarray(self.shape, dtype=np.float32, buffer=self._shm.buf)
+        view[:, offset:offset + samples.shape[1]] = samples
+        del view
+
+    @contextmanager
+    def open(self) -> Iterator[AudioBuffer]:
+        """
+        共有メモリをコピーせずにAudioBufferとして開く
+
+        with を抜けるとAudioBufferは解放される（中の配列を持ち出さないこと）
+        """
+        shm = shared_memory.SharedMemory(name=self.name)
+        samples = np.ndarray(self.shape, dtype=np.float32, buffer=shm.buf)
+        audio = AudioBuffer(samples=samples, sample_rate=self.sample_rate)
+        try:
+            yield audio
+        finally:
+            audio.release()
+            del samples
+            try:
+                shm.close()
+            except BufferError:
+                # まだ参照が残っている場合はGC時に閉じられる
+                pass
+
+    def unlink(self) -> None:
+        """共有メモリを削除（作成した側が使い終わったら呼ぶ）"""
+        try:
+            shm = self._shm or shared_memory.SharedMemory(name=self.name)
+            shm.close()
+            shm.unlink()
+        except FileNotFoundError:
+            pass
+        finally:
+            self._shm = None
+
+    def __repr__(self) -> str:
+        return f"SharedAudio(name={self.name!r}, shape={self.shape}, sample_rate={self.sample_rate})"
+
+    def __getstate__(self) -> dict:
+        state = self.__dict__.copy()
+        state["_shm"] = None
+        return state
+
+
+def decode_with_ffmpeg(
+    path: Union[str, Path], sample_rate: int = FFMPEG_DECODE_SAMPLE_RATE, channels: int = 2
+) -> tuple[np.ndarray, int]:
+    """
+    ffmpegで音声をfloat32 PCMにデコードしてパイプで受け取る（一時ファイルを作らない）
+
+    Args:
+        path: 音声ファイルのパス（Opus/M4Aなどffmpegが読める形式）
+        sample_rate: 出力のサンプルレート（ffmpeg内でリサンプル）
+        channels: 出力のチャンネル数
+
+    Returns:
+        ([channels, samples] のfloat32配列, サンプルレート)
+
+    Raises:
+        FileNotFoundError: ffmpegまたは音声ファイルがない場合
+        RuntimeError: デコードに失敗した場合
+    """
+    if not Path(path).exists():
+        raise FileNotFoundError(f"Audio file not found: {path}")
+
+    result = subprocess.run(
+        [
+            "ffmpeg",
+            "-nostdin",
+            "-v", "error",
+            "-i", str(path),
+            "-vn",
+            "-f", "f32le",
+            "-acodec", "pcm_f32le",
+            "-ac", str(channels),
+            "-ar", str(sample_rate),
+            "-",
+        ],
+        capture_output=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"ffmpeg failed: {result.stderr.decode(errors='replace').strip()}")
+
+    samples = np.frombuffer(result.stdout, dtype=np.float32).reshape(-1, channels).T
+    return samples, sample_rate
+
+
+def as_audio_buffer(
+    audio: Union[str, Path, AudioBuffer], decode_sample_rate: Optional[int] = None
+) -> AudioBuffer:
+    """
+    パスまたはAudioBufferをAudioBufferに揃える
+
+    Args:
+        decode_sample_rate: パスを渡した場合に、圧縮音声をデコードするサンプルレート
+    """
+    if isinstance(audio, AudioBuffer):
+        return audio
+    return AudioBuffer(audio, decode_sample_rate=decode_sample_rate)
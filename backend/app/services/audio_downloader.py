@@ -1,15 +1,54 @@
 """
 yt-dlp 音声ダウンロードサービス
 
-YouTubeから音声（WAV）をダウンロード
+YouTubeから音声をダウンロード
+- native（デフォルト）: YouTubeの音声ストリーム（Opus/M4A）をそのまま保存。
+  WAVへの変換（ffmpeg）と約50MBの書き出しを省き、解析時にffmpegのパイプで
+  必要なサンプルレートに直接デコードする（AudioBuffer）
+- wav: 従来どおりWAVに変換して保存
+
+video_id を渡した場合はダウンロードした音声をキャッシュし、同じ動画は
+（キャッシュに残っている間は）一度だけダウンロードする
+- 書き込み: 一時ファイルにダウンロードしてからリネーム（書き込み途中のファイルを読ませない）
+- 同時実行: 動画ごとのファイルロックで、同じ動画のダウンロードを1回にまとめる
+- 容量: 上限を超えたら最後に使った時刻（mtime）が古いものから削除（LRU）。
+  使用中のファイル（共有ロックを持つ読み手がいるもの）は削除しない
+
+section=(開始秒, 終了秒) を渡した場合はその区間だけをダウンロードする
+（yt-dlpの --download-sections。サビだけの解析などで転送量とデコード量を減らす）。
+区間ごとに別のファイルとしてキャッシュする
 """
+import asyncio
+import fcntl
 import os
 import re
 import subprocess
 import tempfile
+import threading
+import time
 import uuid
 from pathlib import Path
-from typing import Optional, Generator
+from typing import AsyncGenerator, Optional
+
+
+class _FileLock:
+    """動画ごとの排他ロック（flock。スレッド間・プロセス間で有効）"""
+
+    def __init__(self, path: Path):
+        self._fd = os.open(str(path), os.O_RDWR | os.O_CREAT, 0o644)
+
+    def acquire(self, blocking: bool = True) -> bool:
+        try:
+            fcntl.flock(self._fd, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+            return True
+        except BlockingIOError:
+            return False
+
+    def release(self) -> None:
+        try:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        finally:
+            os.close(self._fd)
 
 
 class AudioDownloaderService:
@@ -25,41 +64,146 @@ class AudioDownloaderService:
             self.temp_dir = Path(tempfile.gettempdir()) / "anisong_audio"
         self.temp_dir.mkdir(parents=True, exist_ok=True)
 
-    def download_audio(self, url: str) -> dict:
+        # 保存形式（native: Opus/M4Aのまま、wav: WAVに変換）
+        self.audio_format = os.getenv("ANISONG_AUDIO_FORMAT", "native")
+        if self.audio_format not in ("native", "wav"):
+            raise ValueError(f"Unknown ANISONG_AUDIO_FORMAT: {self.audio_format} (native or wav)")
+        # native時に選ぶ音声ストリームの最大ビットレート（kbps）
+        self.max_abr = int(os.getenv("ANISONG_AUDIO_MAX_ABR", "160"))
+
+        # 1回のダウンロードのタイムアウト（秒）と、失敗時の再実行回数
+        self.timeout = float(os.getenv("ANISONG_DOWNLOAD_TIMEOUT", "300"))
+        self.retries = int(os.getenv("ANISONG_DOWNLOAD_RETRIES", "0"))
+
+        # ダウンロードキャッシュ（video_idごとに1ファイル）
+        custom_cache_dir = os.getenv("ANISONG_AUDIO_CACHE_DIR")
+        self.cache_dir = Path(custom_cache_dir) if custom_cache_dir else self.temp_dir / "cache"
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        (self.cache_dir / ".locks").mkdir(exist_ok=True)
+        # キャッシュの最大容量（MB）。0ならキャッシュしない（リクエストごとにダウンロード）
+        self.cache_max_bytes = int(float(os.getenv("ANISONG_AUDIO_CACHE_MAX_MB", "2048")) * 1024 * 1024)
+
+        # 貸し出し中のキャッシュファイル: パス -> 共有ロックを持つfdのリスト
+        self._leases: dict[str, list[int]] = {}
+        self._leases_lock = threading.Lock()
+
+    # これより古い書き込み途中のファイルは削除する（秒）
+    STALE_TMP_SECONDS = 3600
+    # 他のリクエストのダウンロード完了を待つ間隔（秒、asyncio版）
+    LOCK_POLL_SECONDS = 0.2
+
+    @property
+    def cache_enabled(self) -> bool:
+        return self.cache_max_bytes > 0
+
+    def get_params(self) -> dict:
+        """解析結果に影響するパラメータ一覧を取得（キャッシュキー用）"""
+        params = {"audio_format": self.audio_format}
+        if self.audio_format == "native":
+            params["max_abr"] = self.max_abr
+        return params
+
+    def _section_args(self, section: Optional[tuple[float, Optional[float]]]) -> list[str]:
+        """区間を指定するyt-dlpの引数（Noneなら曲全体）"""
+        if section is None:
+            return []
+        start, end = section
+        return ["--download-sections", f"*{start}-{'inf' if end is None else end}"]
+
+    def _cache_id(self, video_id: str, section: Optional[tuple[float, Optional[float]]] = None) -> str:
+        """キャッシュのファイル名（区間指定時は区間ごとに別ファイル）"""
+        cache_id = self._safe_id(video_id)
+        if section is not None:
+            start, end = section
+            # "~" は動画IDに含まれないため、曲全体のファイルと区別できる
+            cache_id += f"~{round(start * 1000)}-{'end' if end is None else round(end * 1000)}"
+        return cache_id
+
+    def _format_args(self) -> list[str]:
+        """保存形式を指定するyt-dlpの引数"""
+        if self.audio_format == "wav":
+            return ["-x", "--audio-format", "wav"]  # 音声のみ抽出してWAVに変換
+        abr = self.max_abr
+        # 帯域に見合ったビットレートのOpus → M4A → その他の音声のみストリームの順に選ぶ
+        return [
+            "-f",
+            f"bestaudio[acodec=opus][abr<={abr}]/bestaudio[ext=m4a][abr<={abr}]"
+            f"/bestaudio[abr<={abr}]/bestaudio",
+        ]
+
+    def download_audio(
+        self,
+        url: str,
+        video_id: Optional[str] = None,
+        section: Optional[tuple[float, Optional[float]]] = None,
+    ) -> dict:
         """
-        YouTubeから音声（WAV）をダウンロード
+        YouTubeから音声をダウンロード（形式は ANISONG_AUDIO_FORMAT）
 
         Args:
             url: YouTube動画のURL
+            video_id: YouTubeの動画ID（指定するとキャッシュを使う）
+            section: ダウンロードする区間 (開始秒, 終了秒)。終了がNoneなら曲の最後まで
 
         Returns:
             {
                 "success": True/False,
-                "file_path": ダウンロードしたファイルのパス,
+                "file_path": ダウンロードしたファイルのパス（使い終わったら release() する）,
                 "error": エラーメッセージ（失敗時）
             }
         """
-        # ユニークなファイル名を生成
-        file_id = str(uuid.uuid4())
-        output_path = self.temp_dir / f"{file_id}.wav"
+        if not video_id or not self.cache_enabled:
+            return self._download(url, self.temp_dir, str(uuid.uuid4()), section)
+
+        cache_id = self._cache_id(video_id, section)
+        lock = self._lock_for(cache_id)
+        lock.acquire()
+        try:
+            cached = self._checkout(cache_id)
+            if cached:
+                return {"success": True, "file_path": cached, "error": None}
+
+            result = self._download(url, self.cache_dir, f".tmp-{uuid.uuid4()}", section)
+            if result["success"]:
+                try:
+                    result["file_path"] = self._store(cache_id, result["file_path"])
+                except Exception as e:
+                    self.cleanup(result["file_path"])
+                    return {"success": False, "file_path": None, "error": str(e)}
+            return result
+        finally:
+            lock.release()
+
+    def _download(
+        self,
+        url: str,
+        directory: Path,
+        file_id: str,
+        section: Optional[tuple[float, Optional[float]]] = None,
+    ) -> dict:
+        """yt-dlpで directory/file_id.(拡張子) にダウンロード"""
+        output_template = str(directory / f"{file_id}.%(ext)s")
 
         try:
-            # yt-dlpコマンドを実行
-            result = subprocess.run(
-                [
-                    "yt-dlp",
-                    "--js-runtimes", "nodejs",  # Node.jsをJSランタイムとして使用
-                    "-x",  # 音声のみ抽出
-                    "--audio-format", "wav",
-                    "-o", str(output_path),
-                    "--no-playlist",  # プレイリストは無視
-                    "--quiet",
-                    url,
-                ],
-                capture_output=True,
-                text=True,
-                timeout=300,  # 5分タイムアウト
-            )
+            # yt-dlpコマンドを実行（失敗したら retries 回まで再実行）
+            for attempt in range(self.retries + 1):
+                result = subprocess.run(
+                    [
+                        "yt-dlp",
+                        "--js-runtimes", "nodejs",  # Node.jsをJSランタイムとして使用
+                        *self._format_args(),
+                        *self._section_args(section),
+                        "-o", output_template,
+                        "--no-playlist",  # プレイリストは無視
+                        "--quiet",
+                        url,
+                    ],
+                    capture_output=True,
+                    text=True,
+                    timeout=self.timeout,
+                )
+                if result.returncode == 0:
+                    break
 
             if result.returncode != 0:
                 return {
@@ -68,22 +212,18 @@ class AudioDownloaderService:
                     "error": result.stderr or "yt-dlp failed",
                 }
 
-            # ファイルが存在するか確認
-            if not output_path.exists():
-                # yt-dlpは拡張子を自動で付けることがあるので確認
-                possible_paths = list(self.temp_dir.glob(f"{file_id}.*"))
-                if possible_paths:
-                    output_path = possible_paths[0]
-                else:
-                    return {
-                        "success": False,
-                        "file_path": None,
-                        "error": "Downloaded file not found",
-                    }
+            # 拡張子は保存形式（WAVまたは元のストリームの形式）で決まるので、書き出されたファイルを探す
+            possible_paths = self._find_output(directory, file_id)
+            if not possible_paths:
+                return {
+                    "success": False,
+                    "file_path": None,
+                    "error": "Downloaded file not found",
+                }
 
             return {
                 "success": True,
-                "file_path": str(output_path),
+                "file_path": str(possible_paths[0]),
                 "error": None,
             }
 
@@ -106,117 +246,344 @@ class AudioDownloaderService:
                 "error": str(e),
             }
 
-    def download_audio_with_progress(self, url: str) -> Generator[dict, None, None]:
+    async def download_audio_with_progress_async(
+        self,
+        url: str,
+        video_id: Optional[str] = None,
+        section: Optional[tuple[float, Optional[float]]] = None,
+    ) -> AsyncGenerator[dict, None]:
         """
-        YouTubeから音声（WAV）をダウンロード（進捗付き）
+        YouTubeから音声をダウンロード（進捗付き、asyncio版）
+
+        yt-dlpを非同期サブプロセスで実行するため、進捗待ちでイベントループを止めない。
+        タイムアウト・再実行は download_audio と同じ（ANISONG_DOWNLOAD_TIMEOUT / RETRIES）。
+        呼び出し側がキャンセルされた（SSEのクライアントが切断した）場合はyt-dlpを終了させる
 
         Args:
             url: YouTube動画のURL
+            video_id: YouTubeの動画ID（指定するとキャッシュを使う）
+            section: ダウンロードする区間 (開始秒, 終了秒)。終了がNoneなら曲の最後まで
 
         Yields:
             {
                 "stage": "download" | "convert" | "complete" | "error",
                 "progress": 0-100,
                 "message": 状態メッセージ,
-                "file_path": 完了時のファイルパス（completeのみ）
+                "file_path": 完了時のファイルパス（completeのみ。使い終わったら release() する）
             }
         """
-        file_id = str(uuid.uuid4())
-        output_template = str(self.temp_dir / f"{file_id}.%(ext)s")
-        output_path = self.temp_dir / f"{file_id}.wav"
-
+        if not video_id or not self.cache_enabled:
+            async for event in self._download_with_progress_async(
+                url, self.temp_dir, str(uuid.uuid4()), section
+            ):
+                yield event
+            return
+
+        cache_id = self._cache_id(video_id, section)
+        lock = self._lock_for(cache_id)
         try:
-            process = subprocess.Popen(
-                [
-                    "yt-dlp",
-                    "--js-runtimes", "nodejs",  # Node.jsをJSランタイムとして使用
-                    "-x",
-                    "--audio-format", "wav",
-                    "-o", output_template,
-                    "--no-playlist",
-                    "--newline",  # 進捗を行ごとに出力
-                    "--progress-template", "%(progress._percent_str)s",
-                    url,
-                ],
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                text=True,
-            )
+            if not lock.acquire(blocking=False):
+                # 同じ動画を別のリクエストがダウンロード中なので、終わるのを待って共有する
+                # （スレッドでブロックするとキャンセルできないため、ポーリングで待つ）
+                yield {
+                    "stage": "download",
+                    "progress": 0,
+                    "message": "他のリクエストのダウンロード完了を待機中...",
+                }
+                while not lock.acquire(blocking=False):
+                    await asyncio.sleep(self.LOCK_POLL_SECONDS)
 
-            yield {
-                "stage": "download",
-                "progress": 0,
-                "message": "ダウンロード開始...",
-            }
+            cached = self._checkout(cache_id)
+            if cached:
+                yield {
+                    "stage": "complete",
+                    "progress": 100,
+                    "message": "ダウンロード完了（キャッシュ）",
+                    "file_path": cached,
+                }
+                return
+
+            async for event in self._download_with_progress_async(
+                url, self.cache_dir, f".tmp-{uuid.uuid4()}", section
+            ):
+                if event["stage"] == "complete":
+                    try:
+                        event["file_path"] = self._store(cache_id, event["file_path"])
+                    except Exception as e:
+                        self.cleanup(event["file_path"])
+                        event = {"stage": "error", "progress": 0, "message": str(e)}
+                yield event
+        finally:
+            lock.release()
+
+    async def _download_with_progress_async(
+        self,
+        url: str,
+        directory: Path,
+        file_id: str,
+        section: Optional[tuple[float, Optional[float]]] = None,
+    ) -> AsyncGenerator[dict, None]:
+        """yt-dlpで directory/file_id.(拡張子) にダウンロード（進捗付き、asyncio版）"""
+        output_template = str(directory / f"{file_id}.%(ext)s")
+        command = [
+            "yt-dlp",
+            "--js-runtimes", "nodejs",  # Node.jsをJSランタイムとして使用
+            *self._format_args(),
+            *self._section_args(section),
+            "-o", output_template,
+            "--no-playlist",
+            "--newline",  # 進捗を行ごとに出力
+            "--progress-template", "%(progress._percent_str)s",
+            url,
+        ]
+
+        yield {
+            "stage": "download",
+            "progress": 0,
+            "message": "ダウンロード開始...",
+        }
+
+        for attempt in range(self.retries + 1):
+            if attempt > 0:
+                yield {
+                    "stage": "download",
+                    "progress": 0,
+                    "message": f"ダウンロードを再試行中...（{attempt}/{self.retries}）",
+                }
 
-            # 進捗を読み取る
-            last_progress = 0
-            for line in iter(process.stdout.readline, ""):
-                line = line.strip()
-                if not line:
-                    continue
-
-                # パーセンテージを抽出 (例: "50.0%" or " 50.0%")
-                match = re.search(r"(\d+\.?\d*)%", line)
-                if match:
-                    progress = min(float(match.group(1)), 100)
-                    if progress > last_progress:
-                        last_progress = progress
-                        yield {
-                            "stage": "download",
-                            "progress": int(progress),
-                            "message": f"ダウンロード中... {int(progress)}%",
-                        }
-                elif "Extracting" in line or "extract" in line.lower():
-                    yield {
-                        "stage": "convert",
-                        "progress": 0,
-                        "message": "音声変換中...",
-                    }
-
-            process.wait()
-
-            if process.returncode != 0:
-                stderr = process.stderr.read()
+            try:
+                process = await asyncio.create_subprocess_exec(
+                    *command,
+                    stdout=asyncio.subprocess.PIPE,
+                    stderr=asyncio.subprocess.PIPE,
+                )
+            except FileNotFoundError:
                 yield {
                     "stage": "error",
                     "progress": 0,
-                    "message": stderr or "ダウンロード失敗",
+                    "message": "yt-dlpがインストールされていません",
                 }
                 return
 
-            # ファイルを探す
-            if not output_path.exists():
-                possible_paths = list(self.temp_dir.glob(f"{file_id}.*"))
-                if possible_paths:
-                    output_path = possible_paths[0]
-                else:
-                    yield {
-                        "stage": "error",
-                        "progress": 0,
-                        "message": "ダウンロードファイルが見つかりません",
-                    }
-                    return
-
-            yield {
-                "stage": "complete",
-                "progress": 100,
-                "message": "ダウンロード完了",
-                "file_path": str(output_path),
-            }
-
-        except FileNotFoundError:
+            # stderrは並行して読む（パイプが詰まってyt-dlpが止まらないように）
+            stderr_task = asyncio.create_task(process.stderr.read())
+            try:
+                async with asyncio.timeout(self.timeout):
+                    last_progress = 0
+                    async for raw_line in process.stdout:
+                        line = raw_line.decode(errors="replace").strip()
+                        if not line:
+                            continue
+
+                        # パーセンテージを抽出 (例: "50.0%" or " 50.0%")
+                        match = re.search(r"(\d+\.?\d*)%", line)
+                        if match:
+                            progress = min(float(match.group(1)), 100)
+                            if progress > last_progress:
+                                last_progress = progress
+                                yield {
+                                    "stage": "download",
+                                    "progress": int(progress),
+                                    "message": f"ダウンロード中... {int(progress)}%",
+                                }
+                        elif "Extracting" in line or "extract" in line.lower():
+                            yield {
+                                "stage": "convert",
+                                "progress": 0,
+                                "message": "音声変換中...",
+                            }
+                    await process.wait()
+                stderr = (await stderr_task).decode(errors="replace")
+            except TimeoutError:
+                yield {
+                    "stage": "error",
+                    "progress": 0,
+                    "message": "ダウンロードがタイムアウトしました",
+                }
+                return
+            finally:
+                # タイムアウト・キャンセル（クライアント切断）時はyt-dlpを終了させる
+                if process.returncode is None:
+                    process.kill()
+                    await process.wait()
+                stderr_task.cancel()
+
+            if process.returncode == 0:
+                break
+        else:
             yield {
                 "stage": "error",
                 "progress": 0,
-                "message": "yt-dlpがインストールされていません",
+                "message": stderr or "ダウンロード失敗",
             }
-        except Exception as e:
+            return
+
+        possible_paths = self._find_output(directory, file_id)
+        if not possible_paths:
             yield {
                 "stage": "error",
                 "progress": 0,
-                "message": str(e),
+                "message": "ダウンロードファイルが見つかりません",
             }
+            return
+
+        yield {
+            "stage": "complete",
+            "progress": 100,
+            "message": "ダウンロード完了",
+            "file_path": str(possible_paths[0]),
+        }
+
+    def release(self, file_path: str) -> bool:
+        """
+        ダウンロードしたファイルを使い終わったことを通知
+
+        キャッシュのファイルは貸し出しを解除するだけ（削除はLRUに任せる）、
+        キャッシュを使わずにダウンロードしたファイルは削除する
+
+        Returns:
+            成功したかどうか
+        """
+        with self._leases_lock:
+            fds = self._leases.get(str(file_path))
+            fd = fds.pop() if fds else None
+            if fds == []:
+                del self._leases[str(file_path)]
+        if fd is None:
+            return self.cleanup(file_path)
+
+        os.close(fd)  # 共有ロックも解除される
+        return True
+
+    def evict(self) -> int:
+        """
+        キャッシュの容量が上限を超えていれば、最後に使った時刻が古いものから削除
+
+        使用中（共有ロックを持つ読み手がいる）のファイルは削除しない
+
+        Returns:
+            削除したファイル数
+        """
+        entries = []
+        total = 0
+        now = time.time()
+        for path in self.cache_dir.iterdir():
+            if not path.is_file():
+                continue
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            if path.name.startswith(".tmp-"):
+                # 異常終了したダウンロードの残骸
+                if now - stat.st_mtime > self.STALE_TMP_SECONDS:
+                    self.cleanup(str(path))
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+
+        count = 0
+        for _, size, path in sorted(entries):
+            if total <= self.cache_max_bytes:
+                break
+            if self._remove_if_unused(path):
+                total -= size
+                count += 1
+        return count
+
+    def _find_output(self, directory: Path, file_id: str) -> list[Path]:
+        """yt-dlpが書き出したファイルを探す（途中ファイルは除く）"""
+        return [
+            p for p in directory.glob(f"{file_id}.*")
+            if p.suffix not in (".part", ".ytdl")
+        ]
+
+    def _lock_for(self, cache_id: str) -> _FileLock:
+        return _FileLock(self.cache_dir / ".locks" / f"{cache_id}.lock")
+
+    def _checkout(self, cache_id: str) -> Optional[str]:
+        """
+        キャッシュされた音声を貸し出す（動画・区間ごとのロックを持った状態で呼ぶ）
+
+        Returns:
+            ファイルパス（キャッシュがない場合はNone）
+        """
+        for path in self.cache_dir.glob(f"{cache_id}.*"):
+            if path.is_file() and self._lease(path):
+                # 最後に使った時刻を更新（LRU）
+                try:
+                    os.utime(path)
+                except OSError:
+                    pass
+                return str(path)
+        return None
+
+    def _store(self, cache_id: str, tmp_path: str) -> str:
+        """ダウンロードした一時ファイルをキャッシュに登録して貸し出す"""
+        tmp_path = Path(tmp_path)
+        path = self.cache_dir / f"{cache_id}{tmp_path.suffix}"
+
+        # リネーム前に共有ロックを取る（公開した直後に他プロセスのLRUで消されないように）
+        fd = os.open(str(tmp_path), os.O_RDONLY)
+        fcntl.flock(fd, fcntl.LOCK_SH)
+        try:
+            os.replace(tmp_path, path)
+        except Exception:
+            os.close(fd)
+            raise
+        with self._leases_lock:
+            self._leases.setdefault(str(path), []).append(fd)
+
+        self.evict()
+        return str(path)
+
+    def _lease(self, path: Path) -> bool:
+        """
+        ファイルの共有ロックを取って貸し出し中にする
+
+        Returns:
+            貸し出せたか（ロックを取る前に削除された場合はFalse）
+        """
+        try:
+            fd = os.open(str(path), os.O_RDONLY)
+        except FileNotFoundError:
+            return False
+        fcntl.flock(fd, fcntl.LOCK_SH)
+        try:
+            # ロックを取るまでの間に削除されていないか確認
+            if os.fstat(fd).st_ino != os.stat(path).st_ino:
+                os.close(fd)
+                return False
+        except FileNotFoundError:
+            os.close(fd)
+            return False
+
+        with self._leases_lock:
+            self._leases.setdefault(str(path), []).append(fd)
+        return True
+
+    def _remove_if_unused(self, path: Path) -> bool:
+        """読み手がいなければ削除（排他ロックが取れるかで判定）"""
+        try:
+            fd = os.open(str(path), os.O_RDONLY)
+        except FileNotFoundError:
+            return False
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return False
+        try:
+            path.unlink()
+            return True
+        except FileNotFoundError:
+            return False
+        finally:
+            os.close(fd)
+
+    def _safe_id(self, video_id: str) -> str:
+        """ファイル名に使えない文字を除去（YouTubeのIDは英数字と-_のみ）"""
+        return re.sub(r"[^A-Za-z0-9_-]", "_", video_id)
 
     def cleanup(self, file_path: str) -> bool:
         """
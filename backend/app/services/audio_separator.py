@@ -2,11 +2,25 @@
 音声楽器分離サービス
 
 Demucsを使用して音声を4トラック（drums, bass, vocals, other）に分離
+
+長い音声は一定長の区間（重なりあり）ごとに分離し、結果を区間ごとに
+書き出す。Demucsのapply_modelは内部でも分割して推論するが、出力（4ステム × ステレオ、
+shifts使用時はシフト分の入力のコピーも）は渡した長さの分だけ一度に確保するため、
+区間に分けることでDemucsが確保するメモリが曲の長さに関係なく一定になる。
+
+曲の長さに比例するのは、デコード済みの入力音声（ステレオ）と出力先のステム
+（in_memory時は4ステム分のモノラル波形）だけ。入力はテンポ検出と共有するため
+1回だけ全体をデコードし、ステムは後段のノート変換が曲全体を使うため全長で確保する。
+テンポ検出などで作られたモノラル・リサンプルのビューは分離の前に解放する
+
+速度と品質のバランスはプロファイル（fast / balanced / best）で選ぶ
+分離したステムはキャッシュし（stem_cache）、同じ音声の再分離を省く
 """
 import os
 import tempfile
+import uuid
 from pathlib import Path
-from typing import Optional
+from typing import Iterator, Optional, Union
 
 import torch
 import torchaudio
@@ -16,6 +30,40 @@ import numpy as np
 from demucs import pretrained
 from demucs.apply import apply_model
 
+from app.services.audio_buffer import AudioBuffer, SharedAudio, as_audio_buffer
+from app.services.stem_cache import get_stem_cache_service
+
+# 分離プロファイル
+# - model: Demucsのモデル（htdemucs_ft は4モデルのバッグで約4倍遅いが高品質）
+# - overlap: Demucs内部の分割の重なり（割合）。小さいほど分割数が減って速い
+# - shifts: ランダムシフトして平均する回数（0ならシフトなし・結果は決定的）。
+#   1回だけのシフトは平均にならず処理量も変わらないため、使う場合は2回以上
+#
+# Demucs内部の分割長（segment）は指定しない。htdemucs系（Transformer）は学習時の長さ（7.8秒）
+# より長くできず、短くしても各分割が学習時の長さまでパディングされるため、分割数が増えて遅くなるだけ
+DEMUCS_PROFILES = {
+    "fast": {"model": "htdemucs", "overlap": 0.1, "shifts": 0},
+    "balanced": {"model": "htdemucs", "overlap": 0.25, "shifts": 0},
+    "best": {"model": "htdemucs_ft", "overlap": 0.25, "shifts": 2},
+}
+DEFAULT_PROFILE = "balanced"
+
+
+def default_torch_threads() -> int:
+    """
+    分離に使うtorchのスレッド数（環境変数 ANISONG_DEMUCS_THREADS で上書き可能）
+
+    既定ではCPUのコアをCPUワーカーのプロセス数（ANISONG_CPU_WORKERS）で分け合う。
+    torchの既定値（全コア）のままだと、複数のワーカーが同時に分離したときに
+    スレッドが奪い合いになって遅くなる
+    """
+    threads = os.getenv("ANISONG_DEMUCS_THREADS")
+    if threads:
+        return max(1, int(threads))
+    cores = os.cpu_count() or 2
+    workers = int(os.getenv("ANISONG_CPU_WORKERS", str(max(1, cores // 2))))
+    return max(1, cores // max(1, workers))
+
 
 class AudioSeparatorService:
     """Demucsを使用した楽器分離"""
@@ -37,30 +85,84 @@ class AudioSeparatorService:
         else:
             self.device = "cpu"
 
-        # モデルは遅延ロード
-        self._model = None
+        # 既定の分離プロファイル（呼び出しごとに上書き可能）
+        self.default_profile = self.resolve_profile()
+        # torchのスレッド数（結果には影響しないためキャッシュキーには含めない）
+        self.threads = default_torch_threads()
+
+        # 区間分離の長さ（秒）。0なら全体を一度に分離
+        self.chunk_seconds = float(os.getenv("ANISONG_SEPARATION_CHUNK_SECONDS", "60"))
+        # 区間同士の重なり（秒）。重なり部分はクロスフェードでつなぐ
+        self.chunk_overlap = float(os.getenv("ANISONG_SEPARATION_CHUNK_OVERLAP", "2"))
+
+        # モデルはモデル名ごとに遅延ロード
+        self._models: dict = {}
+
+    @staticmethod
+    def resolve_profile(profile: Optional[str] = None) -> str:
+        """
+        プロファイル名を検証（Noneなら環境変数 ANISONG_DEMUCS_PROFILE か balanced）
+
+        Raises:
+            ValueError: 存在しないプロファイル名の場合
+        """
+        name = profile or os.getenv("ANISONG_DEMUCS_PROFILE") or DEFAULT_PROFILE
+        if name not in DEMUCS_PROFILES:
+            raise ValueError(
+                f"Unknown separation profile: {name} (choose from {', '.join(DEMUCS_PROFILES)})"
+            )
+        return name
+
+    @property
+    def model_name(self) -> str:
+        """既定プロファイルのモデル名"""
+        return DEMUCS_PROFILES[self.default_profile]["model"]
 
     @property
     def model(self):
+        """既定プロファイルのモデル（ワーカー起動時のプリロード用）"""
+        return self.get_model(self.model_name)
+
+    def get_model(self, model_name: str):
         """モデルを遅延ロード"""
-        if self._model is None:
-            # htdemucs: Hybrid Transformer Demucs（高品質）
-            self._model = pretrained.get_model("htdemucs")
-            self._model.to(self.device)
-        return self._model
+        if model_name not in self._models:
+            model = pretrained.get_model(model_name)
+            model.to(self.device)
+            self._models[model_name] = model
+        return self._models[model_name]
+
+    def get_params(self, profile: Optional[str] = None) -> dict:
+        """解析結果に影響するパラメータ一覧を取得（キャッシュキー用）"""
+        name = self.resolve_profile(profile or self.default_profile)
+        return {
+            "profile": name,
+            **DEMUCS_PROFILES[name],
+            "chunk_seconds": self.chunk_seconds,
+            "chunk_overlap": self.chunk_overlap,
+        }
 
-    def separate(self, audio_path: str) -> dict:
+    def separate(
+        self,
+        audio_path: Union[str, AudioBuffer],
+        in_memory: bool = False,
+        profile: Optional[str] = None,
+        use_cache: bool = True,
+    ) -> dict:
         """
         音声ファイルを楽器ごとに分離
 
         Args:
-            audio_path: 音声ファイルのパス
+            audio_path: 音声ファイルのパスまたはAudioBuffer（デコード済みならそれを使う）
+            in_memory: Trueならファイルに保存せず、モノラルfloat32の波形を
+                共有メモリ（SharedAudio）で返す（別プロセスのワーカーにコピーなしで渡せる）
+            profile: 分離プロファイル（fast / balanced / best。Noneなら既定）
+            use_cache: Falseならステムのキャッシュを読み書きせず必ずDemucsを実行する（ベンチマーク用）
 
         Returns:
             {
                 "success": True/False,
                 "tracks": {
-                    "drums": ドラムトラックのパス,
+                    "drums": ドラムトラックのパス（in_memory時はSharedAudio）,
                     "bass": ベーストラックのパス,
                     "vocals": ボーカルトラックのパス,
                     "other": その他（ギター等）トラックのパス,
@@ -68,67 +170,99 @@ class AudioSeparatorService:
                 "error": エラーメッセージ（失敗時）
             }
         """
-        audio_path = Path(audio_path)
-        if not audio_path.exists():
+        if not isinstance(audio_path, AudioBuffer) and not Path(audio_path).exists():
             return {
                 "success": False,
                 "tracks": {},
                 "error": f"Audio file not found: {audio_path}",
             }
 
+        tracks = {}
+        cached = None
+        cache_writer = None
         try:
-            # 音声を読み込み（soundfileを使用してtorchcodec問題を回避）
-            audio_data, sr = sf.read(str(audio_path))
+            profile = self.resolve_profile(profile or self.default_profile)
 
-            # numpy配列をtorch tensorに変換
-            # soundfileは [samples, channels] 形式で返す
-            if audio_data.ndim == 1:
-                # モノラル -> ステレオ
-                audio_data = np.stack([audio_data, audio_data], axis=1)
+            # 音声を読み込み（デコード済みのAudioBufferがあればそれを使う）
+            audio = as_audio_buffer(audio_path)
 
-            # [samples, channels] -> [channels, samples]
-            wav = torch.from_numpy(audio_data.T.astype(np.float32))
+            # 同じ音声・同じパラメータで分離済みならキャッシュのステムを使う
+            stem_cache = get_stem_cache_service()
+            use_cache = use_cache and stem_cache.enabled
+            cache_key = stem_cache.make_key(audio, self.get_params(profile)) if use_cache else None
+            cached = stem_cache.open(cache_key) if cache_key else None
 
-            # サンプルレートを44100Hzに統一（Demucsの要件）
-            if sr != 44100:
-                wav = torchaudio.functional.resample(wav, sr, 44100)
-                sr = 44100
+            if cached is not None:
+                print(f"[AudioSeparator] Using cached stems: {cache_key}")
+                source_names = cached.stems
+                length, sr, channels = cached.length, cached.sample_rate, cached.channels
+                chunks = cached.iter_chunks()
+            else:
+                model = self.get_model(DEMUCS_PROFILES[profile]["model"])
+                # テンポ検出などで作ったモノラルのビューは分離に使わないので解放しておく
+                audio.drop_views()
+                audio_data, sr = audio.samples, audio.sample_rate
 
-            # ステレオに変換（モノラルの場合）
-            if wav.shape[0] == 1:
-                wav = wav.repeat(2, 1)
+                # numpy配列をtorch tensorに変換（[channels, samples] 形式）
+                if audio_data.shape[0] == 1:
+                    # モノラル -> ステレオ
+                    audio_data = np.concatenate([audio_data, audio_data], axis=0)
 
-            # バッチ次元を追加 [channels, samples] -> [batch, channels, samples]
-            wav = wav.unsqueeze(0).to(self.device)
+                wav = torch.from_numpy(audio_data)
 
-            # 分離実行
-            with torch.no_grad():
-                sources = apply_model(
-                    self.model,
-                    wav,
-                    device=self.device,
-                    progress=False,
-                )
+                # サンプルレートを44100Hzに統一（Demucsの要件）
+                if sr != 44100:
+                    wav = torchaudio.functional.resample(wav, sr, 44100)
+                    sr = 44100
+
+                # ステレオに変換（モノラルの場合）
+                if wav.shape[0] == 1:
+                    wav = wav.repeat(2, 1)
+
+                # source order: drums, bass, other, vocals（htdemucsの場合）
+                source_names = model.sources  # ['drums', 'bass', 'other', 'vocals']
+                length, channels = wav.shape[-1], wav.shape[0]
+                chunks = self.iter_separated_chunks(wav, profile)
+                if cache_key:
+                    cache_writer = stem_cache.writer(cache_key, list(source_names), sr, channels)
+
+            # 出力先を用意（区間ごとに書き込む）
+            # キャッシュしたダウンロードは同じ動画なら同じ名前なので、実行ごとのIDを付けて上書きを防ぐ
+            stem = f"{audio.name}-{uuid.uuid4().hex[:8]}"
+            writers = {}
+            for name in source_names:
+                if in_memory:
+                    # 変換に使うのはモノラルだけなので、ダウンミックスして共有メモリに置く
+                    tracks[name] = SharedAudio.allocate((1, length), sr)
+                else:
+                    track_path = self.output_dir / f"{stem}_{name}.wav"
+                    tracks[name] = str(track_path)
+                    writers[name] = sf.SoundFile(str(track_path), "w", samplerate=sr, channels=channels)
+
+            try:
+                # 分離実行（区間ごとに書き出す）
+                for offset, chunk in chunks:
+                    if cache_writer is not None:
+                        cache_writer.write(chunk)
+                    for name, track_audio in chunk.items():
+                        if in_memory:
+                            tracks[name].write(offset, track_audio.mean(axis=0))
+                        else:
+                            # [channels, samples] -> [samples, channels]
+                            writers[name].write(track_audio.T)
+            finally:
+                for writer in writers.values():
+                    writer.close()
 
-            # sources shape: [batch, sources, channels, samples]
-            # source order: drums, bass, other, vocals（htdemucsの場合）
-            source_names = self.model.sources  # ['drums', 'bass', 'other', 'vocals']
-
-            # 各トラックを保存（soundfileを使用）
-            tracks = {}
-            stem = audio_path.stem
-            for i, name in enumerate(source_names):
-                track_path = self.output_dir / f"{stem}_{name}.wav"
-                track_audio = sources[0, i].cpu().numpy()
-                # [channels, samples] -> [samples, channels]
-                track_audio = track_audio.T
-                sf.write(str(track_path), track_audio, sr)
-                tracks[name] = str(track_path)
-
-                # デバッグ用ログ
-                file_size = track_path.stat().st_size / 1024 / 1024
-                duration = track_audio.shape[0] / sr
-                print(f"[DEBUG] Saved {name} track: {track_path} ({file_size:.2f}MB, {duration:.1f}s)")
+            if cache_writer is not None:
+                cache_writer.commit()
+                cache_writer = None
+
+            # デバッグ用ログ
+            if not in_memory:
+                for name, track_path in tracks.items():
+                    file_size = Path(track_path).stat().st_size / 1024 / 1024
+                    print(f"[DEBUG] Saved {name} track: {track_path} ({file_size:.2f}MB, {length / sr:.1f}s)")
 
             return {
                 "success": True,
@@ -137,16 +271,105 @@ class AudioSeparatorService:
             }
 
         except Exception as e:
+            # 途中まで作成したトラック・キャッシュを残さない
+            self.cleanup(tracks)
+            if cache_writer is not None:
+                cache_writer.abort()
             return {
                 "success": False,
                 "tracks": {},
                 "error": f"Separation failed: {str(e)}",
             }
+        finally:
+            if cached is not None:
+                cached.close()
+
+    def iter_separated_chunks(
+        self, wav: torch.Tensor, profile: Optional[str] = None
+    ) -> Iterator[tuple[int, dict]]:
+        """
+        分離結果を区間ごとに返す（ジェネレータ）
+
+        chunk_seconds ごとに重なりを持たせて分離し、重なり部分はクロスフェードでつなぐ。
+        Demucsに渡すのも一度に保持する結果も1区間分だけなので、推論のメモリは曲が長くても増えない
+        （入力の wav は曲全体）
+
+        Args:
+            wav: 44100Hzの音声 [channels, samples]
+            profile: 分離プロファイル（Noneなら既定）
+
+        Yields:
+            (開始サンプル位置, {ステム名: [channels, samples] のfloat32配列})
+        """
+        profile = self.resolve_profile(profile or self.default_profile)
+        source_names = self.get_model(DEMUCS_PROFILES[profile]["model"]).sources
+        length = wav.shape[-1]
+        sr = 44100
+
+        chunk = int(self.chunk_seconds * sr) if self.chunk_seconds > 0 else length
+        if chunk >= length:
+            # 短い音声は全体を一度に分離
+            chunk, overlap = length, 0
+        else:
+            overlap = min(int(self.chunk_overlap * sr), chunk // 2)
+        step = chunk - overlap
+        fade_in = np.linspace(0.0, 1.0, overlap, endpoint=False, dtype=np.float32)
+
+        # 前の区間の末尾（次の区間とのクロスフェード用）[sources, channels, overlap]
+        tail = None
+        start = 0
+        while True:
+            end = min(start + chunk, length)
+            sources = self._apply(wav[:, start:end], profile)
+
+            if tail is not None:
+                sources[..., :overlap] = tail * (1.0 - fade_in) + sources[..., :overlap] * fade_in
+
+            is_last = end >= length
+            emit_end = sources.shape[-1] if is_last else sources.shape[-1] - overlap
+            yield start, {
+                name: sources[i, :, :emit_end] for i, name in enumerate(source_names)
+            }
+
+            if is_last:
+                return
+            tail = sources[..., emit_end:].copy()
+            start += step
+
+    def _apply(self, segment: torch.Tensor, profile: str) -> np.ndarray:
+        """
+        1区間を分離
+
+        Returns:
+            [sources, channels, samples] のfloat32配列
+        """
+        settings = DEMUCS_PROFILES[profile]
+        # バッチ次元を追加 [channels, samples] -> [batch, channels, samples]
+        segment = segment.unsqueeze(0).to(self.device)
+
+        previous_threads = torch.get_num_threads()
+        torch.set_num_threads(self.threads)
+        try:
+            with torch.no_grad():
+                sources = apply_model(
+                    self.get_model(settings["model"]),
+                    segment,
+                    shifts=settings["shifts"],
+                    overlap=settings["overlap"],
+                    device=self.device,
+                    progress=False,
+                )
+        finally:
+            torch.set_num_threads(previous_threads)
+        return sources[0].cpu().numpy()
 
     def cleanup(self, tracks: dict) -> None:
-        """分離したトラックファイルを削除"""
+        """分離したトラックファイル（共有メモリ）を削除"""
         for path in tracks.values():
             try:
+                if isinstance(path, SharedAudio):
+                    path.unlink()
+                    continue
                 p = Path(path)
                 if p.exists():
                     p.unlink()
@@ -6,8 +6,9 @@ Spotify's Basic Pitch を使用した高精度オーディオ→MIDI変換
 + 信頼度フィルタリング
 + ビートクオンタイズ
 """
+import threading
 from pathlib import Path
-from typing import Optional
+from typing import Optional, Union
 import numpy as np
 
 # scipy互換性修正（scipy.signal.gaussian → scipy.signal.windows.gaussian）
@@ -18,23 +19,35 @@ if not hasattr(scipy.signal, 'gaussian'):
     scipy.signal.gaussian = scipy.signal.windows.gaussian
 
 # Basic Pitch のインポート
-from basic_pitch.inference import predict
-from basic_pitch import ICASSP_2022_MODEL_PATH
+from basic_pitch.inference import Model, unwrap_output, window_audio_file
+from basic_pitch.constants import AUDIO_N_SAMPLES, AUDIO_SAMPLE_RATE, FFT_HOP
+from basic_pitch import ICASSP_2022_MODEL_PATH, note_creation as infer
 
 # テンポ検出用
 import librosa
 
+from app.services.audio_buffer import AudioBuffer, as_audio_buffer
+from app.services.notes import NoteArray, python_round
+
 # デバッグ: 使用されるモデルパスを表示
 print(f"[BasicPitch] Model path: {ICASSP_2022_MODEL_PATH}")
 
 
+
 class BasicPitchService:
     """Basic Pitch による音声→MIDI変換 + テンポ検出 + クオンタイズ"""
 
     def __init__(self):
-        """初期化（モデルはpredict時に自動ロード）"""
+        """初期化（モデルは初回使用時にロード）"""
         self.model_path = ICASSP_2022_MODEL_PATH
         print(f"[BasicPitch] Using model: {self.model_path}")
+        self._model = None
+        # モデルをロードしたスレッド（TFLiteは他のスレッドでは別インスタンスを使う）
+        self._model_thread: Optional[int] = None
+        self._model_lock = threading.Lock()
+        self._local = threading.local()
+        # モデルをロードした回数（ベンチマーク・テスト用）
+        self.load_count = 0
         # 信頼度しきい値（これ以下のノートは除外）
         self.confidence_threshold = 0.25  # 0.3→0.25 ノートを拾いやすく
         # クオンタイズ解像度（16分音符 = 0.25拍）
@@ -42,15 +55,68 @@ class BasicPitchService:
         # ノートマージ用の最大ギャップ（秒）
         self.merge_gap_threshold = 0.15  # 0.1→0.15 ぶつ切り軽減
 
-    def detect_tempo(self, audio_path: str) -> tuple[float, np.ndarray]:
+    @property
+    def model(self) -> Model:
+        """
+        モデルを遅延ロード（以降のpredictで再利用）
+
+        プロセスごとに1回だけロードする（CPUワーカーはプロセスごとにサービスのシングルトンを持つ）。
+        同じプロセスの複数スレッドから同時に呼ばれても1回しかロードしない。
+        TFLiteのインタープリタはスレッドセーフでないため、ロードしたスレッド以外ではスレッドごとにロードする
+        """
+        if self._model is None:
+            with self._model_lock:
+                if self._model is None:
+                    self._model = self._load_model()
+                    self._model_thread = threading.get_ident()
+
+        if (
+            self._model.model_type == Model.MODEL_TYPES.TFLITE
+            and threading.get_ident() != self._model_thread
+        ):
+            model = getattr(self._local, "model", None)
+            if model is None:
+                model = self._local.model = self._load_model()
+            return model
+        return self._model
+
+    def _load_model(self) -> Model:
+        model = Model(self.model_path)
+        self.load_count += 1
+        print(f"[BasicPitch] Model loaded ({model.model_type.name})")
+        return model
+
+    def get_params(self) -> dict:
+        """
+        解析結果に影響するパラメータ一覧を取得（キャッシュキー用）
+
+        Returns:
+            モデル名・しきい値・楽器別パラメータのdict
+        """
+        return {
+            "model": Path(self.model_path).name,
+            "confidence_threshold": self.confidence_threshold,
+            "quantize_resolution": self.quantize_resolution,
+            "merge_gap_threshold": self.merge_gap_threshold,
+            "tracks": {
+                track_type: self._get_track_params(track_type)
+                for track_type in ["drums", "bass", "other", "vocals"]
+            },
+        }
+
+    def detect_tempo(self, audio: Union[str, AudioBuffer]) -> tuple[float, np.ndarray]:
         """
         librosaでテンポとビート位置を検出
 
+        Args:
+            audio: 音声ファイルのパスまたはAudioBuffer
+
         Returns:
             (tempo, beat_times): テンポ(BPM)とビート位置の配列
         """
         try:
-            y, sr = librosa.load(audio_path, sr=22050)
+            sr = 22050
+            y = as_audio_buffer(audio, decode_sample_rate=sr).mono(sr)
             tempo, beat_frames = librosa.beat.beat_track(y=y, sr=sr)
             beat_times = librosa.frames_to_time(beat_frames, sr=sr)
             # tempo が numpy 配列の場合は最初の値を取得
@@ -79,145 +145,68 @@ class BasicPitchService:
         quantized = round(time / grid_duration) * grid_duration
         return round(quantized, 3)
 
-    def merge_notes(self, notes: list[dict], gap_threshold: float = 0.1) -> list[dict]:
+    def quantize_times(self, times: np.ndarray, tempo: float, resolution: float = 0.5) -> np.ndarray:
         """
-        同じピッチの隣接ノートをマージしてぶつ切りを解消
+        時間の配列をまとめてビートグリッドにクオンタイズ（quantize_timeと同じ結果）
 
         Args:
-            notes: ノートのリスト（開始時間順にソート済み）
-            gap_threshold: マージする最大ギャップ（秒）
+            times: 元の時間（秒）の配列
+            tempo: テンポ（BPM）
+            resolution: クオンタイズ解像度（拍単位、0.5=8分音符）
 
         Returns:
-            マージされたノートのリスト
+            クオンタイズされた時間（秒）の配列
         """
-        if not notes:
-            return []
-
-        # ピッチごとにグループ化
-        pitch_groups: dict[int, list[dict]] = {}
-        for note in notes:
-            pitch = note["pitch"]
-            if pitch not in pitch_groups:
-                pitch_groups[pitch] = []
-            pitch_groups[pitch].append(note)
-
-        merged_notes = []
-
-        for pitch, group in pitch_groups.items():
-            # 開始時間順にソート
-            group.sort(key=lambda n: n["start"])
-
-            current_note = None
-            for note in group:
-                if current_note is None:
-                    current_note = note.copy()
-                else:
-                    # 前のノートの終了と現在のノートの開始のギャップをチェック
-                    gap = note["start"] - current_note["end"]
-
-                    if gap <= gap_threshold:
-                        # マージ: 終了時間を延長、ベロシティは平均
-                        current_note["end"] = note["end"]
-                        current_note["velocity"] = (current_note["velocity"] + note["velocity"]) // 2
-                        if "confidence" in note and "confidence" in current_note:
-                            current_note["confidence"] = max(current_note["confidence"], note["confidence"])
-                    else:
-                        # ギャップが大きいので別ノートとして保存
-                        merged_notes.append(current_note)
-                        current_note = note.copy()
-
-            # 最後のノートを追加
-            if current_note:
-                merged_notes.append(current_note)
-
-        # 開始時間順にソート
-        merged_notes.sort(key=lambda n: n["start"])
-        return merged_notes
-
-    def transcribe_audio(self, audio_path: str, quantize: bool = True) -> dict:
+        grid_duration = 60.0 / tempo * resolution
+        return python_round(np.rint(times / grid_duration) * grid_duration, 3)
+
+    def transcribe_audio(self, audio_path: Union[str, AudioBuffer], quantize: bool = True) -> dict:
         """
         音声ファイルからノート情報を抽出
 
         Args:
-            audio_path: 音声ファイルのパス
+            audio_path: 音声ファイルのパスまたはAudioBuffer（デコードは1回だけ行う）
             quantize: ビートグリッドにクオンタイズするか
 
         Returns:
             {
                 "success": True/False,
                 "tempo": テンポ（BPM）- librosaで検出,
-                "notes": ノート情報のリスト,
+                "notes": ノート列（NoteArray）,
                 "error": エラーメッセージ（失敗時）
             }
         """
-        audio_file = Path(audio_path)
-        if not audio_file.exists():
-            return {
-                "success": False,
-                "tempo": None,
-                "notes": [],
-                "error": f"Audio file not found: {audio_path}",
-            }
-
-        file_size = audio_file.stat().st_size
-        if file_size == 0:
+        error = self._check_audio_file(audio_path)
+        if error:
             return {
                 "success": False,
                 "tempo": None,
-                "notes": [],
-                "error": "Audio file is empty",
+                "notes": NoteArray(),
+                "error": error,
             }
 
         try:
+            # テンポ検出と推論で同じデコード結果を使う（どちらも22050Hzモノラル）
+            audio = as_audio_buffer(audio_path, decode_sample_rate=AUDIO_SAMPLE_RATE)
+
             # 1. テンポ検出（librosa）
-            tempo, beat_times = self.detect_tempo(str(audio_file))
+            tempo, beat_times = self.detect_tempo(audio)
             print(f"[BasicPitch] Detected tempo: {tempo:.1f} BPM")
 
             # 2. Basic Pitch で推論
-            model_output, midi_data, note_events = predict(
-                str(audio_file),
-                model_or_model_path=self.model_path,
-            )
+            model_output, midi_data, note_events = self._predict(audio)
 
             # 3. note_events を変換 + 信頼度フィルタリング
-            # note_events: List of (start_time, end_time, pitch, velocity, [confidence])
-            notes = []
-            filtered_count = 0
-
-            for event in note_events:
-                start_time = float(event[0])
-                end_time = float(event[1])
-                pitch = int(event[2])
-                velocity = float(event[3])  # 0-1
-
-                # 信頼度（velocity）でフィルタリング
-                if velocity < self.confidence_threshold:
-                    filtered_count += 1
-                    continue
-
-                # クオンタイズ
-                if quantize and tempo > 0:
-                    start_time = self.quantize_time(start_time, tempo, self.quantize_resolution)
-                    end_time = self.quantize_time(end_time, tempo, self.quantize_resolution)
-                    # 最小ノート長を確保（16分音符）
-                    min_length = 60.0 / tempo * self.quantize_resolution
-                    if end_time <= start_time:
-                        end_time = start_time + min_length
-
-                notes.append({
-                    "pitch": pitch,
-                    "start": round(start_time, 3),
-                    "end": round(end_time, 3),
-                    "velocity": min(127, max(1, int(velocity * 127))),
-                    "confidence": round(velocity, 2),  # 信頼度も保存
-                })
-
-            # 開始時間順にソート
-            notes.sort(key=lambda n: n["start"])
+            notes, filtered_count = self._events_to_notes(
+                note_events,
+                confidence_threshold=self.confidence_threshold,
+                tempo=tempo if quantize else 0,
+                resolution=self.quantize_resolution,
+            )
 
             # ぶつ切りノートをマージ
             original_count = len(notes)
-            notes = self.merge_notes(notes, gap_threshold=self.merge_gap_threshold)
+            notes = notes.merge(self.merge_gap_threshold)
 
             print(f"[BasicPitch] Transcribed {len(notes)} notes (filtered {filtered_count}, merged {original_count - len(notes)})")
 
@@ -233,16 +222,16 @@ class BasicPitchService:
             return {
                 "success": False,
                 "tempo": None,
-                "notes": [],
+                "notes": NoteArray(),
                 "error": f"Basic Pitch transcription failed: {str(e)}",
             }
 
-    def transcribe_track(self, audio_path: str, track_type: str, tempo: float = None) -> dict:
+    def transcribe_track(self, audio_path: Union[str, AudioBuffer], track_type: str, tempo: float = None) -> dict:
         """
         楽器別にトラックをMIDI変換
 
         Args:
-            audio_path: 分離された音声ファイルのパス
+            audio_path: 分離された音声ファイルのパスまたはAudioBuffer
             track_type: トラック種別（"drums", "bass", "other", "vocals"）
             tempo: テンポ（BPM）- Noneの場合は検出する
 
@@ -250,34 +239,27 @@ class BasicPitchService:
             {
                 "success": True/False,
                 "tempo": テンポ（BPM）,
-                "notes": ノート情報のリスト,
+                "notes": ノート列（NoteArray）,
                 "error": エラーメッセージ（失敗時）
             }
         """
         # vocals は melody として処理（ボーカルメロディをピアノで表示）
 
-        audio_file = Path(audio_path)
-        if not audio_file.exists():
-            return {
-                "success": False,
-                "tempo": None,
-                "notes": [],
-                "error": f"Audio file not found: {audio_path}",
-            }
-
-        file_size = audio_file.stat().st_size
-        if file_size == 0:
+        error = self._check_audio_file(audio_path, f"Audio file is empty: {track_type}")
+        if error:
             return {
                 "success": False,
                 "tempo": None,
-                "notes": [],
-                "error": f"Audio file is empty: {track_type}",
+                "notes": NoteArray(),
+                "error": error,
             }
 
         try:
+            audio = as_audio_buffer(audio_path)
+
             # テンポが未検出なら検出
             if tempo is None:
-                tempo, _ = self.detect_tempo(str(audio_file))
+                tempo, _ = self.detect_tempo(audio)
 
             # 楽器別パラメータ設定
             params = self._get_track_params(track_type)
@@ -288,13 +270,12 @@ class BasicPitchService:
                 return {
                     "success": True,
                     "tempo": round(tempo) if tempo else None,
-                    "notes": [],
+                    "notes": NoteArray(),
                     "error": None,
                 }
 
-            model_output, midi_data, note_events = predict(
-                str(audio_file),
-                model_or_model_path=self.model_path,
+            model_output, midi_data, note_events = self._predict(
+                audio,
                 onset_threshold=params["onset_threshold"],
                 frame_threshold=params["frame_threshold"],
                 minimum_note_length=params["min_note_length"],
@@ -302,52 +283,19 @@ class BasicPitchService:
                 maximum_frequency=params.get("max_freq"),
             )
 
-            # note_events を変換 + 信頼度フィルタリング
-            notes = []
-            filtered_count = 0
-
-            for event in note_events:
-                start_time = float(event[0])
-                end_time = float(event[1])
-                pitch = int(event[2])
-                velocity = float(event[3])  # 0-1
-
-                # 信頼度フィルタリング（楽器別しきい値）
-                if velocity < params["confidence_threshold"]:
-                    filtered_count += 1
-                    continue
-
-                # ドラムは短いノートに（打楽器なので）
-                if track_type == "drums":
-                    end_time = min(end_time, start_time + 0.05)
-                    # ドラムノートをGM Drumマップに正規化
-                    pitch = self._normalize_drum_pitch(pitch)
-
-                # クオンタイズ
-                if tempo > 0:
-                    resolution = 0.125 if track_type == "drums" else 0.25  # ドラムは32分音符
-                    start_time = self.quantize_time(start_time, tempo, resolution)
-                    if track_type != "drums":
-                        end_time = self.quantize_time(end_time, tempo, resolution)
-                        min_length = 60.0 / tempo * resolution
-                        if end_time <= start_time:
-                            end_time = start_time + min_length
-
-                notes.append({
-                    "pitch": pitch,
-                    "start": round(start_time, 3),
-                    "end": round(end_time, 3),
-                    "velocity": min(127, max(1, int(velocity * 127))),
-                    "confidence": round(velocity, 2),
-                })
-
-            # 開始時間順にソート
-            notes.sort(key=lambda n: n["start"])
+            # note_events を変換 + 信頼度フィルタリング（楽器別しきい値、ドラムは32分音符）
+            notes, filtered_count = self._events_to_notes(
+                note_events,
+                confidence_threshold=params["confidence_threshold"],
+                tempo=tempo,
+                resolution=0.125 if track_type == "drums" else 0.25,
+                drums=track_type == "drums",
+            )
 
             # ドラム以外はノートをマージ（ドラムは短いヒットなのでマージしない）
             if track_type != "drums":
                 original_count = len(notes)
-                notes = self.merge_notes(notes, gap_threshold=self.merge_gap_threshold)
+                notes = notes.merge(self.merge_gap_threshold)
                 print(f"[BasicPitch] {track_type}: {len(notes)} notes (filtered {filtered_count}, merged {original_count - len(notes)})")
             else:
                 print(f"[BasicPitch] {track_type}: {len(notes)} notes (filtered {filtered_count})")
@@ -364,10 +312,135 @@ class BasicPitchService:
             return {
                 "success": False,
                 "tempo": None,
-                "notes": [],
+                "notes": NoteArray(),
                 "error": f"Track transcription failed: {str(e)}",
             }
 
+    def _events_to_notes(
+        self,
+        note_events: list,
+        confidence_threshold: float,
+        tempo: float,
+        resolution: float,
+        drums: bool = False,
+    ) -> tuple[NoteArray, int]:
+        """
+        Basic Pitchのnote_eventsをノート列に変換
+
+        フィルタリング・クオンタイズ・最小ノート長・ベロシティ変換は
+        イベント全体の配列に対してまとめて行う（dictへの変換は応答を作るときだけ）
+
+        Args:
+            note_events: (start_time, end_time, pitch, velocity(0-1), pitch_bends) のリスト
+            confidence_threshold: これ未満のvelocity（信頼度）のノートは除外
+            tempo: テンポ（BPM）。0以下ならクオンタイズしない
+            resolution: クオンタイズ解像度（拍単位）
+            drums: ドラムとして変換（短いノート・GM Drumマップ・開始時間のみクオンタイズ）
+
+        Returns:
+            (開始時間順のノート列, 除外したノート数)
+        """
+        events = np.array([event[:4] for event in note_events], dtype=np.float64).reshape(-1, 4)
+        start_time, end_time, pitch, velocity = events.T
+
+        # 信頼度（velocity）でフィルタリング
+        keep = velocity >= confidence_threshold
+        filtered_count = int(len(events) - np.count_nonzero(keep))
+        start_time, end_time, velocity = start_time[keep], end_time[keep], velocity[keep]
+        pitch = pitch[keep].astype(np.int64)
+
+        # ドラムは短いノートに（打楽器なので）+ GM Drumマップに正規化
+        if drums:
+            end_time = np.minimum(end_time, start_time + 0.05)
+            pitch = self._normalize_drum_pitch(pitch)
+
+        # クオンタイズ
+        if tempo > 0:
+            start_time = self.quantize_times(start_time, tempo, resolution)
+            if not drums:
+                end_time = self.quantize_times(end_time, tempo, resolution)
+                # 最小ノート長を確保（1グリッド分）
+                min_length = 60.0 / tempo * resolution
+                end_time = np.where(end_time <= start_time, start_time + min_length, end_time)
+
+        start_time = python_round(start_time, 3)
+        # 開始時間順にソート（同じ開始時間は元の順序を保つ）
+        order = np.argsort(start_time, kind="stable")
+        notes = NoteArray.from_columns(
+            pitch=pitch[order],
+            start=start_time[order],
+            end=python_round(end_time[order], 3),
+            velocity=np.clip((velocity[order] * 127).astype(np.int64), 1, 127),
+            confidence=python_round(velocity[order], 2),
+        )
+        return notes, filtered_count
+
+    def _predict(
+        self,
+        audio: AudioBuffer,
+        onset_threshold: float = 0.5,
+        frame_threshold: float = 0.3,
+        minimum_note_length: float = 127.70,
+        minimum_frequency: Optional[float] = None,
+        maximum_frequency: Optional[float] = None,
+    ):
+        """
+        Basic Pitchで推論（basic_pitch.inference.predict と同じ処理）
+
+        predict() はファイルパスしか受け取らず内部で再度デコードするため、
+        AudioBufferのモノラル22050Hzビューを直接ウィンドウに分割して推論する
+
+        Returns:
+            (model_output, midi_data, note_events)
+        """
+        y = audio.mono(AUDIO_SAMPLE_RATE)
+
+        # 30フレーム重ねてウィンドウ分割（run_inferenceと同じ）
+        n_overlapping_frames = 30
+        overlap_len = n_overlapping_frames * FFT_HOP
+        hop_size = AUDIO_N_SAMPLES - overlap_len
+        padded = np.concatenate([np.zeros((overlap_len // 2,), dtype=np.float32), y])
+
+        output = {"note": [], "onset": [], "contour": []}
+        for window, _ in window_audio_file(padded, hop_size):
+            for key, value in self.model.predict(np.expand_dims(window, axis=0)).items():
+                output[key].append(value)
+
+        model_output = {
+            key: unwrap_output(np.concatenate(values), len(y), n_overlapping_frames)
+            for key, values in output.items()
+        }
+
+        min_note_len = int(np.round(minimum_note_length / 1000 * (AUDIO_SAMPLE_RATE / FFT_HOP)))
+        midi_data, note_events = infer.model_output_to_notes(
+            model_output,
+            onset_thresh=onset_threshold,
+            frame_thresh=frame_threshold,
+            min_note_len=min_note_len,
+            min_freq=minimum_frequency,
+            max_freq=maximum_frequency,
+            multiple_pitch_bends=False,
+            melodia_trick=True,
+            midi_tempo=120,
+        )
+        return model_output, midi_data, note_events
+
+    def _check_audio_file(
+        self, audio: Union[str, AudioBuffer], empty_message: str = "Audio file is empty"
+    ) -> Optional[str]:
+        """音声ファイルの存在と中身を確認（問題があればエラーメッセージを返す）"""
+        if isinstance(audio, AudioBuffer):
+            if audio.path is None:
+                return empty_message if audio.samples.shape[1] == 0 else None
+            audio = audio.path
+
+        audio_file = Path(audio)
+        if not audio_file.exists():
+            return f"Audio file not found: {audio}"
+        if audio_file.stat().st_size == 0:
+            return empty_message
+        return None
+
     def _get_track_params(self, track_type: str) -> dict:
         """楽器別のパラメータを取得（感度UP調整済み）"""
         params = {
@@ -408,9 +481,9 @@ class BasicPitchService:
         }
         return params.get(track_type, params["other"])
 
-    def _normalize_drum_pitch(self, pitch: int) -> int:
+    def _normalize_drum_pitch(self, pitch: np.ndarray) -> np.ndarray:
         """
-        検出されたピッチをGM Drumマップに正規化
+        検出されたピッチの配列をGM Drumマップに正規化
 
         GM Drum Map:
             35: Acoustic Bass Drum
@@ -421,17 +494,15 @@ class BasicPitchService:
             49: Crash Cymbal 1
             51: Ride Cymbal 1
         """
-        # 低いピッチはキック
-        if pitch < 40:
-            return 36  # Kick
-        # 中間はスネアまたはタム
-        elif pitch < 50:
-            return 38  # Snare
-        # 高いピッチはハイハット/シンバル
-        elif pitch < 60:
-            return 42  # Hi-Hat
-        else:
-            return 49  # Crash
+        return np.select(
+            [
+                pitch < 40,  # 低いピッチはキック
+                pitch < 50,  # 中間はスネアまたはタム
+                pitch < 60,  # 高いピッチはハイハット
+            ],
+            [36, 38, 42],
+            49,  # それ以上はクラッシュ
+        )
 
 
 # シングルトンインスタンス
@@ -0,0 +1,224 @@
+"""
+ブロッキング処理の実行先
+
+async ハンドラからブロッキング処理を直接呼ぶとイベントループが止まり、
+解析中は /health や他のSSEストリームも応答しなくなる。
+そのため処理の種類ごとに専用のエグゼキューターへ逃がす
+
+- I/O待ち（yt-dlp, YouTube API, Gemini, キャッシュ読み書き）: スレッドプール
+- CPU処理（Demucs, Basic Pitch, librosa）: プロセスプール
+
+プロセスプールのワーカーは常駐し、起動時にDemucs / Basic Pitchのモデルを
+一度だけロードする（以降の解析ではロード済みのモデルを再利用）
+ANISONG_WARMUP=1 の場合は短い合成音声で各処理を一度実行してから準備完了を報告する
+"""
+import asyncio
+import functools
+import multiprocessing
+import os
+import queue
+import threading
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Optional
+
+_io_executor: Optional[ThreadPoolExecutor] = None
+_cpu_executor: Optional[Executor] = None
+_cpu_worker_count = 0
+# 初期化を終えたCPUワーカーが報告を送るキュー
+_ready_queue = None
+
+# CPUワーカー内で実行中かどうか（ワーカーから再度プールに投げるとデッドロックするため）
+_worker_state = threading.local()
+
+
+def in_cpu_worker() -> bool:
+    """現在のスレッドがCPUワーカーかどうか"""
+    return getattr(_worker_state, "active", False)
+
+
+def _init_cpu_worker(preload_models: bool, warmup: bool = False, ready_queue=None) -> None:
+    """
+    CPUワーカーの初期化
+
+    プロセスワーカーではモデルを先にロードしておき、最初の解析を待たせない。
+    warmup=True なら合成音声で各処理を実行し、JITコンパイル等も済ませておく
+    """
+    _worker_state.active = True
+    report = {"pid": os.getpid(), "models": {}, "warmup": None}
+
+    if preload_models or warmup:
+        from app.services.audio_separator import get_audio_separator_service
+        from app.services.basic_pitch_service import get_basic_pitch_service
+
+        try:
+            get_audio_separator_service().model
+            report["models"]["demucs"] = "loaded"
+            print(f"[Worker {os.getpid()}] Demucs model loaded")
+        except Exception as e:
+            report["models"]["demucs"] = f"failed: {e}"
+            print(f"[Worker {os.getpid()}] Failed to preload Demucs model: {e}")
+        try:
+            get_basic_pitch_service().model
+            report["models"]["basic_pitch"] = "loaded"
+            print(f"[Worker {os.getpid()}] Basic Pitch model loaded")
+        except Exception as e:
+            report["models"]["basic_pitch"] = f"failed: {e}"
+            print(f"[Worker {os.getpid()}] Failed to preload Basic Pitch model: {e}")
+
+    if warmup:
+        from app.services.warmup import warm_up_stages
+
+        report["warmup"] = warm_up_stages()
+
+    if ready_queue is not None:
+        ready_queue.put(report)
+
+
+def _noop() -> None:
+    """ワーカーを起動させるための空の処理"""
+
+
+def get_io_executor() -> ThreadPoolExecutor:
+    """I/O待ち用のスレッドプールを取得"""
+    global _io_executor
+    if _io_executor is None:
+        max_workers = int(os.getenv("ANISONG_IO_WORKERS", "8"))
+        _io_executor = ThreadPoolExecutor(
+            max_workers=max(1, max_workers),
+            thread_name_prefix="anisong-io",
+        )
+    return _io_executor
+
+
+def get_cpu_executor() -> Executor:
+    """
+    CPU処理用のプロセスプールを取得
+
+    ANISONG_CPU_WORKERS=0 の場合はプロセスを使わずスレッドで実行する
+    （テスト・デバッグ用。イベントループは止めないがGILは共有する）
+    """
+    global _cpu_executor, _cpu_worker_count, _ready_queue
+    if _cpu_executor is None:
+        default_workers = max(1, (os.cpu_count() or 2) // 2)
+        max_workers = int(os.getenv("ANISONG_CPU_WORKERS", str(default_workers)))
+        warmup = os.getenv("ANISONG_WARMUP", "0") == "1"
+        if max_workers <= 0:
+            _cpu_worker_count = 1
+            _ready_queue = queue.Queue()
+            _cpu_executor = ThreadPoolExecutor(
+                max_workers=1,
+                thread_name_prefix="anisong-cpu",
+                initializer=_init_cpu_worker,
+                initargs=(False, warmup, _ready_queue),
+            )
+        else:
+            # torch / TensorFlow はforkと相性が悪いためspawnで起動
+            context = multiprocessing.get_context("spawn")
+            _cpu_worker_count = max_workers
+            _ready_queue = context.Queue()
+            _cpu_executor = ProcessPoolExecutor(
+                max_workers=max_workers,
+                mp_context=context,
+                initializer=_init_cpu_worker,
+                initargs=(True, warmup, _ready_queue),
+            )
+    return _cpu_executor
+
+
+def start_cpu_workers(timeout: Optional[float] = None) -> list[dict]:
+    """
+    すべてのCPUワーカーを起動し、初期化（モデルロード・ウォームアップ）の完了を待つ
+
+    Args:
+        timeout: 待機する最大秒数
+
+    Returns:
+        ワーカーごとの初期化結果（pid, models, warmup）
+
+    Raises:
+        TimeoutError: 時間内にすべてのワーカーの初期化が終わらなかった場合
+    """
+    executor = get_cpu_executor()
+    ready_queue = _ready_queue
+    # ワーカーは処理の投入時に起動されるため、ワーカー数だけ空の処理を投げる
+    futures = [executor.submit(_noop) for _ in range(_cpu_worker_count)]
+
+    reports = []
+    try:
+        for _ in range(_cpu_worker_count):
+            reports.append(ready_queue.get(timeout=timeout))
+    except queue.Empty:
+        raise TimeoutError(
+            f"CPUワーカーの初期化が{timeout}秒以内に終わりませんでした（{len(reports)}/{_cpu_worker_count}）"
+        )
+
+    for future in futures:
+        future.result(timeout=timeout)
+    return reports
+
+
+async def run_in_thread(func: Callable[..., Any], *args, **kwargs) -> Any:
+    """ブロッキングI/O処理をスレッドプールで実行"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        get_io_executor(), functools.partial(func, *args, **kwargs)
+    )
+
+
+def submit_cpu_task(func: Callable[..., Any], *args, **kwargs) -> Future:
+    """
+    CPU負荷の高い処理をプロセスプールに投入してFutureを返す
+
+    独立した複数の処理（ステムごとの変換など）を並列に実行する場合に使う。
+    既にCPUワーカー内で実行中の場合はその場で実行し、完了済みのFutureを返す
+    """
+    if in_cpu_worker():
+        future = Future()
+        try:
+            future.set_result(func(*args, **kwargs))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    executor = get_cpu_executor()
+    try:
+        future = executor.submit(func, *args, **kwargs)
+    except BrokenProcessPool:
+        _discard_broken_cpu_executor(executor)
+        raise
+    future.add_done_callback(lambda f: _discard_if_broken(f, executor))
+    return future
+
+
+def run_cpu_task(func: Callable[..., Any], *args, **kwargs) -> Any:
+    """
+    CPU負荷の高い処理をプロセスプールで実行して結果を待つ（同期版）
+
+    サービス内部（スレッドで実行中のオーケストレーション処理）から呼ぶ。
+    既にCPUワーカー内で実行中の場合はその場で実行する
+    """
+    return submit_cpu_task(func, *args, **kwargs).result()
+
+
+def _discard_if_broken(future: Future, executor: Executor) -> None:
+    if not future.cancelled() and isinstance(future.exception(), BrokenProcessPool):
+        _discard_broken_cpu_executor(executor)
+
+
+def _discard_broken_cpu_executor(executor: Executor) -> None:
+    """ワーカーが異常終了（メモリ不足など）した場合は次回作り直す"""
+    global _cpu_executor
+    if _cpu_executor is executor:
+        _cpu_executor = None
+
+
+def shutdown_executors() -> None:
+    """エグゼキューターを停止（アプリ終了時）"""
+    global _io_executor, _cpu_executor
+    if _io_executor is not None:
+        _io_executor.shutdown(wait=False, cancel_futures=True)
+        _io_executor = None
+    if _cpu_executor is not None:
+        _cpu_executor.shutdown(wait=False, cancel_futures=True)
+        _cpu_executor = None
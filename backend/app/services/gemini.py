@@ -18,6 +18,7 @@ from app.prompts import (
     TRANSCRIBE_BASS_PROMPT,
     TRANSCRIBE_OTHER_PROMPT,
 )
+from app.services.executors import run_in_thread
 
 # 範囲指定解説用プロンプト
 SECTION_ANALYSIS_PROMPT = """
@@ -133,7 +134,9 @@ class GeminiService:
         )
 
         try:
-            response = self.client.models.generate_content(
+            # SDKの呼び出しはブロッキングなのでスレッドで実行
+            response = await run_in_thread(
+                self.client.models.generate_content,
                 model=self.model,
                 contents=prompt,
             )
@@ -197,7 +200,9 @@ class GeminiService:
         )
 
         try:
-            response = self.client.models.generate_content(
+            # SDKの呼び出しはブロッキングなのでスレッドで実行
+            response = await run_in_thread(
+                self.client.models.generate_content,
                 model=self.model,
                 contents=prompt,
             )
@@ -228,7 +233,9 @@ class GeminiService:
         )
 
         try:
-            response = self.client.models.generate_content(
+            # SDKの呼び出しはブロッキングなのでスレッドで実行
+            response = await run_in_thread(
+                self.client.models.generate_content,
                 model=self.model,
                 contents=prompt,
             )
@@ -259,7 +266,9 @@ class GeminiService:
         )
 
         try:
-            response = self.client.models.generate_content(
+            # SDKの呼び出しはブロッキングなのでスレッドで実行
+            response = await run_in_thread(
+                self.client.models.generate_content,
                 model=self.model,
                 contents=prompt,
             )
@@ -0,0 +1,201 @@
+"""
+バックグラウンド解析ジョブ
+
+長時間かかる解析（4トラック分離など）をHTTPリクエストから切り離して実行
+- 投入するとすぐにジョブIDを返す
+- 上限付きのワーカーがキューから順に処理
+- クライアントが切断しても処理は継続
+- 完了したジョブの結果は一定時間（TTL）取得可能
+"""
+import asyncio
+import os
+import time
+import uuid
+from typing import AsyncIterator, Callable, Optional
+
+
+class JobQueueFullError(Exception):
+    """ジョブキューが満杯"""
+
+
+class Job:
+    """解析ジョブ1件の状態"""
+
+    def __init__(self, kind: str, video_id: str):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.video_id = video_id
+        self.status = "queued"  # queued | running | completed | failed
+        self.stage = "queued"
+        self.progress = 0
+        self.message = "待機中..."
+        self.result: Optional[dict] = None
+        self.error: Optional[str] = None
+        self.status_code: Optional[int] = None
+        self.created_at = time.time()
+        self.updated_at = self.created_at
+        self.finished_at: Optional[float] = None
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ("completed", "failed")
+
+    def apply_event(self, event: dict) -> None:
+        """パイプラインの進捗イベントを反映"""
+        self.stage = event["stage"]
+        self.progress = event.get("progress", self.progress)
+        self.message = event.get("message", self.message)
+        self.updated_at = time.time()
+
+        if event["stage"] == "complete":
+            self.status = "completed"
+            self.result = event.get("data")
+            self.finished_at = self.updated_at
+        elif event["stage"] == "error":
+            self.status = "failed"
+            self.error = event.get("message")
+            self.status_code = event.get("status_code", 500)
+            self.finished_at = self.updated_at
+
+    def to_dict(self) -> dict:
+        """状態をAPIレスポンス用のdictに変換（結果本体は含めない）"""
+        return {
+            "job_id": self.id,
+            "kind": self.kind,
+            "video_id": self.video_id,
+            "status": self.status,
+            "stage": self.stage,
+            "progress": self.progress,
+            "message": self.message,
+            "error": self.error,
+            "created_at": self.created_at,
+            "updated_at": self.updated_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class JobManager:
+    """上限付きワーカーでジョブを処理するマネージャー"""
+
+    def __init__(self):
+        # 同時に実行するジョブ数
+        self.max_workers = int(os.getenv("ANISONG_JOB_WORKERS", "2"))
+        # 待機できるジョブ数の上限
+        self.max_queue_size = int(os.getenv("ANISONG_JOB_QUEUE_SIZE", "100"))
+        # 完了したジョブの結果を保持する秒数
+        self.result_ttl = float(os.getenv("ANISONG_JOB_TTL", "3600"))
+
+        self._jobs: dict[str, Job] = {}
+        self._queue: Optional[asyncio.Queue] = None
+        self._workers: list[asyncio.Task] = []
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def submit(
+        self, kind: str, video_id: str, producer: Callable[[], AsyncIterator[dict]]
+    ) -> Job:
+        """
+        ジョブを投入
+
+        Args:
+            kind: ジョブ種別（"analyze", "analyze-4tracks"）
+            video_id: YouTubeの動画ID
+            producer: 進捗イベントを順に返す非同期ジェネレータを作る関数
+
+        Returns:
+            投入したJob
+
+        Raises:
+            JobQueueFullError: 待機中のジョブが上限に達している場合
+        """
+        self._ensure_workers()
+        self._purge_expired()
+
+        job = Job(kind, video_id)
+        try:
+            self._queue.put_nowait((job, producer))
+        except asyncio.QueueFull:
+            raise JobQueueFullError("ジョブが混み合っています。しばらくしてから再度お試しください")
+
+        self._jobs[job.id] = job
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        """
+        ジョブを取得
+
+        Returns:
+            Job（存在しない、またはTTL切れの場合はNone）
+        """
+        self._purge_expired()
+        return self._jobs.get(job_id)
+
+    async def shutdown(self) -> None:
+        """ワーカーを停止"""
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        self._queue = None
+        self._loop = None
+
+    def _ensure_workers(self) -> None:
+        """ワーカーを起動（イベントループが変わった場合は作り直す）"""
+        loop = asyncio.get_running_loop()
+        if self._loop is loop and self._workers:
+            return
+
+        self._loop = loop
+        self._queue = asyncio.Queue(maxsize=self.max_queue_size)
+        self._workers = [
+            asyncio.create_task(self._worker()) for _ in range(max(1, self.max_workers))
+        ]
+
+    async def _worker(self) -> None:
+        queue = self._queue
+        while True:
+            job, producer = await queue.get()
+            try:
+                await self._run(job, producer)
+            finally:
+                queue.task_done()
+
+    async def _run(self, job: Job, producer: Callable[[], AsyncIterator[dict]]) -> None:
+        job.status = "running"
+        job.updated_at = time.time()
+        try:
+            async for event in producer():
+                job.apply_event(event)
+            if not job.finished:
+                job.apply_event({
+                    "stage": "error",
+                    "progress": 0,
+                    "message": "解析エラー: 結果がありません",
+                })
+        except Exception as e:
+            job.apply_event({
+                "stage": "error",
+                "progress": 0,
+                "message": f"解析エラー: {str(e)}",
+            })
+
+    def _purge_expired(self) -> None:
+        """TTLを過ぎた完了ジョブを削除"""
+        now = time.time()
+        expired = [
+            job_id for job_id, job in self._jobs.items()
+            if job.finished_at is not None and now - job.finished_at > self.result_ttl
+        ]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+
+# シングルトンインスタンス
+_job_manager: Optional[JobManager] = None
+
+
+def get_job_manager() -> JobManager:
+    """JobManagerのシングルトンを取得"""
+    global _job_manager
+    if _job_manager is None:
+        _job_manager = JobManager()
+    return _job_manager
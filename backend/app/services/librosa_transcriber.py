@@ -6,11 +6,14 @@ TensorFlow不要の軽量な実装:
 - onset_detect: ドラムオンセット検出
 """
 from pathlib import Path
-from typing import Optional
+from typing import Optional, Union
 import numpy as np
 import librosa
 from scipy import signal
 
+from app.services.audio_buffer import AudioBuffer, as_audio_buffer
+from app.services.notes import NoteArray
+
 
 class LibrosaTranscriber:
     """Librosaによる音声→ノート変換"""
@@ -37,39 +40,52 @@ class LibrosaTranscriber:
             "ride": 51,         # Ride Cymbal 1
         }
 
-    def extract_melody(self, audio_path: str, tempo: float = None) -> dict:
+    def get_params(self) -> dict:
+        """解析結果に影響するパラメータ一覧を取得（キャッシュキー用）"""
+        return {
+            "vocal_fmin": self.vocal_fmin,
+            "vocal_fmax": self.vocal_fmax,
+            "min_note_duration": self.min_note_duration,
+            "voiced_threshold": self.voiced_threshold,
+            "pitch_tolerance": self.pitch_tolerance,
+            "gap_tolerance": self.gap_tolerance,
+            "drum_map": self.drum_map,
+        }
+
+    def extract_melody(self, audio_path: Union[str, AudioBuffer], tempo: float = None) -> dict:
         """
         pyinでボーカルメロディを抽出
 
         Args:
-            audio_path: 音声ファイルのパス（分離済みボーカル推奨）
+            audio_path: 音声ファイルのパスまたはAudioBuffer（分離済みボーカル推奨）
             tempo: テンポ（BPM）- クオンタイズ用
 
         Returns:
             {
                 "success": True/False,
-                "notes": ノート情報のリスト,
+                "notes": ノート列（NoteArray）,
                 "error": エラーメッセージ（失敗時）
             }
         """
-        audio_file = Path(audio_path)
-        if not audio_file.exists():
+        if not isinstance(audio_path, AudioBuffer) and not Path(audio_path).exists():
             return {
                 "success": False,
-                "notes": [],
+                "notes": NoteArray(),
                 "error": f"Audio file not found: {audio_path}",
             }
 
         try:
-            print(f"[Librosa] Loading audio: {audio_file}")
-            # 音声を読み込み
-            y, sr = librosa.load(str(audio_file), sr=22050, mono=True)
+            audio = as_audio_buffer(audio_path)
+            print(f"[Librosa] Loading audio: {audio.name}")
+            # 音声を読み込み（デコード済みならモノラル22050Hzのビューを使う）
+            sr = 22050
+            y = audio.mono(sr)
             print(f"[Librosa] Loaded: {len(y)} samples, sr={sr}, duration={len(y)/sr:.1f}s")
 
             if len(y) == 0:
                 return {
                     "success": False,
-                    "notes": [],
+                    "notes": NoteArray(),
                     "error": "Audio file is empty",
                 }
 
@@ -109,7 +125,7 @@ class LibrosaTranscriber:
             print(f"[Librosa] Melody error: {type(e).__name__}: {str(e)}")
             return {
                 "success": False,
-                "notes": [],
+                "notes": NoteArray(),
                 "error": f"Melody extraction failed: {str(e)}",
             }
 
@@ -120,9 +136,9 @@ class LibrosaTranscriber:
         voiced_probs: np.ndarray,
         times: np.ndarray,
         tempo: float = None
-    ) -> list[dict]:
+    ) -> NoteArray:
         """
-        連続ピッチデータをノートイベントに変換
+        連続ピッチデータをノート列に変換
         ビブラート許容・ギャップブリッジ対応
         """
         notes = []
@@ -207,26 +223,11 @@ class LibrosaTranscriber:
                 notes.append(note)
 
         # 近接ノートをマージ（同じピッチで短いギャップ）
-        notes = self._merge_nearby_notes(notes)
-
-        return notes
-
-    def _merge_nearby_notes(self, notes: list[dict]) -> list[dict]:
-        """同じピッチの近接ノートをマージ"""
-        if len(notes) < 2:
-            return notes
-
-        merged = [notes[0]]
-        for note in notes[1:]:
-            prev = merged[-1]
-            gap = note["start"] - prev["end"]
-            # 同じピッチで短いギャップならマージ
-            if note["pitch"] == prev["pitch"] and gap <= self.gap_tolerance:
-                prev["end"] = note["end"]
-                prev["velocity"] = max(prev["velocity"], note["velocity"])
-            else:
-                merged.append(note)
-        return merged
+        return self._merge_nearby_notes(NoteArray.from_dicts(notes))
+
+    def _merge_nearby_notes(self, notes: NoteArray) -> NoteArray:
+        """同じピッチの近接ノートをマージ（連続するノート同士、ベロシティは最大値）"""
+        return notes.merge(self.gap_tolerance, velocity="max", by_pitch=False)
 
     def _finalize_note(
         self,
@@ -262,7 +263,7 @@ class LibrosaTranscriber:
             "velocity": min(127, max(40, int(avg_confidence * 100))),
         }
 
-    def extract_drums(self, audio_path: str, tempo: float = None) -> dict:
+    def extract_drums(self, audio_path: Union[str, AudioBuffer], tempo: float = None) -> dict:
         """
         周波数帯域分離によるドラムイベント抽出
 
@@ -274,34 +275,35 @@ class LibrosaTranscriber:
         - Crash/Ride: 3000-10000Hz（シンバルのシャーン）
 
         Args:
-            audio_path: 音声ファイルのパス（分離済みドラム）
+            audio_path: 音声ファイルのパスまたはAudioBuffer（分離済みドラム）
             tempo: テンポ（BPM）- クオンタイズ用
 
         Returns:
             {
                 "success": True/False,
-                "notes": ノート情報のリスト,
+                "notes": ノート列（NoteArray）,
                 "error": エラーメッセージ（失敗時）
             }
         """
-        audio_file = Path(audio_path)
-        if not audio_file.exists():
+        if not isinstance(audio_path, AudioBuffer) and not Path(audio_path).exists():
             return {
                 "success": False,
-                "notes": [],
+                "notes": NoteArray(),
                 "error": f"Audio file not found: {audio_path}",
             }
 
         try:
-            print(f"[Librosa] Loading drum audio: {audio_file}")
+            audio = as_audio_buffer(audio_path)
+            print(f"[Librosa] Loading drum audio: {audio.name}")
             # 44100Hzで読み込み（高周波数を正確に捉えるため）
-            y, sr = librosa.load(str(audio_file), sr=44100, mono=True)
+            sr = 44100
+            y = audio.mono(sr)
             print(f"[Librosa] Drum audio loaded: {len(y)} samples, sr={sr}, duration={len(y)/sr:.1f}s")
 
             if len(y) == 0:
                 return {
                     "success": False,
-                    "notes": [],
+                    "notes": NoteArray(),
                     "error": "Audio file is empty",
                 }
 
@@ -380,15 +382,14 @@ class LibrosaTranscriber:
             print(f"[Librosa] After classification: {len(notes)} notes")
 
             # 時間順にソート
-            notes.sort(key=lambda n: n["start"])
+            notes = NoteArray.from_dicts(notes).sort()
 
             # 統計を出力
             drum_counts = {}
-            for note in notes:
-                pitch = note["pitch"]
+            for pitch, count in zip(*np.unique(notes.pitch, return_counts=True)):
                 drum_name = [k for k, v in self.drum_map.items() if v == pitch]
                 drum_name = drum_name[0] if drum_name else str(pitch)
-                drum_counts[drum_name] = drum_counts.get(drum_name, 0) + 1
+                drum_counts[drum_name] = int(count)
             print(f"[Librosa] Drum summary: {drum_counts}")
             print(f"[Librosa] Total drum events: {len(notes)}")
 
@@ -404,7 +405,7 @@ class LibrosaTranscriber:
             traceback.print_exc()
             return {
                 "success": False,
-                "notes": [],
+                "notes": NoteArray(),
                 "error": f"Drum detection failed: {str(e)}",
             }
 
@@ -8,14 +8,115 @@ Demucsで楽器分離 → 各トラックをMIDI変換
 """
 import os
 import tempfile
+import uuid
+from concurrent.futures import as_completed
 from pathlib import Path
-from typing import Optional
+from typing import Optional, Union
 
+import librosa
 import mido
+import numpy as np
 
 from app.services.basic_pitch_service import get_basic_pitch_service
 from app.services.audio_separator import get_audio_separator_service
+from app.services.audio_downloader import get_audio_downloader_service
 from app.services.librosa_transcriber import get_librosa_transcriber
+from app.services.audio_buffer import AudioBuffer, SharedAudio, as_audio_buffer
+from app.services.executors import run_cpu_task, submit_cpu_task
+from app.services.notes import NoteArray, as_note_array
+
+# 解析ロジックを変更したら上げる（キャッシュ済みの結果を無効化するため）
+PIPELINE_VERSION = 2
+
+# ピッチクラス名
+PITCH_CLASSES = ["C", "C#", "D", "D#", "E", "F", "F#", "G", "G#", "A", "A#", "B"]
+
+# コードパターン（ルートからの半音数）
+CHORD_PATTERNS = {
+    "": [0, 4, 7],           # Major
+    "m": [0, 3, 7],          # Minor
+    "7": [0, 4, 7, 10],      # Dominant 7th
+    "M7": [0, 4, 7, 11],     # Major 7th
+    "m7": [0, 3, 7, 10],     # Minor 7th
+    "dim": [0, 3, 6],        # Diminished
+    "aug": [0, 4, 8],        # Augmented
+    "sus4": [0, 5, 7],       # Suspended 4th
+}
+
+
+def _build_chord_templates() -> tuple[list[str], np.ndarray]:
+    """
+    全ルート × コードパターンのテンプレートを作成
+
+    Returns:
+        (コード名のリスト, [12, コード数] の行列（コードに含まれるピッチクラスが1）)
+        並びはルート順 → CHORD_PATTERNSの順
+    """
+    names = []
+    templates = np.zeros((12, 12 * len(CHORD_PATTERNS)), dtype=np.int64)
+    for root in range(12):
+        for chord_type, intervals in CHORD_PATTERNS.items():
+            for interval in intervals:
+                templates[(root + interval) % 12, len(names)] += 1
+            names.append(PITCH_CLASSES[root] + chord_type)
+    return names, templates
+
+
+CHORD_NAMES, CHORD_TEMPLATES = _build_chord_templates()
+
+
+# --- CPUワーカーで実行する処理 ---
+# プロセスプールに渡すためモジュールレベル関数にしている（pickle可能）
+# ワーカー内ではサービスのシングルトン（ロード済みモデル）が再利用される
+
+def _transcribe_audio_stage(audio_path: str) -> dict:
+    """Basic Pitchでフル楽曲をノートに変換"""
+    return get_basic_pitch_service().transcribe_audio(audio_path)
+
+
+def _chords_stage(audio_path: str, offset: float) -> dict:
+    """音声から直接コード進行を推定（ノート変換なし）"""
+    return get_magenta_service().extract_chords_from_audio(audio_path, offset=offset)
+
+
+def _tempo_and_separate_stage(
+    audio_path: str, in_memory: bool, profile: Optional[str] = None
+) -> tuple[float, dict]:
+    """
+    元の音声からテンポを検出し、Demucsで楽器分離
+
+    同じワーカー内で1回だけデコードした音声を両方の処理で使う
+    """
+    audio = AudioBuffer(audio_path)
+    tempo, _ = get_basic_pitch_service().detect_tempo(audio)
+    print(f"[Magenta] Detected tempo from original: {tempo:.1f} BPM")
+    return tempo, get_audio_separator_service().separate(
+        audio, in_memory=in_memory, profile=profile
+    )
+
+
+def _transcribe_stem_stage(track_type: str, track, tempo: float) -> dict:
+    """分離したトラック（パスまたは共有メモリ）を楽器別に最適なツールでノートに変換"""
+    if isinstance(track, SharedAudio):
+        # 共有メモリ上のステムをコピーせずに読む
+        with track.open() as audio:
+            return _transcribe_stem(track_type, audio, tempo)
+    return _transcribe_stem(track_type, track, tempo)
+
+
+def _transcribe_stem(track_type: str, track_path, tempo: float) -> dict:
+    if track_type == "drums":
+        # ドラム: librosa onset_detect
+        print(f"[Magenta] Using librosa for drums")
+        return get_librosa_transcriber().extract_drums(track_path, tempo=tempo)
+    elif track_type == "vocals":
+        # ボーカル: librosa pyin（単音メロディに最適）
+        print(f"[Magenta] Using librosa pyin for vocals")
+        return get_librosa_transcriber().extract_melody(track_path, tempo=tempo)
+    else:
+        # ベース/その他: Basic Pitch（和音に最適）
+        print(f"[Magenta] Using Basic Pitch for {track_type}")
+        return get_basic_pitch_service().transcribe_track(track_path, track_type, tempo=tempo)
 
 
 class MagentaService:
@@ -30,18 +131,62 @@ class MagentaService:
             self.temp_dir = Path(tempfile.gettempdir()) / "anisong_midi"
         self.temp_dir.mkdir(parents=True, exist_ok=True)
 
-    def audio_to_midi(self, audio_path: str) -> dict:
+        # 分離したステムをWAVファイルとして残すか（デフォルトはメモリ上で受け渡し）
+        self.save_stems = os.getenv("ANISONG_SAVE_STEMS", "0") == "1"
+
+        # コードのみの解析（ビート同期クロマ + HMM）のパラメータ
+        self.chord_hmm_params = {
+            "hop_length": 512,
+            "self_transition": 0.9,  # 同じコードに留まる確率（大きいほどコードが切り替わりにくい）
+            "temperature": 20.0,     # テンプレートとの類似度を観測確率にするときの鋭さ
+            "silence_db": -40.0,     # 最大音量からこれ以下のビートはコードなし
+        }
+
+    def get_pipeline_params(self, mode: str, profile: Optional[str] = None) -> dict:
+        """
+        解析パイプラインのパラメータ一覧を取得（キャッシュキー用）
+
+        Args:
+            mode: "single"（フル楽曲をBasic Pitch）、"4tracks"（Demucs分離）
+                または "chords"（コードのみ。ノート変換なし）
+            profile: 分離プロファイル（"4tracks"のみ。Noneなら既定）
+
+        Returns:
+            結果に影響するすべてのパラメータのdict
+        """
+        params = {
+            "pipeline_version": PIPELINE_VERSION,
+            "mode": mode,
+            # ダウンロード形式（Opus/M4AかWAVか）で入力音声が変わる
+            "download": get_audio_downloader_service().get_params(),
+        }
+        if mode == "chords":
+            params["chords"] = self.chord_hmm_params
+            return params
+
+        params["basic_pitch"] = get_basic_pitch_service().get_params()
+        if mode == "4tracks":
+            params["separator"] = {
+                **get_audio_separator_service().get_params(profile),
+                # WAV保存時は16bitに量子化されたステムを変換するため結果が変わる
+                "save_stems": self.save_stems,
+            }
+            params["librosa"] = get_librosa_transcriber().get_params()
+        return params
+
+    def audio_to_midi(self, audio_path: str, offset: float = 0.0) -> dict:
         """
         音声ファイルをMIDIに変換（Basic Pitchを使用）
 
         Args:
             audio_path: 音声ファイルのパス
+            offset: 音声が曲の途中の区間の場合はその開始時刻（秒）。ノートの時刻に加算する
 
         Returns:
             {
                 "success": True/False,
                 "midi_path": MIDIファイルのパス,
-                "notes": ノート情報のリスト,
+                "notes": ノート列（NoteArray）,
                 "tempo": テンポ（BPM）- Basic Pitchはテンポ検出しないため120固定,
                 "error": エラーメッセージ（失敗時）
             }
@@ -51,31 +196,30 @@ class MagentaService:
             return {
                 "success": False,
                 "midi_path": None,
-                "notes": [],
+                "notes": NoteArray(),
                 "tempo": None,
                 "error": f"Audio file not found: {audio_path}",
             }
 
         try:
-            # Basic Pitchで音声を分析
-            basic_pitch = get_basic_pitch_service()
-            result = basic_pitch.transcribe_audio(str(audio_path))
+            # Basic Pitchで音声を分析（CPUワーカーで実行）
+            result = run_cpu_task(_transcribe_audio_stage, str(audio_path))
 
             if not result["success"]:
                 return {
                     "success": False,
                     "midi_path": None,
-                    "notes": [],
+                    "notes": NoteArray(),
                     "tempo": None,
                     "error": result["error"],
                 }
 
-            notes = result["notes"]
+            # 区間を解析した場合は曲の先頭からの時刻に戻す
+            notes = as_note_array(result["notes"]).shift(offset)
             tempo = result["tempo"] or 120  # Basic Pitchはテンポ検出しないため120をデフォルト
 
             # ノート情報をMIDIファイルに変換
-            midi_filename = audio_path.stem + ".mid"
-            midi_path = self.temp_dir / midi_filename
+            midi_path = self.temp_dir / f"{self._output_stem(audio_path)}.mid"
 
             self._notes_to_midi(notes, tempo, midi_path)
 
@@ -91,17 +235,50 @@ class MagentaService:
             return {
                 "success": False,
                 "midi_path": None,
-                "notes": [],
+                "notes": NoteArray(),
                 "tempo": None,
                 "error": f"Audio transcription failed: {str(e)}",
             }
 
-    def _notes_to_midi(self, notes: list[dict], tempo: int, midi_path: Path) -> None:
+    def audio_to_chords(self, audio_path: str, offset: float = 0.0) -> dict:
+        """
+        音声ファイルから直接コード進行を推定（ノート変換を行わない高速モード）
+
+        Args:
+            audio_path: 音声ファイルのパス
+            offset: 音声が曲の途中の区間の場合はその開始時刻（秒）。コードの時刻に加算する
+
+        Returns:
+            extract_chords_from_audioと同じ形式のdict
+        """
+        audio_path = Path(audio_path)
+        if not audio_path.exists():
+            return {
+                "success": False,
+                "tempo": None,
+                "duration": None,
+                "chords": [],
+                "error": f"Audio file not found: {audio_path}",
+            }
+
+        try:
+            # クロマ計算・ビート検出はCPUワーカーで実行
+            return run_cpu_task(_chords_stage, str(audio_path), offset)
+        except Exception as e:
+            return {
+                "success": False,
+                "tempo": None,
+                "duration": None,
+                "chords": [],
+                "error": f"Chord analysis failed: {str(e)}",
+            }
+
+    def _notes_to_midi(self, notes: NoteArray, tempo: int, midi_path: Path) -> None:
         """
-        ノート情報をMIDIファイルに変換
+        ノート列をMIDIファイルに変換
 
         Args:
-            notes: ノート情報のリスト
+            notes: ノート列
             tempo: テンポ（BPM）
             midi_path: 出力MIDIファイルのパス
         """
@@ -115,156 +292,210 @@ class MagentaService:
 
         ticks_per_beat = mid.ticks_per_beat
 
-        # ノートをイベントに変換
-        events = []
-        for note in notes:
-            pitch = note.get("pitch", 60)
-            start = note.get("start", 0)
-            end = note.get("end", start + 0.5)
-            velocity = note.get("velocity", 80)
-
-            # 時間をティックに変換
-            start_ticks = int(mido.second2tick(start, ticks_per_beat, tempo_microseconds))
-            end_ticks = int(mido.second2tick(end, ticks_per_beat, tempo_microseconds))
-
-            events.append((start_ticks, "note_on", pitch, velocity))
-            events.append((end_ticks, "note_off", pitch, 0))
+        # 時間をティックに変換（mido.second2tickと同じ計算）
+        scale = tempo_microseconds * 1e-6 / ticks_per_beat
+        start_ticks = np.rint(notes.start / scale).astype(np.int64)
+        end_ticks = np.rint(notes.end / scale).astype(np.int64)
 
-        # イベントを時間順にソート
-        events.sort(key=lambda x: (x[0], x[1] == "note_on"))
+        # ノートをイベントに変換し、時間順にソート（同じ時刻は note_off を先に）
+        ticks = np.concatenate([start_ticks, end_ticks])
+        is_note_on = np.concatenate([np.ones(len(notes), dtype=bool), np.zeros(len(notes), dtype=bool)])
+        pitches = np.concatenate([notes.pitch, notes.pitch])
+        velocities = np.concatenate([notes.velocity, np.zeros(len(notes), dtype=np.int64)])
+        order = np.lexsort((is_note_on, ticks))
 
         # 相対時間に変換してトラックに追加
-        last_tick = 0
-        for tick, msg_type, pitch, velocity in events:
-            delta = tick - last_tick
-            if msg_type == "note_on":
+        deltas = np.diff(ticks[order], prepend=0)
+        for delta, note_on, pitch, velocity in zip(
+            deltas.tolist(), is_note_on[order].tolist(), pitches[order].tolist(), velocities[order].tolist()
+        ):
+            if note_on:
                 track.append(mido.Message("note_on", note=pitch, velocity=velocity, time=delta))
             else:
                 track.append(mido.Message("note_off", note=pitch, velocity=0, time=delta))
-            last_tick = tick
 
         mid.save(midi_path)
 
-    def audio_to_4tracks(self, audio_path: str) -> dict:
+    def audio_to_4tracks_with_progress(
+        self, audio_path: str, profile: Optional[str] = None, offset: float = 0.0
+    ):
         """
-        音声ファイルを4トラックに分離してMIDI変換
+        4トラック分離・MIDI変換を進捗付きで実行（ジェネレータ）
+
+        各トラックは変換が終わった順に "track" イベントで返すため、
+        遅いトラック（ボーカルのpyin）を待たずに結果を表示できる。
+        offset（区間の開始時刻）を指定した場合、ノートの時刻は曲の先頭からの時刻で返す
 
         Args:
             audio_path: 音声ファイルのパス
+            profile: 分離プロファイル（fast / balanced / best。Noneなら既定）
+            offset: 音声が曲の途中の区間の場合はその開始時刻（秒）。ノートの時刻に加算する
 
-        Returns:
-            {
+        Yields:
+            {"stage": "separate" | "transcribe", "progress": 0-100, "message": "..."}
+            {"stage": "track", "progress": ..., "message": "...", "track": "bass", "tempo": 120, "data": {"notes": NoteArray, "midi_path": "..."}}
+            {"stage": "complete" | "error", "progress": ..., "message": "...", "result": {
                 "success": True/False,
                 "tempo": テンポ（BPM）,
                 "tracks": {
-                    "drums": {"notes": [...], "midi_path": "..."},
-                    "bass": {"notes": [...], "midi_path": "..."},
-                    "other": {"notes": [...], "midi_path": "..."},  # ギター/キーボード
-                    "vocals": {"notes": [], "midi_path": None},  # 使用しない
+                    "drums": {"notes": NoteArray, "midi_path": "..."},
+                    "bass": {"notes": NoteArray, "midi_path": "..."},
+                    "other": {"notes": NoteArray, "midi_path": "..."},  # ギター/キーボード
+                    "melody": {"notes": NoteArray, "midi_path": "..."},  # ボーカル
                 },
                 "error": エラーメッセージ（失敗時）
-            }
+            }}
         """
         audio_path = Path(audio_path)
         if not audio_path.exists():
-            return {
-                "success": False,
-                "tempo": None,
-                "tracks": {},
-                "error": f"Audio file not found: {audio_path}",
+            error = f"Audio file not found: {audio_path}"
+            yield {
+                "stage": "error",
+                "progress": 0,
+                "message": error,
+                "result": {"success": False, "tempo": None, "tracks": {}, "error": error},
             }
+            return
 
         separated_tracks = None
 
         try:
             # 1. 元の音声からテンポを検出（最も正確）
-            basic_pitch = get_basic_pitch_service()
-            tempo, _ = basic_pitch.detect_tempo(str(audio_path))
-            print(f"[Magenta] Detected tempo from original: {tempo:.1f} BPM")
-
-            # 2. Demucsで楽器分離
-            separator = get_audio_separator_service()
-            sep_result = separator.separate(str(audio_path))
+            # 2. Demucsで楽器分離（デコードを1回で済ませるため同じCPUワーカーで実行）
+            yield {"stage": "separate", "progress": 0, "message": "テンポ検出・楽器分離中（Demucs）..."}
+            tempo, sep_result = run_cpu_task(
+                _tempo_and_separate_stage, str(audio_path), not self.save_stems, profile
+            )
 
             if not sep_result["success"]:
-                return {
-                    "success": False,
-                    "tempo": None,
-                    "tracks": {},
-                    "error": f"Separation failed: {sep_result['error']}",
+                error = f"Separation failed: {sep_result['error']}"
+                yield {
+                    "stage": "error",
+                    "progress": 0,
+                    "message": error,
+                    "result": {"success": False, "tempo": None, "tracks": {}, "error": error},
                 }
+                return
 
             separated_tracks = sep_result["tracks"]
 
-            # 3. 各トラックをMIDI変換（楽器別に最適なツールを使用）
-            tracks = {}
-            librosa_transcriber = get_librosa_transcriber()
-
+            # 3. 各トラックをMIDI変換（楽器別に最適なツールをCPUワーカーで並列実行）
+            # トラック同士は独立しているので、全体の時間は最も遅いトラック程度になる
+            yield {"stage": "transcribe", "progress": 50, "message": "各トラックをMIDI変換中..."}
+            output_stem = self._output_stem(audio_path)
+            futures = {}
             for track_type, track_path in separated_tracks.items():
                 print(f"[Magenta] Processing {track_type} track: {track_path}")
-
-                # 楽器別に最適なツールを選択
-                if track_type == "drums":
-                    # ドラム: librosa onset_detect
-                    print(f"[Magenta] Using librosa for drums")
-                    result = librosa_transcriber.extract_drums(track_path, tempo=tempo)
-                    output_key = "drums"
-                elif track_type == "vocals":
-                    # ボーカル: librosa pyin（単音メロディに最適）
-                    print(f"[Magenta] Using librosa pyin for vocals")
-                    result = librosa_transcriber.extract_melody(track_path, tempo=tempo)
-                    output_key = "melody"
-                else:
-                    # ベース/その他: Basic Pitch（和音に最適）
-                    print(f"[Magenta] Using Basic Pitch for {track_type}")
-                    result = basic_pitch.transcribe_track(track_path, track_type, tempo=tempo)
-                    output_key = track_type
-
-                print(f"[Magenta] {track_type} result: success={result['success']}, notes={len(result.get('notes', []))}")
-
-                if result["success"]:
-                    notes = result["notes"]
-
-                    # MIDIファイルを生成
-                    midi_path = None
-                    if notes:
-                        midi_filename = f"{audio_path.stem}_{output_key}.mid"
-                        midi_path = self.temp_dir / midi_filename
-                        self._notes_to_midi(notes, tempo, midi_path)
-                        midi_path = str(midi_path)
-
-                    tracks[output_key] = {
-                        "notes": notes,
-                        "midi_path": midi_path,
-                    }
-                else:
-                    tracks[output_key] = {
-                        "notes": [],
-                        "midi_path": None,
-                        "error": result["error"],
+                future = submit_cpu_task(_transcribe_stem_stage, track_type, track_path, tempo)
+                futures[future] = track_type
+
+            results = {}
+            for future in as_completed(futures):
+                track_type = futures[future]
+                # ボーカルはメロディとして表示
+                output_key = "melody" if track_type == "vocals" else track_type
+                try:
+                    result = future.result()
+                except Exception as e:
+                    # 1トラックの失敗で全体を失敗にしない
+                    result = {
+                        "success": False,
+                        "notes": NoteArray(),
+                        "error": f"{track_type} transcription failed: {str(e)}",
                     }
+                results[track_type] = self._build_track(
+                    result, track_type, output_key, tempo, output_stem, offset
+                )
+                yield {
+                    "stage": "track",
+                    "progress": 50 + int(50 * len(results) / len(futures)),
+                    "message": f"{output_key} トラックの変換完了",
+                    "track": output_key,
+                    "tempo": round(tempo),
+                    "data": results[track_type],
+                }
 
-            return {
-                "success": True,
-                "tempo": round(tempo),
-                "tracks": tracks,
-                "error": None,
+            # 分離結果と同じ順序で返す
+            tracks = {}
+            for track_type in separated_tracks:
+                output_key = "melody" if track_type == "vocals" else track_type
+                tracks[output_key] = results[track_type]
+
+            yield {
+                "stage": "complete",
+                "progress": 100,
+                "message": "4トラック変換完了",
+                "result": {
+                    "success": True,
+                    "tempo": round(tempo),
+                    "tracks": tracks,
+                    "error": None,
+                },
             }
 
         except Exception as e:
-            return {
-                "success": False,
-                "tempo": None,
-                "tracks": {},
-                "error": f"4-track conversion failed: {str(e)}",
+            error = f"4-track conversion failed: {str(e)}"
+            yield {
+                "stage": "error",
+                "progress": 0,
+                "message": error,
+                "result": {"success": False, "tempo": None, "tracks": {}, "error": error},
             }
 
         finally:
-            # 分離したトラックをクリーンアップ
-            if separated_tracks:
+            # 分離したトラックをクリーンアップ（WAVを残す設定の場合は残す）
+            if separated_tracks and not self.save_stems:
                 separator = get_audio_separator_service()
                 separator.cleanup(separated_tracks)
 
+    @staticmethod
+    def _output_stem(audio_path: Path) -> str:
+        """
+        1回の解析で書き出すファイル名の元（音声ファイル名 + 実行ごとのID）
+
+        キャッシュしたダウンロードは同じ動画なら毎回同じファイル名になるため、
+        同じ動画を別の設定で同時に解析しても出力ファイルが上書きされないようにする
+        """
+        return f"{audio_path.stem}-{uuid.uuid4().hex[:8]}"
+
+    def _build_track(
+        self,
+        result: dict,
+        track_type: str,
+        output_key: str,
+        tempo: float,
+        output_stem: str,
+        offset: float = 0.0,
+    ) -> dict:
+        """
+        トラックの変換結果からレスポンス用のdictを作成（MIDIファイルも生成）
+
+        MIDIファイルは temp_dir/{output_stem}_{output_key}.mid に書き出す
+        """
+        print(f"[Magenta] {track_type} result: success={result['success']}, notes={len(result.get('notes', []))}")
+
+        if not result["success"]:
+            return {
+                "notes": NoteArray(),
+                "midi_path": None,
+                "error": result["error"],
+            }
+
+        # 区間を解析した場合は曲の先頭からの時刻に戻す
+        notes = as_note_array(result["notes"]).shift(offset)
+
+        # MIDIファイルを生成
+        midi_path = None
+        if len(notes):
+            midi_path = self.temp_dir / f"{output_stem}_{output_key}.mid"
+            self._notes_to_midi(notes, tempo, midi_path)
+            midi_path = str(midi_path)
+
+        return {
+            "notes": notes,
+            "midi_path": midi_path,
+        }
+
     def parse_midi(self, midi_path: str) -> dict:
         """
         MIDIファイルを解析してノート情報を抽出
@@ -354,94 +585,162 @@ class MagentaService:
                 "error": str(e),
             }
 
-    def extract_chords_from_notes(self, notes: list[dict], window_size: float = 0.5) -> list[dict]:
+    def extract_chords_from_notes(
+        self, notes: Union[NoteArray, list[dict]], window_size: float = 0.5
+    ) -> list[dict]:
         """
         ノート情報からコード進行を推定
 
         Args:
-            notes: ノート情報のリスト
+            notes: ノート列（NoteArrayまたはノート情報のリスト）
             window_size: コード検出のウィンドウサイズ（秒）
 
         Returns:
             コード情報のリスト
         """
-        if not notes:
+        notes = as_note_array(notes)
+        if not len(notes):
             return []
 
-        # ピッチクラス名
-        pitch_classes = ["C", "C#", "D", "D#", "E", "F", "F#", "G", "G#", "A", "A#", "B"]
-
-        # コードパターン（ルートからの半音数）
-        chord_patterns = {
-            "": [0, 4, 7],           # Major
-            "m": [0, 3, 7],          # Minor
-            "7": [0, 4, 7, 10],      # Dominant 7th
-            "M7": [0, 4, 7, 11],     # Major 7th
-            "m7": [0, 3, 7, 10],     # Minor 7th
-            "dim": [0, 3, 6],        # Diminished
-            "aug": [0, 4, 8],        # Augmented
-            "sus4": [0, 5, 7],       # Suspended 4th
-        }
+        # ウィンドウの開始時刻（0から window_size ずつ足していき、曲の終了時間の手前まで）
+        end_time = notes.end_time
+        steps = np.full(max(int(np.ceil(end_time / window_size)), 0) + 1, window_size)
+        window_starts = np.concatenate([[0.0], np.cumsum(steps)])
+        window_starts = window_starts[window_starts < end_time]
+        window_ends = window_starts + window_size
+
+        # 各ノートが鳴っているウィンドウの範囲 [first, last)
+        # （ウィンドウの開始・終了はどちらも増加するので二分探索で求まる）
+        first = np.searchsorted(window_ends, notes.start, side="right")
+        last = np.searchsorted(window_starts, notes.end, side="left")
+        sounding = first < last
+
+        # ウィンドウごとにピッチクラスのベロシティを集計
+        # 範囲の先頭に足して末尾の次で引き、ウィンドウ方向に累積する（ノート数 + ウィンドウ数の計算量）
+        pitch_class = notes.pitch[sounding] % 12
+        velocity = notes.velocity[sounding]
+        chroma = np.zeros((len(window_starts) + 1, 12), dtype=np.int64)
+        np.add.at(chroma, (first[sounding], pitch_class), velocity)
+        np.add.at(chroma, (last[sounding], pitch_class), -velocity)
+        chroma = np.cumsum(chroma[:-1], axis=0)
+
+        # 最も可能性の高いコードを検出し、変化したところだけ残す
+        chords = []
+        for time, chord in zip(window_starts.tolist(), self._detect_chords(chroma)):
+            if chord and (not chords or chords[-1]["chord"] != chord):
+                chords.append({
+                    "time": round(time, 2),
+                    "chord": chord,
+                })
+
+        return chords
 
-        # 曲の終了時間
-        end_time = max(n["end"] for n in notes)
+    def _detect_chords(self, chroma: np.ndarray) -> list[Optional[str]]:
+        """
+        ウィンドウごとのピッチクラスの重みからコードを推定
 
-        chords = []
-        current_time = 0
+        全コードのテンプレートとの行列積でスコアを求め、最もスコアの高いコードを選ぶ
+        （同点ならルート順 → CHORD_PATTERNSの順で先のもの）
 
-        while current_time < end_time:
-            window_end = current_time + window_size
+        Args:
+            chroma: [windows, 12] のピッチクラスごとの重み
 
-            # ウィンドウ内のノートを収集
-            window_notes = [
-                n for n in notes
-                if n["start"] < window_end and n["end"] > current_time
-            ]
+        Returns:
+            ウィンドウごとのコード名（音がないウィンドウはNone）
+        """
+        scores = chroma @ CHORD_TEMPLATES
+        best = np.argmax(scores, axis=1)
+        best_scores = scores[np.arange(len(scores)), best]
+        return [
+            CHORD_NAMES[index] if score > 0 else None
+            for index, score in zip(best.tolist(), best_scores.tolist())
+        ]
+
+    def extract_chords_from_audio(
+        self, audio: Union[str, AudioBuffer], offset: float = 0.0
+    ) -> dict:
+        """
+        音声から直接コード進行を推定（ノート変換なし）
 
-            if window_notes:
-                # ピッチクラスを集計
-                pitch_class_counts = {}
-                for note in window_notes:
-                    pc = note["pitch"] % 12
-                    pitch_class_counts[pc] = pitch_class_counts.get(pc, 0) + note["velocity"]
+        1. ビート位置を検出し、ビートごとに平均したクロマ（ピッチクラスごとの強さ）を求める
+        2. 各ビートのクロマとコードテンプレート（extract_chords_from_notesと同じ語彙）の
+           コサイン類似度を観測確率にする（無音のビートは「コードなし」）
+        3. 同じコードに留まりやすいHMMをViterbiで復号し、ビートごとのばらつきを抑える
 
-                # 最も可能性の高いコードを検出
-                best_chord = self._detect_chord(pitch_class_counts, pitch_classes, chord_patterns)
+        Args:
+            audio: 音声ファイルのパスまたはAudioBuffer
+            offset: 音声が曲の途中の区間の場合はその開始時刻（秒）。コードの時刻に加算する
 
-                if best_chord and (not chords or chords[-1]["chord"] != best_chord):
+        Returns:
+            {
+                "success": True/False,
+                "tempo": テンポ（BPM）,
+                "duration": 曲の長さ（秒、offsetを含む）,
+                "chords": コード情報のリスト（extract_chords_from_notesと同じ形式）,
+                "error": エラーメッセージ（失敗時）
+            }
+        """
+        try:
+            sr = 22050
+            params = self.chord_hmm_params
+            hop_length = params["hop_length"]
+            y = as_audio_buffer(audio, decode_sample_rate=sr).mono(sr)
+            if len(y) == 0:
+                return {"success": False, "tempo": None, "duration": None, "chords": [], "error": "Audio file is empty"}
+
+            # 1. ビートごとのクロマと音量（テンポ検出はフル楽曲解析と同じ）
+            tempo, beat_times = get_basic_pitch_service().detect_tempo(AudioBuffer(samples=y, sample_rate=sr))
+            chroma = librosa.feature.chroma_cqt(y=y, sr=sr, hop_length=hop_length)
+            rms = librosa.feature.rms(y=y, hop_length=hop_length)[0][: chroma.shape[1]]
+            beat_frames = librosa.time_to_frames(beat_times, sr=sr, hop_length=hop_length)
+            bounds = librosa.util.fix_frames(beat_frames, x_min=0, x_max=chroma.shape[1])
+            beat_chroma = librosa.util.sync(chroma, bounds, aggregate=np.mean, pad=False)
+            beat_rms = librosa.util.sync(rms[np.newaxis], bounds, aggregate=np.mean, pad=False)[0]
+            beat_starts = librosa.frames_to_time(bounds[:-1], sr=sr, hop_length=hop_length)
+
+            # 2. 観測確率（コード × ビート。最後の行が「コードなし」）
+            templates = CHORD_TEMPLATES / np.linalg.norm(CHORD_TEMPLATES, axis=0)
+            beat_chroma = beat_chroma / np.maximum(np.linalg.norm(beat_chroma, axis=0), 1e-9)
+            silent = beat_rms <= rms.max() * 10 ** (params["silence_db"] / 20)
+            similarity = np.vstack([(templates.T @ beat_chroma) * ~silent, silent])
+            logits = similarity * params["temperature"]
+            prob = np.exp(logits - logits.max(axis=0))
+            prob /= prob.sum(axis=0)
+
+            # 3. Viterbiで最も確からしいコード列を求める
+            transition = librosa.sequence.transition_loop(len(CHORD_NAMES) + 1, params["self_transition"])
+            states = librosa.sequence.viterbi(prob, transition)
+
+            # コードが変化したところだけ残す（コードなしのビートは飛ばす）
+            chords = []
+            for time, state in zip(beat_starts.tolist(), states.tolist()):
+                if state == len(CHORD_NAMES):
+                    continue
+                chord = CHORD_NAMES[state]
+                if not chords or chords[-1]["chord"] != chord:
                     chords.append({
-                        "time": round(current_time, 2),
-                        "chord": best_chord,
+                        "time": round(time + offset, 2),
+                        "chord": chord,
                     })
 
-            current_time += window_size
-
-        return chords
+            print(f"[Magenta] Chords from audio: {len(chords)} changes over {len(states)} beats")
+            return {
+                "success": True,
+                "tempo": round(tempo),
+                "duration": round(offset + len(y) / sr, 2),
+                "chords": chords,
+                "error": None,
+            }
 
-    def _detect_chord(
-        self, pitch_counts: dict, pitch_classes: list, patterns: dict
-    ) -> Optional[str]:
-        """ピッチクラスの出現からコードを推定"""
-        if not pitch_counts:
-            return None
-
-        best_score = 0
-        best_chord = None
-
-        # 各ルート音について試行
-        for root in range(12):
-            for chord_type, intervals in patterns.items():
-                score = 0
-                for interval in intervals:
-                    pc = (root + interval) % 12
-                    if pc in pitch_counts:
-                        score += pitch_counts[pc]
-
-                if score > best_score:
-                    best_score = score
-                    best_chord = pitch_classes[root] + chord_type
-
-        return best_chord
+        except Exception as e:
+            print(f"[Magenta] Chord analysis error: {type(e).__name__}: {str(e)}")
+            return {
+                "success": False,
+                "tempo": None,
+                "duration": None,
+                "chords": [],
+                "error": f"Chord analysis failed: {str(e)}",
+            }
 
     def cleanup(self, midi_path: str) -> bool:
         """MIDIファイルを削除"""
@@ -0,0 +1,255 @@
+"""
+ノート列の配列表現と共通処理
+
+解析結果のノートは1曲で数万個になり、dictのリストでは生成・コピーのたびに
+メモリと時間がかかるため、pitch / start / end / velocity / confidence の列を持つ
+構造化配列（NoteArray）で各サービス間を受け渡す
+
+- ソート・時間での切り出し・結合・マージは配列の演算で行う
+- dictのリストへの変換はAPIの応答を作るときだけ行う（to_dicts）
+
+confidence を持たないノート（librosaの変換結果など）は confidence を NaN にし、
+dictに変換するときはキーを付けない
+"""
+from typing import Iterable, Optional, Union
+
+import numpy as np
+
+NOTE_DTYPE = np.dtype([
+    ("pitch", np.int64),
+    ("start", np.float64),
+    ("end", np.float64),
+    ("velocity", np.int64),
+    ("confidence", np.float64),
+])
+
+
+def python_round(values: np.ndarray, ndigits: int) -> np.ndarray:
+    """
+    配列をPythonのround(x, ndigits)と同じ結果に丸める
+
+    np.round は x * 10**ndigits を丸めるため、ちょうど半分付近の値で
+    Pythonのround（10進での正確な丸め）と結果が変わることがある。
+    その付近の値だけPythonのroundで丸め直す
+    """
+    scale = 10.0 ** ndigits
+    scaled = values * scale
+    rounded = np.rint(scaled) / scale
+    for i in np.flatnonzero(np.abs(scaled - np.floor(scaled) - 0.5) < 1e-6):
+        rounded[i] = round(float(values[i]), ndigits)
+    return rounded
+
+
+class NoteArray:
+    """ノート列（NOTE_DTYPEの構造化配列を保持する）"""
+
+    __slots__ = ("data",)
+
+    def __init__(self, data: Optional[np.ndarray] = None):
+        """
+        Args:
+            data: NOTE_DTYPE の配列（Noneなら空）
+        """
+        self.data = np.empty(0, dtype=NOTE_DTYPE) if data is None else data
+
+    @classmethod
+    def from_columns(
+        cls,
+        pitch: np.ndarray,
+        start: np.ndarray,
+        end: np.ndarray,
+        velocity: np.ndarray,
+        confidence: Optional[np.ndarray] = None,
+    ) -> "NoteArray":
+        """列ごとの配列から作成（confidenceがなければNaN）"""
+        data = np.empty(len(pitch), dtype=NOTE_DTYPE)
+        data["pitch"] = pitch
+        data["start"] = start
+        data["end"] = end
+        data["velocity"] = velocity
+        data["confidence"] = np.nan if confidence is None else confidence
+        return cls(data)
+
+    @classmethod
+    def from_dicts(cls, notes: list[dict]) -> "NoteArray":
+        """
+        ノートのdictのリストから作成
+
+        Args:
+            notes: {"pitch", "start", "end", "velocity", ["confidence"]} のリスト
+        """
+        data = np.empty(len(notes), dtype=NOTE_DTYPE)
+        for name in ("pitch", "start", "end", "velocity"):
+            data[name] = [note[name] for note in notes]
+        data["confidence"] = [note.get("confidence", np.nan) for note in notes]
+        return cls(data)
+
+    @classmethod
+    def concatenate(cls, arrays: Iterable["NoteArray"]) -> "NoteArray":
+        """複数のノート列を順につなげる（ソートはしない）"""
+        arrays = [a.data for a in arrays]
+        if not arrays:
+            return cls()
+        return cls(np.concatenate(arrays))
+
+    @property
+    def pitch(self) -> np.ndarray:
+        return self.data["pitch"]
+
+    @property
+    def start(self) -> np.ndarray:
+        return self.data["start"]
+
+    @property
+    def end(self) -> np.ndarray:
+        return self.data["end"]
+
+    @property
+    def velocity(self) -> np.ndarray:
+        return self.data["velocity"]
+
+    @property
+    def confidence(self) -> np.ndarray:
+        return self.data["confidence"]
+
+    @property
+    def end_time(self) -> float:
+        """最後のノートの終了時刻（ノートがなければ0）"""
+        return float(self.data["end"].max()) if len(self.data) else 0.0
+
+    def __len__(self) -> int:
+        return len(self.data)
+
+    def __getitem__(self, index: Union[slice, np.ndarray]) -> "NoteArray":
+        """スライス・インデックス配列・マスクで取り出す"""
+        return NoteArray(self.data[index])
+
+    def __repr__(self) -> str:
+        return f"NoteArray({len(self)} notes)"
+
+    def sort(self) -> "NoteArray":
+        """開始時間順に並べ替え（同じ開始時間は元の順序を保つ）"""
+        return NoteArray(self.data[np.argsort(self.data["start"], kind="stable")])
+
+    def between(self, start: float, end: float) -> "NoteArray":
+        """
+        指定した時間範囲に鳴っているノートを取り出す
+
+        Args:
+            start: 範囲の開始時刻（秒）
+            end: 範囲の終了時刻（秒）
+
+        Returns:
+            start < ノートの終了 かつ ノートの開始 < end のノート
+        """
+        return NoteArray(self.data[(self.data["start"] < end) & (self.data["end"] > start)])
+
+    def shift(self, offset: float) -> "NoteArray":
+        """
+        開始・終了時刻をずらす（小数点以下3桁に丸める）
+
+        区間を解析したノートの時刻を曲の先頭からの時刻に戻すのに使う
+        """
+        if not offset:
+            return self
+        data = self.data.copy()
+        data["start"] = python_round(data["start"] + offset, 3)
+        data["end"] = python_round(data["end"] + offset, 3)
+        return NoteArray(data)
+
+    def merge(self, gap_threshold: float, velocity: str = "average", by_pitch: bool = True) -> "NoteArray":
+        """同じピッチの隣接ノートをマージ（merge_notesを参照）"""
+        return NoteArray(merge_notes(self.data, gap_threshold, velocity=velocity, by_pitch=by_pitch))
+
+    def to_dicts(self, confidence: bool = True) -> list[dict]:
+        """
+        ノートのdictのリストに変換（APIの応答用）
+
+        Args:
+            confidence: confidence を含めるか（NaNのノートには付けない）
+
+        Returns:
+            {"pitch", "start", "end", "velocity", ["confidence"]} のリスト
+        """
+        result = [
+            {"pitch": p, "start": s, "end": e, "velocity": v}
+            for p, s, e, v in zip(
+                self.data["pitch"].tolist(),
+                self.data["start"].tolist(),
+                self.data["end"].tolist(),
+                self.data["velocity"].tolist(),
+            )
+        ]
+        if confidence:
+            values = self.data["confidence"]
+            has_confidence = ~np.isnan(values)
+            for i, c in zip(np.flatnonzero(has_confidence).tolist(), values[has_confidence].tolist()):
+                result[i]["confidence"] = c
+        return result
+
+
+def as_note_array(notes: Union[NoteArray, list[dict]]) -> NoteArray:
+    """NoteArrayまたはノートのdictのリストをNoteArrayに揃える"""
+    if isinstance(notes, NoteArray):
+        return notes
+    return NoteArray.from_dicts(notes)
+
+
+def merge_notes(
+    notes: np.ndarray,
+    gap_threshold: float,
+    velocity: str = "average",
+    by_pitch: bool = True,
+) -> np.ndarray:
+    """
+    同じピッチの隣接ノートをマージしてぶつ切りを解消
+
+    前のノートの終了から次のノートの開始までのギャップがしきい値以下ならつなげる
+    （終了時間は後のノートの終了時間、confidence は最大値）
+
+    Args:
+        notes: NOTE_DTYPE の配列（開始時間順）
+        gap_threshold: マージする最大ギャップ（秒）
+        velocity: マージしたノートのベロシティ
+            "average": (前の値 + 次の値) // 2 を順に適用
+            "max": 最大値
+        by_pitch: Trueならピッチごとに開始時間順に並べてマージし、結果を開始時間順に並べる
+            （同じ開始時間はピッチが先に現れた順）。Falseなら連続するノート同士だけをマージする
+
+    Returns:
+        マージされたノートの配列
+    """
+    if len(notes) < 2:
+        return notes.copy()
+
+    if by_pitch:
+        # ピッチが最初に現れた位置（結果の並び順で使う）
+        _, first_index, inverse = np.unique(notes["pitch"], return_index=True, return_inverse=True)
+        order = np.lexsort((notes["start"], notes["pitch"]))
+        notes = notes[order]
+        pitch_rank = first_index[inverse][order]
+
+    # 前のノートと同じピッチで、ギャップがしきい値以下ならマージ
+    joins = np.zeros(len(notes), dtype=bool)
+    joins[1:] = (notes["pitch"][1:] == notes["pitch"][:-1]) & (
+        notes["start"][1:] - notes["end"][:-1] <= gap_threshold
+    )
+    heads = np.flatnonzero(~joins)
+    lasts = np.append(heads[1:], len(notes)) - 1
+
+    merged = notes[heads]
+    merged["end"] = notes["end"][lasts]
+    merged["confidence"] = np.fmax.reduceat(notes["confidence"], heads)
+    if velocity == "max":
+        merged["velocity"] = np.maximum.reduceat(notes["velocity"], heads)
+    else:
+        # k番目のノートまでマージした値を、マージするノートが残っている区間だけまとめて更新
+        lengths = lasts - heads + 1
+        merged_velocity = merged["velocity"]
+        for k in range(1, int(lengths.max())):
+            runs = np.flatnonzero(lengths > k)
+            merged_velocity[runs] = (merged_velocity[runs] + notes["velocity"][heads[runs] + k]) // 2
+
+    if by_pitch:
+        merged = merged[np.lexsort((heads, pitch_rank[heads], merged["start"]))]
+    return merged
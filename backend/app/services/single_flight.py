@@ -0,0 +1,161 @@
+"""
+同一処理の重複実行防止（Single-flight）
+
+同じキー（video_id + パラメータ）の解析が同時に要求された場合、
+最初の要求だけがパイプラインを実行し、後続の要求は同じ実行に合流して
+進捗イベントと最終結果を受け取る
+
+購読者が全員いなくなった（SSEのクライアントが全員切断した）処理はキャンセルし、
+ダウンロード中のyt-dlpなども止める。キャンセルした処理にはそれ以降合流させない
+"""
+import asyncio
+from typing import AsyncGenerator, AsyncIterator, Callable, Optional
+
+
+# 処理の最後に送るイベントの stage
+TERMINAL_STAGES = ("complete", "error")
+
+
+class Flight:
+    """実行中の処理1件（イベント履歴 + 購読者への通知）"""
+
+    def __init__(self, key: str, on_cancel: Optional[Callable[["Flight"], None]] = None):
+        """
+        Args:
+            key: 重複判定キー
+            on_cancel: 最後の購読者が抜けて処理をキャンセルするときに呼ぶ関数
+        """
+        self.key = key
+        self.events: list[dict] = []
+        self.done = False
+        self.task: Optional[asyncio.Task] = None
+        self.subscribers = 0
+        self._on_cancel = on_cancel
+        self._condition = asyncio.Condition()
+
+    @property
+    def terminated(self) -> bool:
+        """complete または error のイベントを送ったか"""
+        return bool(self.events) and self.events[-1]["stage"] in TERMINAL_STAGES
+
+    async def publish(self, event: dict) -> None:
+        """イベントを履歴に追加して購読者に通知"""
+        async with self._condition:
+            self.events.append(event)
+            self._condition.notify_all()
+
+    async def finish(self) -> None:
+        """処理完了を通知"""
+        async with self._condition:
+            self.done = True
+            self._condition.notify_all()
+
+    async def subscribe(self) -> AsyncGenerator[dict, None]:
+        """
+        イベントを購読
+
+        途中から合流した場合も、それまでのイベントを先に受け取る。
+        完了前に最後の購読者が抜けた場合は処理をキャンセルする
+        """
+        index = 0
+        self.subscribers += 1
+        try:
+            while True:
+                while index < len(self.events):
+                    yield self.events[index]
+                    index += 1
+                if self.done:
+                    return
+                async with self._condition:
+                    await self._condition.wait_for(
+                        lambda: index < len(self.events) or self.done
+                    )
+        finally:
+            self.subscribers -= 1
+            if self.subscribers == 0 and not self.done and self.task is not None:
+                # キャンセルが_runに届くまでの間に再接続したクライアントが合流しないようにする
+                if self._on_cancel is not None:
+                    self._on_cancel(self)
+                self.task.cancel()
+
+    async def result(self) -> Optional[dict]:
+        """
+        処理完了を待って最後のイベント（complete または error）を返す
+        """
+        last_event = None
+        async for event in self.subscribe():
+            last_event = event
+        return last_event
+
+
+class SingleFlight:
+    """キーごとに実行中の処理を1つにまとめる"""
+
+    def __init__(self):
+        self._flights: dict[str, Flight] = {}
+
+    def join(self, key: str, producer: Callable[[], AsyncIterator[dict]]) -> Flight:
+        """
+        実行中の処理に合流（なければ新しく開始）
+
+        処理はリクエストから独立したタスクで実行されるため、
+        最初のクライアントが切断しても他の購読者には結果が届く
+        （購読者が全員抜けた場合はキャンセルされる）
+
+        Args:
+            key: 重複判定キー
+            producer: 進捗イベントを順に返す非同期ジェネレータを作る関数
+
+        Returns:
+            Flight
+        """
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = Flight(key, on_cancel=self._forget)
+            self._flights[key] = flight
+            flight.task = asyncio.create_task(self._run(flight, producer))
+        return flight
+
+    def is_running(self, key: str) -> bool:
+        """指定キーの処理が実行中か"""
+        return key in self._flights
+
+    def _forget(self, flight: Flight) -> None:
+        """処理を一覧から外す（以降の同じキーの要求は新しく開始する）"""
+        if self._flights.get(flight.key) is flight:
+            del self._flights[flight.key]
+
+    async def _run(self, flight: Flight, producer: Callable[[], AsyncIterator[dict]]) -> None:
+        try:
+            async for event in producer():
+                await flight.publish(event)
+        except Exception as e:
+            await flight.publish({
+                "stage": "error",
+                "progress": 0,
+                "message": f"解析エラー: {str(e)}",
+                "status_code": 500,
+            })
+        finally:
+            self._forget(flight)
+            # キャンセルなどで complete / error を送らずに終わった場合も購読者にエラーを返す
+            if not flight.terminated:
+                await flight.publish({
+                    "stage": "error",
+                    "progress": 0,
+                    "message": "解析エラー: 解析が中断されました",
+                    "status_code": 500,
+                })
+            await flight.finish()
+
+
+# シングルトンインスタンス
+_single_flight: Optional[SingleFlight] = None
+
+
+def get_single_flight() -> SingleFlight:
+    """SingleFlightのシングルトンを取得"""
+    global _single_flight
+    if _single_flight is None:
+        _single_flight = SingleFlight()
+    return _single_flight
@@ -0,0 +1,280 @@
+"""
+分離済みステムのキャッシュ
+
+楽器分離（Demucs）は解析で最も重い処理のため、分離したステムを
+デコード済み音声のハッシュ + 分離パラメータ（モデル・プロファイル等）をキーに保存し、
+同じ音声の再解析・パラメータ変更時はファイルの読み出しだけで済ませる
+
+- 形式: ステムごとの32bit浮動小数点WAV（ステレオ）。Demucsの出力をそのまま保存するため、
+  キャッシュから読んだステムは分離し直した結果と同じになる（整数PCMのFLACでは
+  ±1.0を超える値がクリップされ、量子化もされる）。区間ごとに書き出すのでメモリ使用量は一定
+- 書き込み: 一時ディレクトリに書いてからリネーム（書き込み途中のエントリを読ませない）
+- 容量: 上限を超えたら最後に使った時刻（mtime）が古いエントリから削除（LRU）
+
+複数のワーカープロセスから同時に使われるため、状態はすべてディスク上に置く
+"""
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+import uuid
+from pathlib import Path
+from typing import Iterator, Optional
+
+import numpy as np
+import soundfile as sf
+
+from app.services.audio_buffer import AudioBuffer
+
+
+class CachedStems:
+    """キャッシュから読み出すステム（区間ごとにデコード）"""
+
+    def __init__(self, entry_dir: Path, stems: list[str]):
+        self.entry_dir = entry_dir
+        self.stems = stems
+        self._files = {name: sf.SoundFile(str(entry_dir / f"{name}.wav")) for name in stems}
+        first = self._files[stems[0]]
+        self.sample_rate = first.samplerate
+        self.channels = first.channels
+        self.length = first.frames
+
+    def iter_chunks(self, block_seconds: float = 30.0) -> Iterator[tuple[int, dict]]:
+        """
+        ステムを区間ごとに返す（AudioSeparatorService.iter_separated_chunksと同じ形式）
+
+        Yields:
+            (開始サンプル位置, {ステム名: [channels, samples] のfloat32配列})
+        """
+        block = max(1, int(block_seconds * self.sample_rate))
+        offset = 0
+        while offset < self.length:
+            chunk = {
+                name: f.read(block, dtype="float32", always_2d=True).T
+                for name, f in self._files.items()
+            }
+            yield offset, chunk
+            offset += block
+
+    def close(self) -> None:
+        for f in self._files.values():
+            f.close()
+
+
+class StemCacheWriter:
+    """分離結果を区間ごとにキャッシュへ書き込む"""
+
+    def __init__(self, cache: "StemCacheService", key: str, stems: list[str], sample_rate: int, channels: int):
+        self.cache = cache
+        self.key = key
+        self.stems = stems
+        # 同じディレクトリ内の一時ディレクトリに書き、完了したらリネームする
+        self.tmp_dir = cache.cache_dir / f".tmp-{key}-{uuid.uuid4().hex[:8]}"
+        self.tmp_dir.mkdir(parents=True)
+        self._files = {
+            name: sf.SoundFile(
+                str(self.tmp_dir / f"{name}.wav"),
+                "w",
+                samplerate=sample_rate,
+                channels=channels,
+                format="WAV",
+                subtype="FLOAT",
+            )
+            for name in stems
+        }
+
+    def write(self, chunk: dict) -> None:
+        """
+        1区間分のステムを書き込む
+
+        Args:
+            chunk: {ステム名: [channels, samples] のfloat32配列}
+        """
+        for name, audio in chunk.items():
+            self._files[name].write(audio.T)
+
+    def commit(self) -> None:
+        """
+        書き込みを完了してエントリとして公開（容量を超えたら古いエントリを削除）
+
+        キャッシュへの保存に失敗しても分離自体は成功しているため、例外は投げない
+        """
+        try:
+            for f in self._files.values():
+                f.close()
+            with open(self.tmp_dir / "meta.json", "w", encoding="utf-8") as f:
+                json.dump({"stems": self.stems, "created_at": time.time()}, f)
+        except Exception as e:
+            print(f"[StemCache] Failed to write {self.key}: {e}")
+            self.abort()
+            return
+
+        try:
+            os.rename(self.tmp_dir, self.cache._entry_dir(self.key))
+        except OSError:
+            # 別のワーカーが先に同じエントリを書き込んだ
+            shutil.rmtree(self.tmp_dir, ignore_errors=True)
+            return
+        self.cache.evict()
+
+    def abort(self) -> None:
+        """書き込みを中止して一時ファイルを削除"""
+        for f in self._files.values():
+            try:
+                f.close()
+            except Exception:
+                pass
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+
+class StemCacheService:
+    """ディスク上の分離済みステムキャッシュ（容量上限付きLRU）"""
+
+    # これより古い書き込み途中のエントリは削除する（秒）
+    STALE_TMP_SECONDS = 3600
+
+    def __init__(self):
+        # キャッシュディレクトリ（共有ディレクトリを優先）
+        custom_dir = os.getenv("ANISONG_STEM_CACHE_DIR")
+        if custom_dir:
+            self.cache_dir = Path(custom_dir)
+        else:
+            self.cache_dir = Path(tempfile.gettempdir()) / "anisong_stems"
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+        # キャッシュの最大容量（MB）。0ならキャッシュしない
+        self.max_bytes = int(float(os.getenv("ANISONG_STEM_CACHE_MAX_MB", "2048")) * 1024 * 1024)
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+    def make_key(self, audio: AudioBuffer, params: dict) -> str:
+        """
+        キャッシュキーを生成
+
+        Args:
+            audio: 分離する音声（デコード済みの波形でハッシュする）
+            params: 分離パラメータ（モデル・プロファイル・区間長など）
+
+        Returns:
+            音声と分離パラメータのハッシュ
+        """
+        digest = hashlib.sha256()
+        digest.update(json.dumps(params, sort_keys=True, default=str).encode("utf-8"))
+        digest.update(f"{audio.sample_rate}:{audio.samples.shape}".encode("utf-8"))
+        digest.update(np.ascontiguousarray(audio.samples).data)
+        return digest.hexdigest()[:32]
+
+    def open(self, key: str) -> Optional[CachedStems]:
+        """
+        キャッシュされたステムを開く
+
+        Returns:
+            CachedStems（キャッシュがない・壊れている場合はNone）。使い終わったらclose()する
+        """
+        if not self.enabled:
+            return None
+
+        entry_dir = self._entry_dir(key)
+        try:
+            with open(entry_dir / "meta.json", "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            cached = CachedStems(entry_dir, meta["stems"])
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            print(f"[StemCache] Broken cache entry {key}: {e}")
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            return None
+
+        # 最後に使った時刻を更新（LRU）
+        try:
+            os.utime(entry_dir)
+        except OSError:
+            pass
+        return cached
+
+    def writer(self, key: str, stems: list[str], sample_rate: int, channels: int) -> Optional[StemCacheWriter]:
+        """
+        キャッシュへの書き込みを開始
+
+        Returns:
+            StemCacheWriter（キャッシュ無効・書き込めない場合はNone）
+        """
+        if not self.enabled:
+            return None
+        try:
+            return StemCacheWriter(self, key, stems, sample_rate, channels)
+        except Exception as e:
+            print(f"[StemCache] Failed to start writing {key}: {e}")
+            return None
+
+    def evict(self) -> int:
+        """
+        容量の上限を超えていれば、最後に使った時刻が古いエントリから削除
+
+        Returns:
+            削除したエントリ数
+        """
+        entries = []
+        total = 0
+        now = time.time()
+        for entry_dir in self.cache_dir.iterdir():
+            if not entry_dir.is_dir():
+                continue
+            if entry_dir.name.startswith(".tmp-"):
+                # 異常終了したワーカーが残した書き込み途中のエントリ
+                try:
+                    if now - entry_dir.stat().st_mtime > self.STALE_TMP_SECONDS:
+                        shutil.rmtree(entry_dir, ignore_errors=True)
+                except FileNotFoundError:
+                    pass
+                continue
+            try:
+                size = sum(p.stat().st_size for p in entry_dir.iterdir())
+                entries.append((entry_dir.stat().st_mtime, size, entry_dir))
+            except FileNotFoundError:
+                # 他のワーカーが削除中
+                continue
+            total += size
+
+        count = 0
+        for _, size, entry_dir in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            total -= size
+            count += 1
+        return count
+
+    def clear(self) -> int:
+        """
+        キャッシュをすべて削除
+
+        Returns:
+            削除したエントリ数
+        """
+        count = 0
+        for entry_dir in self.cache_dir.iterdir():
+            if entry_dir.is_dir():
+                shutil.rmtree(entry_dir, ignore_errors=True)
+                count += 1
+        return count
+
+    def _entry_dir(self, key: str) -> Path:
+        return self.cache_dir / key
+
+
+# シングルトンインスタンス
+_stem_cache_service: Optional[StemCacheService] = None
+
+
+def get_stem_cache_service() -> StemCacheService:
+    """StemCacheServiceのシングルトンを取得"""
+    global _stem_cache_service
+    if _stem_cache_service is None:
+        _stem_cache_service = StemCacheService()
+    return _stem_cache_service
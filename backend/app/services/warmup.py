@@ -0,0 +1,158 @@
+"""
+起動時ウォームアップ
+
+デプロイ直後の最初の解析だけが遅くならないよう、起動時に
+- Demucs / Basic Pitch のモデルをロード
+- 短い合成音声で各処理を一度実行（librosaのpyin / beat_track のnumba JITなど）
+してから準備完了（/ready）を報告する
+
+numbaのJITキャッシュはディスクに保存されるため、NUMBA_CACHE_DIR を
+永続ボリュームに向けておけば再起動後のコンパイルも省ける
+"""
+import asyncio
+import os
+import time
+from typing import Optional
+
+import numpy as np
+
+from app.services.executors import run_in_thread, start_cpu_workers
+
+
+def make_warmup_clip(duration: float = 4.0, sample_rate: int = 44100) -> np.ndarray:
+    """
+    ウォームアップ用の合成音声を作成
+
+    ベース・和音・メロディ・クリック（ドラム代わり）を重ねた120BPMのステレオ音声
+
+    Returns:
+        [2, samples] のfloat32配列
+    """
+    t = np.arange(int(duration * sample_rate)) / sample_rate
+    beat = 0.5  # 120BPM
+
+    # C - G のコード（ベース + 和音）
+    first_half = t < duration / 2
+    bass = np.where(first_half, np.sin(2 * np.pi * 65.41 * t), np.sin(2 * np.pi * 98.00 * t))
+    chord_freqs = np.where(first_half[:, None], [261.63, 329.63, 392.00], [196.00, 246.94, 293.66])
+    chord = np.sin(2 * np.pi * chord_freqs * t[:, None]).sum(axis=1) / 3
+
+    # 1拍ごとに音が変わるメロディ
+    melody_notes = np.array([523.25, 587.33, 659.25, 698.46])
+    melody = np.sin(2 * np.pi * melody_notes[(t / beat).astype(int) % 4] * t)
+
+    # 拍頭のクリック
+    clicks = np.exp(-((t % beat) * 200)) * np.sin(2 * np.pi * 1000 * t)
+
+    mix = 0.3 * bass + 0.2 * chord + 0.2 * melody + 0.3 * clicks
+    return np.stack([mix, mix]).astype(np.float32)
+
+
+def warm_up_stages() -> dict:
+    """
+    合成音声で各処理を一度実行（CPUワーカー内で呼ばれる）
+
+    失敗した処理があっても他の処理は続ける
+
+    Returns:
+        {処理名: {"ok": True/False, "seconds": 所要時間, "error": エラー}}
+    """
+    from app.services.audio_buffer import AudioBuffer
+    from app.services.audio_separator import get_audio_separator_service
+    from app.services.basic_pitch_service import get_basic_pitch_service
+    from app.services.librosa_transcriber import get_librosa_transcriber
+
+    audio = AudioBuffer(samples=make_warmup_clip(), sample_rate=44100)
+    basic_pitch = get_basic_pitch_service()
+    librosa_transcriber = get_librosa_transcriber()
+    separator = get_audio_separator_service()
+
+    def separate():
+        result = separator.separate(audio, in_memory=True)
+        separator.cleanup(result["tracks"])
+        return result
+
+    stages = {
+        "tempo": lambda: basic_pitch.detect_tempo(audio),
+        "basic_pitch": lambda: basic_pitch.transcribe_track(audio, "other", tempo=120.0),
+        "melody": lambda: librosa_transcriber.extract_melody(audio, tempo=120.0),
+        "drums": lambda: librosa_transcriber.extract_drums(audio, tempo=120.0),
+        "separate": separate,
+    }
+
+    report = {}
+    for name, stage in stages.items():
+        started = time.perf_counter()
+        try:
+            result = stage()
+            error = result.get("error") if isinstance(result, dict) else None
+            report[name] = {"ok": error is None, "seconds": None, "error": error}
+        except Exception as e:
+            report[name] = {"ok": False, "seconds": None, "error": str(e)}
+        report[name]["seconds"] = round(time.perf_counter() - started, 3)
+        print(f"[Warmup {os.getpid()}] {name}: {report[name]}")
+    return report
+
+
+class WarmupService:
+    """ウォームアップの実行と準備状態の管理"""
+
+    def __init__(self):
+        # 起動時にウォームアップするか
+        self.enabled = os.getenv("ANISONG_WARMUP", "0") == "1"
+        # ウォームアップを待つ最大秒数（超えたら諦めてトラフィックを受ける）
+        self.timeout = float(os.getenv("ANISONG_WARMUP_TIMEOUT", "600"))
+
+        self.status = "pending" if self.enabled else "disabled"
+        self.workers: list[dict] = []
+        self.error: Optional[str] = None
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+
+    @property
+    def ready(self) -> bool:
+        """トラフィックを受けられるか（失敗時も受ける。遅くなるだけで解析はできるため）"""
+        return self.status in ("disabled", "ready", "failed")
+
+    async def run(self) -> None:
+        """すべてのCPUワーカーを起動してウォームアップ完了を待つ"""
+        if not self.enabled or self.status in ("warming", "ready"):
+            return
+
+        self.status = "warming"
+        self.started_at = time.time()
+        try:
+            self.workers = await run_in_thread(start_cpu_workers, self.timeout)
+            self.status = "ready"
+        except asyncio.CancelledError:
+            self.status = "pending"
+            raise
+        except Exception as e:
+            self.status = "failed"
+            self.error = str(e)
+            print(f"[Warmup] Failed: {e}")
+        finally:
+            self.finished_at = time.time() if self.status != "pending" else None
+
+    def to_dict(self) -> dict:
+        """状態をAPIレスポンス用のdictに変換"""
+        return {
+            "status": self.status,
+            "ready": self.ready,
+            "workers": self.workers,
+            "error": self.error,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+
+# シングルトンインスタンス
+_warmup_service: Optional[WarmupService] = None
+
+
+def get_warmup_service() -> WarmupService:
+    """WarmupServiceのシングルトンを取得"""
+    global _warmup_service
+    if _warmup_service is None:
+        _warmup_service = WarmupService()
+    return _warmup_service
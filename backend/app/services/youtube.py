@@ -2,11 +2,150 @@
 YouTube Data API v3 サービス
 
 曲検索とURL取得を提供
+
+動画情報・検索結果はTTL付きでキャッシュし、同じ動画・同じ検索語の
+2回目以降はAPIを呼ばない（クォータ節約）
+- メモリ: 件数上限付きLRU
+- ディスク: ANISONG_YOUTUBE_CACHE_DIR を指定した場合のみJSONファイルに保存（再起動後も再利用）
+
+複数の動画情報は get_videos でまとめて取得する（APIの1回の呼び出しで最大50件）
+
+async版（search_music_async / get_video_async / get_videos_async）は
+httpxのコネクションプール（keep-alive）でAPIを直接呼ぶため、イベントループを止めず、
+同時に来た検索リクエストも並行して処理できる。タイムアウトと、一時的なエラー
+（接続エラー・429・5xx）の指数バックオフ付き再試行を行う。
+ディスクキャッシュを使う場合、その読み書きもI/Oスレッドプールで行う
 """
+import asyncio
+import hashlib
+import json
 import os
-from typing import Optional
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Optional
+import httpx
 from googleapiclient.discovery import build
 
+from app.services.executors import run_in_thread
+
+# videos.list に一度に渡せるIDの上限
+MAX_IDS_PER_REQUEST = 50
+
+YOUTUBE_API_URL = "https://www.googleapis.com/youtube/v3"
+# 再試行するHTTPステータス（レート制限・サーバーエラー）
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class TTLCache:
+    """有効期限付きキャッシュ（メモリLRU + 任意でディスク永続化）"""
+
+    def __init__(self, max_entries: int = 1024, cache_dir: Optional[Path] = None):
+        self.max_entries = max_entries
+        self.cache_dir = cache_dir
+        if self.cache_dir is not None:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+        # キー -> (有効期限のUNIX時刻, 値)
+        self._memory: OrderedDict[str, tuple[float, Any]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Any]:
+        """
+        キャッシュから取得
+
+        Returns:
+            値（ない・期限切れの場合はNone）
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > now:
+                    self._memory.move_to_end(key)
+                    return value
+                del self._memory[key]
+
+        if self.cache_dir is None:
+            return None
+
+        path = self._path_for(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+            expires_at, value = entry["expires_at"], entry["value"]
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            print(f"[YouTubeCache] Broken cache entry {path.name}: {e}")
+            self._unlink(path)
+            return None
+
+        if expires_at <= now:
+            self._unlink(path)
+            return None
+        self._remember(key, expires_at, value)
+        return value
+
+    def set(self, key: str, value: Any, ttl: float) -> None:
+        """
+        キャッシュに保存
+
+        Args:
+            key: キー
+            value: JSONシリアライズ可能な値
+            ttl: 有効期間（秒）。0以下なら保存しない
+        """
+        if ttl <= 0:
+            return
+        expires_at = time.time() + ttl
+        self._remember(key, expires_at, value)
+
+        if self.cache_dir is None:
+            return
+
+        path = self._path_for(key)
+        tmp_path = None
+        try:
+            # 一時ファイルに書いてからリネーム（書き込み途中のファイルを読ませない）
+            fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump({"key": key, "expires_at": expires_at, "value": value}, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            print(f"[YouTubeCache] Failed to write {path.name}: {e}")
+            if tmp_path:
+                self._unlink(Path(tmp_path))
+
+    def clear(self) -> None:
+        """キャッシュをすべて削除"""
+        with self._lock:
+            self._memory.clear()
+        if self.cache_dir is not None:
+            for path in self.cache_dir.glob("*.json"):
+                self._unlink(path)
+
+    def _remember(self, key: str, expires_at: float, value: Any) -> None:
+        """メモリLRUに追加（上限を超えたら古いものから破棄）"""
+        with self._lock:
+            self._memory[key] = (expires_at, value)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+
+    def _path_for(self, key: str) -> Path:
+        digest = hashlib.sha256(key.encode("utf-8")).hexdigest()[:32]
+        return self.cache_dir / f"{digest}.json"
+
+    def _unlink(self, path: Path) -> None:
+        try:
+            path.unlink()
+        except Exception:
+            pass
+
 
 class YouTubeService:
     """YouTube Data API v3 クライアント"""
@@ -16,11 +155,31 @@ class YouTubeService:
         if not api_key:
             raise ValueError("YOUTUBE_API_KEY not found in environment variables")
 
+        self.api_key = api_key
         self.youtube = build("youtube", "v3", developerKey=api_key)
 
+        # async版のHTTPクライアント設定
+        self.api_url = os.getenv("ANISONG_YOUTUBE_API_URL", YOUTUBE_API_URL)
+        self.timeout = float(os.getenv("ANISONG_YOUTUBE_TIMEOUT", "10"))
+        self.retries = int(os.getenv("ANISONG_YOUTUBE_RETRIES", "2"))
+        self.backoff = float(os.getenv("ANISONG_YOUTUBE_BACKOFF", "0.5"))
+        self.max_connections = int(os.getenv("ANISONG_YOUTUBE_MAX_CONNECTIONS", "20"))
+        self._client: Optional[httpx.AsyncClient] = None
+        self._client_loop: Optional[asyncio.AbstractEventLoop] = None
+
+        # キャッシュの有効期間（秒）。動画情報はほとんど変わらないため長めにする
+        self.video_ttl = float(os.getenv("ANISONG_YOUTUBE_VIDEO_TTL", "86400"))
+        self.search_ttl = float(os.getenv("ANISONG_YOUTUBE_SEARCH_TTL", "600"))
+        # ディスクに保存する場合のディレクトリ（未指定ならメモリのみ）
+        custom_dir = os.getenv("ANISONG_YOUTUBE_CACHE_DIR")
+        self.cache = TTLCache(
+            max_entries=int(os.getenv("ANISONG_YOUTUBE_CACHE_ENTRIES", "1024")),
+            cache_dir=Path(custom_dir) if custom_dir else None,
+        )
+
     def search_music(self, query: str, limit: int = 10) -> list[dict]:
         """
-        音楽を検索
+        音楽を検索（同じ検索語・件数の結果は ANISONG_YOUTUBE_SEARCH_TTL 秒キャッシュ）
 
         Args:
             query: 検索クエリ（曲名、アーティスト名など）
@@ -29,15 +188,55 @@ class YouTubeService:
         Returns:
             動画情報のリスト
         """
-        request = self.youtube.search().list(
-            q=query,
-            part="snippet",
-            type="video",
-            videoCategoryId="10",  # Music category
-            maxResults=limit,
-        )
+        cache_key = self._search_cache_key(query, limit)
+        cached = self.cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+        request = self.youtube.search().list(**self._search_params(query, limit))
         response = request.execute()
 
+        videos = self._parse_search(response)
+        self.cache.set(cache_key, videos, self.search_ttl)
+        return videos
+
+    async def search_music_async(self, query: str, limit: int = 10) -> list[dict]:
+        """
+        音楽を検索（async版。キャッシュは search_music と共有）
+
+        Args:
+            query: 検索クエリ（曲名、アーティスト名など）
+            limit: 取得件数
+
+        Returns:
+            動画情報のリスト
+        """
+        cache_key = self._search_cache_key(query, limit)
+        cached = await self._run_cache(self.cache.get, cache_key)
+        if cached is not None:
+            return cached
+
+        response = await self._request("search", self._search_params(query, limit))
+
+        videos = self._parse_search(response)
+        await self._run_cache(self.cache.set, cache_key, videos, self.search_ttl)
+        return videos
+
+    def _search_cache_key(self, query: str, limit: int) -> str:
+        return f"search:{limit}:{query.strip()}"
+
+    def _search_params(self, query: str, limit: int) -> dict:
+        """search.list のパラメータ"""
+        return {
+            "q": query,
+            "part": "snippet",
+            "type": "video",
+            "videoCategoryId": "10",  # Music category
+            "maxResults": limit,
+        }
+
+    def _parse_search(self, response: dict) -> list[dict]:
+        """search.list のレスポンスを動画情報のリストに変換"""
         videos = []
         for item in response.get("items", []):
             # videoIdがない項目はスキップ（チャンネルやプレイリストの可能性）
@@ -55,12 +254,11 @@ class YouTubeService:
                 "published_at": snippet["publishedAt"],
             }
             videos.append(video)
-
         return videos
 
     def get_video(self, video_id: str) -> Optional[dict]:
         """
-        動画詳細を取得
+        動画詳細を取得（ANISONG_YOUTUBE_VIDEO_TTL 秒キャッシュ）
 
         Args:
             video_id: YouTubeの動画ID
@@ -69,32 +267,175 @@ class YouTubeService:
             動画情報（見つからない場合はNone）
         """
         try:
-            request = self.youtube.videos().list(
-                id=video_id,
-                part="snippet,contentDetails",
-            )
-            response = request.execute()
+            videos = self.get_videos([video_id])
+        except Exception:
+            return None
+        return videos[0] if videos else None
 
-            items = response.get("items", [])
-            if not items:
-                return None
+    async def get_video_async(self, video_id: str) -> Optional[dict]:
+        """
+        動画詳細を取得（async版。キャッシュは get_video と共有）
 
-            item = items[0]
-            snippet = item["snippet"]
-            content_details = item["contentDetails"]
+        Args:
+            video_id: YouTubeの動画ID
 
-            return {
-                "id": video_id,
-                "title": snippet["title"],
-                "channel": snippet["channelTitle"],
-                "description": snippet.get("description", ""),
-                "thumbnail": snippet["thumbnails"]["high"]["url"] if "high" in snippet["thumbnails"] else snippet["thumbnails"]["default"]["url"],
-                "url": f"https://www.youtube.com/watch?v={video_id}",
-                "duration": content_details["duration"],  # ISO 8601 format
-                "published_at": snippet["publishedAt"],
-            }
+        Returns:
+            動画情報（見つからない場合・取得に失敗した場合はNone）
+        """
+        try:
+            videos = await self.get_videos_async([video_id])
         except Exception:
             return None
+        return videos[0] if videos else None
+
+    def get_videos(self, video_ids: list[str]) -> list[dict]:
+        """
+        複数の動画詳細をまとめて取得
+
+        キャッシュにない動画だけを、APIの1回の呼び出しで最大50件ずつ取得する
+
+        Args:
+            video_ids: YouTubeの動画IDのリスト
+
+        Returns:
+            動画情報のリスト（video_idsの順。見つからない動画は含まない）
+        """
+        found, missing = self._lookup_cached_videos(video_ids)
+
+        for i in range(0, len(missing), MAX_IDS_PER_REQUEST):
+            request = self.youtube.videos().list(**self._videos_params(missing[i:i + MAX_IDS_PER_REQUEST]))
+            self._store_videos(request.execute(), found)
+
+        return [found[video_id] for video_id in dict.fromkeys(video_ids) if video_id in found]
+
+    async def get_videos_async(self, video_ids: list[str]) -> list[dict]:
+        """
+        複数の動画詳細をまとめて取得（async版。50件ずつのリクエストは並行して送る）
+
+        Args:
+            video_ids: YouTubeの動画IDのリスト
+
+        Returns:
+            動画情報のリスト（video_idsの順。見つからない動画は含まない）
+        """
+        found, missing = await self._run_cache(self._lookup_cached_videos, video_ids)
+
+        responses = await asyncio.gather(*(
+            self._request("videos", self._videos_params(missing[i:i + MAX_IDS_PER_REQUEST]))
+            for i in range(0, len(missing), MAX_IDS_PER_REQUEST)
+        ))
+        for response in responses:
+            await self._run_cache(self._store_videos, response, found)
+
+        return [found[video_id] for video_id in dict.fromkeys(video_ids) if video_id in found]
+
+    async def _run_cache(self, func, *args) -> Any:
+        """
+        キャッシュを読み書きする処理をasync版から呼ぶ
+
+        ディスクキャッシュを使う場合はファイルの読み書きでイベントループを
+        止めないようI/Oスレッドプールで実行する（メモリのみならその場で実行）
+        """
+        if self.cache.cache_dir is None:
+            return func(*args)
+        return await run_in_thread(func, *args)
+
+    def _lookup_cached_videos(self, video_ids: list[str]) -> tuple[dict[str, dict], list[str]]:
+        """
+        キャッシュにある動画とない動画に分ける
+
+        Returns:
+            ({動画ID: 動画情報}, キャッシュにない動画IDのリスト（重複なし）)
+        """
+        found: dict[str, dict] = {}
+        missing = []
+        for video_id in dict.fromkeys(video_ids):
+            cached = self.cache.get(f"video:{video_id}")
+            if cached is not None:
+                found[video_id] = cached
+            else:
+                missing.append(video_id)
+        return found, missing
+
+    def _videos_params(self, video_ids: list[str]) -> dict:
+        """videos.list のパラメータ"""
+        return {
+            "id": ",".join(video_ids),
+            "part": "snippet,contentDetails",
+            "maxResults": MAX_IDS_PER_REQUEST,
+        }
+
+    def _store_videos(self, response: dict, found: dict[str, dict]) -> None:
+        """videos.list のレスポンスを found に追加してキャッシュする"""
+        for item in response.get("items", []):
+            video = self._parse_video(item)
+            found[video["id"]] = video
+            self.cache.set(f"video:{video['id']}", video, self.video_ttl)
+
+    def _parse_video(self, item: dict) -> dict:
+        """videos.list の項目を動画情報に変換"""
+        video_id = item["id"]
+        snippet = item["snippet"]
+        content_details = item["contentDetails"]
+
+        return {
+            "id": video_id,
+            "title": snippet["title"],
+            "channel": snippet["channelTitle"],
+            "description": snippet.get("description", ""),
+            "thumbnail": snippet["thumbnails"]["high"]["url"] if "high" in snippet["thumbnails"] else snippet["thumbnails"]["default"]["url"],
+            "url": f"https://www.youtube.com/watch?v={video_id}",
+            "duration": content_details["duration"],  # ISO 8601 format
+            "published_at": snippet["publishedAt"],
+        }
+
+    def _get_client(self) -> httpx.AsyncClient:
+        """
+        コネクションプール付きのHTTPクライアントを取得
+
+        接続は作成したイベントループに紐づくため、ループが変わったら作り直す
+        """
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._client.is_closed or self._client_loop is not loop:
+            self._client = httpx.AsyncClient(
+                base_url=self.api_url,
+                timeout=httpx.Timeout(self.timeout),
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_connections,
+                ),
+            )
+            self._client_loop = loop
+        return self._client
+
+    async def _request(self, path: str, params: dict) -> dict:
+        """
+        Data APIを呼び出す（接続エラー・429・5xxは指数バックオフで再試行）
+
+        Raises:
+            httpx.HTTPStatusError: 再試行しないエラー（403 クォータ超過など）か、再試行しても失敗した場合
+            httpx.TransportError: 再試行しても接続できなかった場合
+        """
+        client = self._get_client()
+        params = {**params, "key": self.api_key}
+        for attempt in range(self.retries + 1):
+            try:
+                response = await client.get(path, params=params)
+            except httpx.TransportError:
+                if attempt >= self.retries:
+                    raise
+            else:
+                if response.status_code not in RETRY_STATUS_CODES or attempt >= self.retries:
+                    response.raise_for_status()
+                    return response.json()
+            await asyncio.sleep(self.backoff * 2 ** attempt)
+
+    async def aclose(self) -> None:
+        """HTTPクライアントを閉じる（アプリ終了時）"""
+        if self._client is not None and self._client_loop is asyncio.get_running_loop():
+            await self._client.aclose()
+        self._client = None
+        self._client_loop = None
 
 
 # シングルトンインスタンス
@@ -107,3 +448,9 @@ def get_youtube_service() -> YouTubeService:
     if _youtube_service is None:
         _youtube_service = YouTubeService()
     return _youtube_service
+
+
+async def close_youtube_service() -> None:
+    """作成済みのYouTubeServiceのHTTPクライアントを閉じる（アプリ終了時）"""
+    if _youtube_service is not None:
+        await _youtube_service.aclose()
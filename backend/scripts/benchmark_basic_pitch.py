@@ -0,0 +1,89 @@
+"""
+Basic Pitchのモデル再利用のベンチマーク
+
+同じ音声を続けて変換し、1回あたりの処理時間を比較する
+- reload: 呼び出しごとにモデルをロード（predict(model_or_model_path=パス) と同じ）
+- reuse: サービスがロード済みのモデルを再利用（現在の動作）
+
+既定では固定の合成音声（ウォームアップ用と同じ）を使う。--audio で実際の音声を指定できる
+
+使い方（backend ディレクトリで実行）:
+    python -m scripts.benchmark_basic_pitch
+    python -m scripts.benchmark_basic_pitch --calls 5 --seconds 10
+    python -m scripts.benchmark_basic_pitch --audio /path/to/other.wav --json
+"""
+import argparse
+import json
+import time
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+from app.services.audio_buffer import AudioBuffer
+from app.services.basic_pitch_service import BasicPitchService
+from app.services.warmup import make_warmup_clip
+
+
+def benchmark_mode(audio: AudioBuffer, mode: str, calls: int) -> dict:
+    """
+    1つのモードで calls 回変換して時間を測定
+
+    1回目はTensorFlowのグラフ構築などを含むため、2回目以降の平均も出す
+    """
+    service = BasicPitchService()
+    seconds = []
+    for _ in range(calls):
+        if mode == "reload":
+            service._model = None
+        started = time.perf_counter()
+        result = service.transcribe_track(audio, "other", tempo=120.0)
+        seconds.append(time.perf_counter() - started)
+        if not result["success"]:
+            return {"mode": mode, "error": result["error"]}
+
+    return {
+        "mode": mode,
+        "calls": calls,
+        "model_loads": service.load_count,
+        "first_call": round(seconds[0], 3),
+        "per_call": round(float(np.mean(seconds[1:] if calls > 1 else seconds)), 3),
+        "total": round(sum(seconds), 3),
+    }
+
+
+def run(calls: int = 3, seconds: float = 4.0, audio_path: Optional[Path] = None) -> list[dict]:
+    """reload / reuse の順に測定"""
+    if audio_path:
+        audio = AudioBuffer(audio_path)
+    else:
+        audio = AudioBuffer(samples=make_warmup_clip(duration=seconds), sample_rate=44100)
+    return [benchmark_mode(audio, mode, calls) for mode in ("reload", "reuse")]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Basic Pitchのモデル再利用のベンチマーク")
+    parser.add_argument("--calls", type=int, default=3, help="モードごとの変換回数")
+    parser.add_argument("--seconds", type=float, default=4.0, help="合成音声の長さ（秒）")
+    parser.add_argument("--audio", type=Path, help="変換する音声ファイル")
+    parser.add_argument("--json", action="store_true", help="結果をJSONで出力")
+    args = parser.parse_args()
+
+    results = run(args.calls, args.seconds, args.audio)
+    if args.json:
+        print(json.dumps(results, ensure_ascii=False, indent=2))
+        return
+
+    print(f"{'mode':<8} {'loads':>6} {'first':>8} {'per call':>9} {'total':>8}")
+    for r in results:
+        if "error" in r:
+            print(f"{r['mode']:<8} error: {r['error']}")
+            continue
+        print(
+            f"{r['mode']:<8} {r['model_loads']:>6} {r['first_call']:>8.3f} "
+            f"{r['per_call']:>9.3f} {r['total']:>8.3f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
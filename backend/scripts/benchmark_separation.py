@@ -0,0 +1,198 @@
+"""
+楽器分離プロファイルのベンチマーク
+
+各プロファイル（fast / balanced / best）で同じ音声を分離し、
+- 音声1分あたりの処理秒数（sec/min）
+- ステムごとのSDR（dB、高いほど元のステムに近い）
+を表示する
+
+正解ステムが必要なため、既定では固定シードで合成したテスト音声
+（ドラム・ベース・和音・メロディを別々に作って重ねたもの）を使う。
+MUSDB18などの実際の楽曲で測る場合は、drums.wav / bass.wav / other.wav / vocals.wav
+を置いたディレクトリを --stems-dir で指定する（ミックスは4ステムの和）
+
+使い方（backend ディレクトリで実行）:
+    python -m scripts.benchmark_separation
+    python -m scripts.benchmark_separation --profiles fast balanced --seconds 60
+    python -m scripts.benchmark_separation --stems-dir /data/musdb/test/track01
+"""
+import argparse
+import json
+import time
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+from app.services.audio_buffer import AudioBuffer
+from app.services.audio_separator import DEMUCS_PROFILES, AudioSeparatorService
+
+SAMPLE_RATE = 44100
+STEMS = ("drums", "bass", "other", "vocals")
+
+
+def make_test_stems(seconds: float = 30.0, seed: int = 0) -> dict[str, np.ndarray]:
+    """
+    正解ステム付きの合成テスト音声を作成（同じ引数なら毎回同じ音声）
+
+    Returns:
+        {ステム名: [2, samples] のfloat32配列}
+    """
+    rng = np.random.default_rng(seed)
+    n = int(seconds * SAMPLE_RATE)
+    t = np.arange(n) / SAMPLE_RATE
+    beat = 0.5  # 120BPM
+    bar = (t / (beat * 4)).astype(int)
+
+    # ドラム: キック（拍頭の低い減衰音）+ ハイハット（裏拍のノイズ）
+    phase = t % beat
+    kick = np.exp(-phase * 30) * np.sin(2 * np.pi * 55 * phase * (1 + np.exp(-phase * 40)))
+    offbeat = (t + beat / 2) % beat
+    hihat = np.exp(-offbeat * 120) * rng.standard_normal(n)
+    drums = 0.6 * kick + 0.15 * hihat
+
+    # ベース: 1小節ごとにルートが変わる（C - A - F - G）
+    roots = np.array([65.41, 55.00, 87.31, 98.00])
+    bass_freq = roots[bar % 4]
+    bass = 0.4 * (np.sin(2 * np.pi * bass_freq * t) + 0.3 * np.sin(4 * np.pi * bass_freq * t))
+
+    # その他: 同じ進行の和音（倍音付き）
+    chords = np.array([
+        [261.63, 329.63, 392.00],
+        [220.00, 261.63, 329.63],
+        [174.61, 220.00, 261.63],
+        [196.00, 246.94, 293.66],
+    ])
+    chord_freqs = chords[bar % 4]
+    other = sum(
+        np.sin(2 * np.pi * chord_freqs[:, i] * t) + 0.4 * np.sin(4 * np.pi * chord_freqs[:, i] * t)
+        for i in range(3)
+    ) * 0.08
+
+    # ボーカル: ビブラート付きのメロディ（1拍ごとに音が変わる）
+    melody = 440.0 * 2 ** (rng.choice([0, 2, 3, 5, 7, 9, 10, 12], size=int(seconds / beat) + 1) / 12)
+    melody_freq = melody[(t / beat).astype(int)] * (1 + 0.01 * np.sin(2 * np.pi * 5.5 * t))
+    melody_phase = 2 * np.pi * np.cumsum(melody_freq) / SAMPLE_RATE
+    vocals = 0.25 * (np.sin(melody_phase) + 0.5 * np.sin(2 * melody_phase) + 0.25 * np.sin(3 * melody_phase))
+
+    # 定位を少しずつ変えてステレオにする
+    pans = {"drums": 0.5, "bass": 0.5, "other": 0.3, "vocals": 0.6}
+    stems = {}
+    for name, mono in zip(STEMS, (drums, bass, other, vocals)):
+        pan = pans[name]
+        stems[name] = np.stack([mono * (1 - pan), mono * pan]).astype(np.float32)
+    return stems
+
+
+def load_stems(stems_dir: Path) -> dict[str, np.ndarray]:
+    """正解ステム（drums.wav等）を読み込む（44100Hzステレオ）"""
+    stems = {}
+    for name in STEMS:
+        audio = AudioBuffer(stems_dir / f"{name}.wav")
+        samples = audio.samples
+        if audio.sample_rate != SAMPLE_RATE:
+            import librosa
+            samples = librosa.resample(samples, orig_sr=audio.sample_rate, target_sr=SAMPLE_RATE)
+        if samples.shape[0] == 1:
+            samples = np.concatenate([samples, samples])
+        stems[name] = samples.astype(np.float32)
+    length = min(s.shape[1] for s in stems.values())
+    return {name: s[:, :length] for name, s in stems.items()}
+
+
+def sdr(reference: np.ndarray, estimate: np.ndarray) -> float:
+    """
+    SDR（Signal to Distortion Ratio, dB）
+
+    10 * log10(|正解|^2 / |正解 - 推定|^2)（MDX Challengeと同じ定義）
+    """
+    length = min(reference.shape[-1], estimate.shape[-1])
+    reference = reference[..., :length].astype(np.float64)
+    estimate = estimate[..., :length].astype(np.float64)
+    eps = 1e-8
+    return float(10 * np.log10(
+        (np.sum(reference ** 2) + eps) / (np.sum((reference - estimate) ** 2) + eps)
+    ))
+
+
+def benchmark_profile(
+    service: AudioSeparatorService, profile: str, stems: dict[str, np.ndarray]
+) -> dict:
+    """
+    1つのプロファイルで分離して速度とSDRを測定
+
+    ステムの変換に使うのと同じモノラルの分離結果（in_memory）で評価する。
+    テスト音声は毎回同じなので、ステムのキャッシュは使わない（Demucsの時間を測る）
+    """
+    mixture = sum(stems.values())
+    audio = AudioBuffer(samples=mixture, sample_rate=SAMPLE_RATE)
+    minutes = audio.duration / 60
+
+    # モデルのロードは計測に含めない
+    try:
+        service.get_model(DEMUCS_PROFILES[profile]["model"])
+    except Exception as e:
+        return {"profile": profile, "error": f"Model load failed: {e}"}
+
+    started = time.perf_counter()
+    result = service.separate(audio, in_memory=True, profile=profile, use_cache=False)
+    seconds = time.perf_counter() - started
+    if not result["success"]:
+        return {"profile": profile, "error": result["error"]}
+
+    try:
+        stem_sdr = {}
+        for name, track in result["tracks"].items():
+            with track.open() as separated:
+                stem_sdr[name] = round(sdr(stems[name].mean(axis=0), separated.mono()), 2)
+    finally:
+        service.cleanup(result["tracks"])
+
+    return {
+        "profile": profile,
+        "settings": DEMUCS_PROFILES[profile],
+        "audio_seconds": round(audio.duration, 1),
+        "seconds": round(seconds, 2),
+        "sec_per_min": round(seconds / minutes, 2),
+        "sdr": stem_sdr,
+        "mean_sdr": round(float(np.mean(list(stem_sdr.values()))), 2),
+    }
+
+
+def run(
+    profiles: list[str],
+    seconds: float = 30.0,
+    stems_dir: Optional[Path] = None,
+) -> list[dict]:
+    """指定したプロファイルを順に測定"""
+    stems = load_stems(stems_dir) if stems_dir else make_test_stems(seconds)
+    service = AudioSeparatorService()
+    return [benchmark_profile(service, profile, stems) for profile in profiles]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="楽器分離プロファイルのベンチマーク")
+    parser.add_argument("--profiles", nargs="+", default=list(DEMUCS_PROFILES), choices=list(DEMUCS_PROFILES))
+    parser.add_argument("--seconds", type=float, default=30.0, help="合成テスト音声の長さ（秒）")
+    parser.add_argument("--stems-dir", type=Path, help="正解ステム（drums.wav等）のディレクトリ")
+    parser.add_argument("--json", action="store_true", help="結果をJSONで出力")
+    args = parser.parse_args()
+
+    results = run(args.profiles, args.seconds, args.stems_dir)
+    if args.json:
+        print(json.dumps(results, ensure_ascii=False, indent=2))
+        return
+
+    print(f"{'profile':<10} {'sec/min':>8} {'mean SDR':>9}  " + "  ".join(f"{s:>7}" for s in STEMS))
+    for r in results:
+        if "error" in r:
+            print(f"{r['profile']:<10} error: {r['error']}")
+            continue
+        print(
+            f"{r['profile']:<10} {r['sec_per_min']:>8.2f} {r['mean_sdr']:>9.2f}  "
+            + "  ".join(f"{r['sdr'][s]:>7.2f}" for s in STEMS)
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,14 @@
 """
 pytest設定・フィクスチャ
 """
+import os
+
+# テストではCPU処理をプロセスプールではなくスレッドで実行する
+# （モックはプロセス間で共有できないため）
+os.environ.setdefault("ANISONG_CPU_WORKERS", "0")
+# 分離済みステムのキャッシュは使わない（前回の実行結果で分離処理が省かれないように）
+os.environ.setdefault("ANISONG_STEM_CACHE_MAX_MB", "0")
+
 import pytest
 from fastapi.testclient import TestClient
 from app.main import app
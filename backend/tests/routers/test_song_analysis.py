@@ -1,8 +1,19 @@
 """
 楽曲解析APIルーターのテスト
 """
+import asyncio
+
 import pytest
-from unittest.mock import Mock, patch
+from unittest.mock import AsyncMock, Mock, patch
+
+
+def async_events(*events, seconds=0.0):
+    """イベントを順に返す非同期ジェネレータ（download_audio_with_progress_async の代わり）"""
+    async def _run(*args, **kwargs):
+        for event in events:
+            await asyncio.sleep(seconds)
+            yield event
+    return _run
 
 
 class TestSongAnalysisRouter:
@@ -22,7 +33,7 @@ class TestSongAnalysisRouter:
     def test_search_songs_success(self, mock_get_youtube, client):
         """曲検索が成功する"""
         mock_service = Mock()
-        mock_service.search_music.return_value = [
+        mock_service.search_music_async = AsyncMock(return_value=[
             {
                 "id": "video123",
                 "title": "Test Song",
@@ -31,7 +42,7 @@ class TestSongAnalysisRouter:
                 "url": "https://www.youtube.com/watch?v=video123",
                 "published_at": "2024-01-01T00:00:00Z",
             }
-        ]
+        ])
         mock_get_youtube.return_value = mock_service
 
         response = client.get("/api/v1/song-analysis/search?query=test")
@@ -51,7 +62,7 @@ class TestSongAnalysisRouter:
     def test_get_video_success(self, mock_get_youtube, client):
         """動画取得が成功する"""
         mock_service = Mock()
-        mock_service.get_video.return_value = {
+        mock_service.get_video_async = AsyncMock(return_value={
             "id": "video123",
             "title": "Test Song",
             "channel": "Test Artist",
@@ -60,7 +71,7 @@ class TestSongAnalysisRouter:
             "url": "https://www.youtube.com/watch?v=video123",
             "duration": "PT3M30S",
             "published_at": "2024-01-01T00:00:00Z",
-        }
+        })
         mock_get_youtube.return_value = mock_service
 
         response = client.get("/api/v1/song-analysis/video/video123")
@@ -73,12 +84,36 @@ class TestSongAnalysisRouter:
     def test_get_video_not_found(self, mock_get_youtube, client):
         """存在しない動画は404エラー"""
         mock_service = Mock()
-        mock_service.get_video.return_value = None
+        mock_service.get_video_async = AsyncMock(return_value=None)
         mock_get_youtube.return_value = mock_service
 
         response = client.get("/api/v1/song-analysis/video/nonexistent")
         assert response.status_code == 404
 
+    @patch("app.routers.song_analysis.get_youtube_service")
+    def test_get_videos_batch(self, mock_get_youtube, client):
+        """複数の動画をまとめて取得する"""
+        mock_service = Mock()
+        mock_service.get_videos_async = AsyncMock(return_value=[{"id": "a"}, {"id": "b"}])
+        mock_get_youtube.return_value = mock_service
+
+        response = client.get("/api/v1/song-analysis/videos?ids=a, b,,")
+        assert response.status_code == 200
+        assert response.json()["data"]["total"] == 2
+        mock_service.get_videos_async.assert_awaited_once_with(["a", "b"])
+
+        response = client.get("/api/v1/song-analysis/videos?ids=,")
+        assert response.status_code == 400
+
+    def test_unfinished_flight_is_error(self):
+        """最後のイベントが complete / error 以外（途中で中断）なら500"""
+        from fastapi import HTTPException
+        from app.routers.song_analysis import _raise_for_error
+
+        with pytest.raises(HTTPException) as exc_info:
+            _raise_for_error({"stage": "download", "progress": 20, "message": "ダウンロード中"})
+        assert exc_info.value.status_code == 500
+
 
 class TestChordDetection:
     """コード検出のテスト（MagentaService）"""
@@ -141,3 +176,409 @@ class TestChordDetection:
         service = MagentaService()
         chords = service.extract_chords_from_notes([])
         assert chords == []
+
+
+class TestAnalysisCache:
+    """解析結果キャッシュのテスト"""
+
+    @patch("app.routers.song_analysis.get_youtube_service")
+    @patch("app.routers.song_analysis.get_magenta_service")
+    @patch("app.routers.song_analysis.get_analysis_cache_service")
+    def test_analyze_4tracks_cache_hit(self, mock_get_cache, mock_get_magenta, mock_get_youtube, client):
+        """キャッシュがあればダウンロード・解析をスキップする"""
+        mock_cache = Mock()
+        mock_cache.get.return_value = {
+            "video_id": "video123",
+            "title": "Test Song",
+            "channel": "Test Artist",
+            "tempo": 128,
+            "tracks": {"bass": {"notes": [{"pitch": 40, "start": 0.0, "end": 0.5}]}},
+            "chords": [{"time": 0.0, "chord": "C"}],
+        }
+        mock_get_cache.return_value = mock_cache
+        mock_get_magenta.return_value.get_pipeline_params.return_value = {"mode": "4tracks"}
+
+        response = client.get("/api/v1/song-analysis/analyze-4tracks/video123")
+        assert response.status_code == 200
+        data = response.json()
+        assert data["data"]["tempo"] == 128
+        assert data["data"]["chords"][0]["chord"] == "C"
+        mock_cache.get.assert_called_once_with("video123", {"mode": "4tracks"})
+        mock_get_youtube.assert_not_called()
+        mock_get_magenta.return_value.audio_to_4tracks_with_progress.assert_not_called()
+
+    @patch("app.routers.song_analysis.get_youtube_service")
+    @patch("app.routers.song_analysis.get_magenta_service")
+    @patch("app.routers.song_analysis.get_analysis_cache_service")
+    def test_analyze_4tracks_profile_in_cache_key(self, mock_get_cache, mock_get_magenta, mock_get_youtube, client):
+        """分離プロファイルごとに別のキャッシュキーで解析する"""
+        mock_cache = Mock()
+        mock_cache.get.return_value = {"video_id": "video123", "title": "Test Song", "channel": "Test Artist"}
+        mock_get_cache.return_value = mock_cache
+
+        response = client.get("/api/v1/song-analysis/analyze-4tracks/video123?profile=fast")
+        assert response.status_code == 200
+        mock_get_magenta.return_value.get_pipeline_params.assert_called_once_with("4tracks", "fast")
+
+    def test_analyze_4tracks_unknown_profile(self, client):
+        """存在しない分離プロファイルは400"""
+        response = client.get("/api/v1/song-analysis/analyze-4tracks/video123?profile=ultra")
+        assert response.status_code == 400
+        response = client.get("/api/v1/song-analysis/analyze-4tracks/video123/stream?profile=ultra")
+        assert response.status_code == 400
+
+    @patch("app.routers.song_analysis.get_gemini_service")
+    @patch("app.routers.song_analysis.get_audio_downloader_service")
+    @patch("app.routers.song_analysis.get_youtube_service")
+    @patch("app.routers.song_analysis.get_magenta_service")
+    @patch("app.routers.song_analysis.get_analysis_cache_service")
+    def test_analyze_stores_result(
+        self, mock_get_cache, mock_get_magenta, mock_get_youtube, mock_get_downloader, mock_get_gemini, client
+    ):
+        """キャッシュがなければ解析してから結果を保存する"""
+        mock_cache = Mock()
+        mock_cache.get.return_value = None
+        mock_get_cache.return_value = mock_cache
+
+        mock_get_youtube.return_value.get_video_async = AsyncMock(return_value={
+            "id": "video123",
+            "title": "Test Song",
+            "channel": "Test Artist",
+            "url": "https://www.youtube.com/watch?v=video123",
+        })
+        mock_get_downloader.return_value.download_audio_with_progress_async.side_effect = async_events(
+            {"stage": "complete", "progress": 100, "message": "ダウンロード完了", "file_path": "/tmp/test.wav"},
+        )
+        magenta = mock_get_magenta.return_value
+        magenta.get_pipeline_params.return_value = {"mode": "single"}
+        magenta.audio_to_midi.return_value = {
+            "success": True,
+            "midi_path": "/tmp/test.mid",
+            "notes": [{"pitch": 60, "start": 0.0, "end": 0.5, "velocity": 100}],
+            "tempo": 120,
+        }
+        magenta.extract_chords_from_notes.return_value = [{"time": 0.0, "chord": "C"}]
+
+        response = client.get("/api/v1/song-analysis/analyze/video123?generate_ai_analysis=false")
+        assert response.status_code == 200
+        mock_cache.set.assert_called_once()
+        video_id, params, result = mock_cache.set.call_args[0]
+        assert video_id == "video123"
+        assert params == {"mode": "single", "generate_ai_analysis": False}
+        assert result["notes_count"] == 1
+        assert result["chords"] == [{"time": 0.0, "chord": "C"}]
+
+    @patch("app.routers.song_analysis.get_audio_downloader_service")
+    @patch("app.routers.song_analysis.get_youtube_service")
+    @patch("app.routers.song_analysis.get_magenta_service")
+    @patch("app.routers.song_analysis.get_analysis_cache_service")
+    def test_analyze_section(
+        self, mock_get_cache, mock_get_magenta, mock_get_youtube, mock_get_downloader, client
+    ):
+        """区間指定ではその区間だけをダウンロードし、区間ごとにキャッシュする"""
+        mock_cache = Mock()
+        mock_cache.get.return_value = None
+        mock_get_cache.return_value = mock_cache
+
+        mock_get_youtube.return_value.get_video_async = AsyncMock(return_value={
+            "id": "video123",
+            "title": "Test Song",
+            "channel": "Test Artist",
+            "url": "https://www.youtube.com/watch?v=video123",
+        })
+        downloader = mock_get_downloader.return_value
+        downloader.download_audio_with_progress_async.side_effect = async_events(
+            {"stage": "complete", "progress": 100, "message": "ダウンロード完了", "file_path": "/tmp/test.webm"},
+        )
+        magenta = mock_get_magenta.return_value
+        magenta.get_pipeline_params.return_value = {"mode": "single"}
+        magenta.audio_to_midi.return_value = {
+            "success": True,
+            "midi_path": "/tmp/test.mid",
+            "notes": [{"pitch": 60, "start": 30.5, "end": 31.0, "velocity": 100}],
+            "tempo": 120,
+        }
+        magenta.extract_chords_from_notes.return_value = [{"time": 30.5, "chord": "C"}]
+
+        response = client.get(
+            "/api/v1/song-analysis/analyze/video123?generate_ai_analysis=false&start=30&end=60"
+        )
+        assert response.status_code == 200
+        data = response.json()["data"]
+        assert data["start"] == 30.0
+        assert data["end"] == 60.0
+        assert downloader.download_audio_with_progress_async.call_args.kwargs["section"] == (30.0, 60.0)
+        # ノートの時刻を曲の時刻に戻すため、区間の開始時刻を渡す
+        assert magenta.audio_to_midi.call_args[0][1] == 30.0
+        _, params, _ = mock_cache.set.call_args[0]
+        assert params["section"] == [30.0, 60.0]
+
+    @patch("app.routers.song_analysis.get_audio_downloader_service")
+    @patch("app.routers.song_analysis.get_youtube_service")
+    @patch("app.routers.song_analysis.get_magenta_service")
+    @patch("app.routers.song_analysis.get_analysis_cache_service")
+    def test_analyze_chords_only(
+        self, mock_get_cache, mock_get_magenta, mock_get_youtube, mock_get_downloader, client
+    ):
+        """コードのみの解析ではノート変換を行わず、別のパラメータでキャッシュする"""
+        mock_cache = Mock()
+        mock_cache.get.return_value = None
+        mock_get_cache.return_value = mock_cache
+
+        mock_get_youtube.return_value.get_video_async = AsyncMock(return_value={
+            "id": "video123",
+            "title": "Test Song",
+            "channel": "Test Artist",
+            "url": "https://www.youtube.com/watch?v=video123",
+        })
+        mock_get_downloader.return_value.download_audio_with_progress_async.side_effect = async_events(
+            {"stage": "complete", "progress": 100, "message": "ダウンロード完了", "file_path": "/tmp/test.wav"},
+        )
+        magenta = mock_get_magenta.return_value
+        magenta.get_pipeline_params.side_effect = lambda mode: {"mode": mode}
+        magenta.audio_to_chords.return_value = {
+            "success": True,
+            "tempo": 128,
+            "duration": 180.0,
+            "chords": [{"time": 0.0, "chord": "C"}, {"time": 2.0, "chord": "Am"}],
+            "error": None,
+        }
+
+        response = client.get(
+            "/api/v1/song-analysis/analyze/video123?generate_ai_analysis=false&chords_only=true"
+        )
+        assert response.status_code == 200
+        data = response.json()["data"]
+        assert data["chords_only"] is True
+        assert data["notes_count"] == 0
+        assert data["tempo"] == 128
+        assert data["duration"] == 180.0
+        assert data["chords"] == [{"time": 0.0, "chord": "C"}, {"time": 2.0, "chord": "Am"}]
+        magenta.audio_to_midi.assert_not_called()
+        magenta.extract_chords_from_notes.assert_not_called()
+        _, params, _ = mock_cache.set.call_args[0]
+        assert params == {"mode": "chords", "generate_ai_analysis": False}
+
+    def test_analyze_invalid_section(self, client):
+        """不正な区間は400"""
+        response = client.get("/api/v1/song-analysis/analyze/video123?start=60&end=30")
+        assert response.status_code == 400
+        response = client.get("/api/v1/song-analysis/analyze-4tracks/video123/stream?start=-1")
+        assert response.status_code == 400
+
+    @patch("app.routers.song_analysis.get_youtube_service")
+    @patch("app.routers.song_analysis.get_magenta_service")
+    @patch("app.routers.song_analysis.get_analysis_cache_service")
+    def test_analyze_stream_cache_hit(self, mock_get_cache, mock_get_magenta, mock_get_youtube, client):
+        """SSEでもキャッシュがあれば即座にcompleteを返す"""
+        import json
+
+        mock_cache = Mock()
+        mock_cache.make_key.return_value = "video123_stream"
+        mock_cache.get.return_value = {
+            "video_id": "video123",
+            "title": "Test Song",
+            "channel": "Test Artist",
+            "tempo": 120,
+        }
+        mock_get_cache.return_value = mock_cache
+        mock_get_magenta.return_value.get_pipeline_params.return_value = {"mode": "single"}
+
+        response = client.get("/api/v1/song-analysis/analyze/video123/stream")
+        assert response.status_code == 200
+        events = [
+            json.loads(line[len("data: "):])
+            for line in response.text.splitlines() if line.startswith("data: ")
+        ]
+        assert events[-1]["stage"] == "complete"
+        assert events[-1]["data"]["tempo"] == 120
+        assert "status_code" not in events[-1]
+        mock_get_youtube.assert_not_called()
+
+
+class TestAnalysisJobs:
+    """バックグラウンドジョブAPIのテスト"""
+
+    @patch("app.routers.song_analysis.get_youtube_service")
+    @patch("app.routers.song_analysis.get_magenta_service")
+    @patch("app.routers.song_analysis.get_analysis_cache_service")
+    def test_submit_and_get_result(self, mock_get_cache, mock_get_magenta, mock_get_youtube):
+        """ジョブを投入すると即座にIDが返り、完了後に結果を取得できる"""
+        import time
+        from fastapi.testclient import TestClient
+        from app.main import app
+
+        mock_cache = Mock()
+        mock_cache.make_key.return_value = "video123_job"
+        mock_cache.get.return_value = {
+            "video_id": "video123",
+            "title": "Test Song",
+            "channel": "Test Artist",
+            "tempo": 128,
+        }
+        mock_get_cache.return_value = mock_cache
+        mock_get_magenta.return_value.get_pipeline_params.return_value = {"mode": "4tracks"}
+
+        with TestClient(app) as client:
+            response = client.post("/api/v1/song-analysis/jobs/analyze-4tracks/video123")
+            assert response.status_code == 202
+            job_id = response.json()["data"]["job_id"]
+
+            for _ in range(100):
+                status = client.get(f"/api/v1/song-analysis/jobs/{job_id}").json()["data"]
+                if status["status"] == "completed":
+                    break
+                time.sleep(0.01)
+            assert status["status"] == "completed"
+            assert status["progress"] == 100
+
+            response = client.get(f"/api/v1/song-analysis/jobs/{job_id}/result")
+            assert response.status_code == 200
+            assert response.json()["data"]["tempo"] == 128
+
+    def test_unknown_job_returns_404(self, client):
+        """存在しないジョブは404"""
+        response = client.get("/api/v1/song-analysis/jobs/unknown")
+        assert response.status_code == 404
+        response = client.get("/api/v1/song-analysis/jobs/unknown/result")
+        assert response.status_code == 404
+
+
+class TestEventLoopNotBlocked:
+    """解析中もイベントループが止まらないことのテスト"""
+
+    @pytest.mark.asyncio
+    @patch("app.routers.song_analysis.get_gemini_service")
+    @patch("app.routers.song_analysis.get_audio_downloader_service")
+    @patch("app.routers.song_analysis.get_youtube_service")
+    @patch("app.routers.song_analysis.get_magenta_service")
+    @patch("app.routers.song_analysis.get_analysis_cache_service")
+    async def test_health_latency_flat_during_analysis(
+        self, mock_get_cache, mock_get_magenta, mock_get_youtube, mock_get_downloader, mock_get_gemini
+    ):
+        """ダウンロード・分離がブロッキングでも /health は即座に応答する"""
+        import asyncio
+        import time
+        import httpx
+        from app.main import app
+
+        mock_cache = Mock()
+        mock_cache.make_key.return_value = "video123_blocking"
+        mock_cache.get.return_value = None
+        mock_get_cache.return_value = mock_cache
+
+        async def slow_video(*args, **kwargs):
+            await asyncio.sleep(0.2)
+            return {
+                "id": "video123",
+                "title": "Test Song",
+                "channel": "Test Artist",
+                "url": "https://www.youtube.com/watch?v=video123",
+            }
+
+        mock_get_youtube.return_value.get_video_async = slow_video
+        def slow_events(*events, seconds=0.5):
+            def _run(*args, **kwargs):
+                for event in events:
+                    time.sleep(seconds)
+                    yield event
+            return _run
+
+        mock_get_downloader.return_value.download_audio_with_progress_async.side_effect = async_events(
+            {"stage": "complete", "progress": 100, "message": "完了", "file_path": "/tmp/test.wav"},
+            seconds=0.5,
+        )
+        magenta = mock_get_magenta.return_value
+        magenta.get_pipeline_params.return_value = {"mode": "4tracks"}
+        magenta.audio_to_4tracks_with_progress.side_effect = slow_events(
+            {"stage": "complete", "progress": 100, "message": "完了",
+             "result": {"success": True, "tempo": 120, "tracks": {}, "error": None}},
+        )
+        magenta.extract_chords_from_notes.return_value = []
+
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as ac:
+            analysis = asyncio.create_task(ac.get("/api/v1/song-analysis/analyze-4tracks/video123"))
+            await asyncio.sleep(0.05)
+
+            latencies = []
+            while not analysis.done():
+                started = time.perf_counter()
+                response = await ac.get("/health")
+                latencies.append(time.perf_counter() - started)
+                assert response.status_code == 200
+                await asyncio.sleep(0.05)
+
+            response = await analysis
+
+        assert response.status_code == 200
+        # 解析は合計1.2秒ブロックするが、その間も /health は応答し続ける
+        assert len(latencies) >= 5
+        assert max(latencies) < 0.2
+
+
+class TestFourTrackStream:
+    """4トラック解析のSSEストリーミングのテスト"""
+
+    @patch("app.routers.song_analysis.get_gemini_service")
+    @patch("app.routers.song_analysis.get_audio_downloader_service")
+    @patch("app.routers.song_analysis.get_youtube_service")
+    @patch("app.routers.song_analysis.get_magenta_service")
+    @patch("app.routers.song_analysis.get_analysis_cache_service")
+    def test_tracks_streamed_before_complete(
+        self, mock_get_cache, mock_get_magenta, mock_get_youtube, mock_get_downloader, mock_get_gemini, client
+    ):
+        """各トラックのノートは変換完了時に track イベントで届く"""
+        import json
+
+        mock_cache = Mock()
+        mock_cache.make_key.return_value = "video123_4tracks_stream"
+        mock_cache.get.return_value = None
+        mock_get_cache.return_value = mock_cache
+
+        mock_get_youtube.return_value.get_video_async = AsyncMock(return_value={
+            "id": "video123",
+            "title": "Test Song",
+            "channel": "Test Artist",
+            "url": "https://www.youtube.com/watch?v=video123",
+        })
+        mock_get_downloader.return_value.download_audio_with_progress_async.side_effect = async_events(
+            {"stage": "download", "progress": 50, "message": "ダウンロード中... 50%"},
+            {"stage": "complete", "progress": 100, "message": "ダウンロード完了", "file_path": "/tmp/test.wav"},
+        )
+        bass = {"notes": [{"pitch": 40, "start": 0.0, "end": 0.5, "velocity": 90}], "midi_path": None}
+        drums = {"notes": [{"pitch": 36, "start": 0.0, "end": 0.1, "velocity": 100}], "midi_path": None}
+        magenta = mock_get_magenta.return_value
+        magenta.get_pipeline_params.return_value = {"mode": "4tracks"}
+        magenta.audio_to_4tracks_with_progress.return_value = iter([
+            {"stage": "separate", "progress": 5, "message": "楽器を分離中（Demucs）..."},
+            {"stage": "track", "progress": 62, "message": "bass トラックの変換完了",
+             "track": "bass", "tempo": 120, "data": bass},
+            {"stage": "track", "progress": 75, "message": "drums トラックの変換完了",
+             "track": "drums", "tempo": 120, "data": drums},
+            {"stage": "complete", "progress": 100, "message": "4トラック変換完了",
+             "result": {"success": True, "tempo": 120, "tracks": {"drums": drums, "bass": bass}, "error": None}},
+        ])
+        magenta.extract_chords_from_notes.return_value = []
+
+        response = client.get("/api/v1/song-analysis/analyze-4tracks/video123/stream")
+        assert response.status_code == 200
+        events = [
+            json.loads(line[len("data: "):])
+            for line in response.text.splitlines() if line.startswith("data: ")
+        ]
+        stages = [e["stage"] for e in events]
+        assert "download" in stages
+        assert "separate" in stages
+
+        track_events = [e for e in events if e["stage"] == "track"]
+        assert [e["data"]["track"] for e in track_events] == ["bass", "drums"]
+        assert track_events[0]["data"]["notes"][0]["pitch"] == 40
+        assert track_events[0]["data"]["tempo"] == 120
+        assert stages.index("track") < stages.index("complete")
+
+        # 進捗は単調増加
+        progresses = [e["progress"] for e in events]
+        assert progresses == sorted(progresses)
+        assert events[-1]["stage"] == "complete"
+        assert set(events[-1]["data"]["tracks"]) == {"drums", "bass"}
@@ -0,0 +1,112 @@
+"""
+AnalysisCacheServiceのテスト
+"""
+import pytest
+from unittest.mock import patch
+
+
+@pytest.fixture
+def cache_service(tmp_path):
+    """一時ディレクトリを使うキャッシュサービス"""
+    from app.services.analysis_cache import AnalysisCacheService
+
+    with patch.dict("os.environ", {"ANISONG_CACHE_DIR": str(tmp_path)}):
+        return AnalysisCacheService()
+
+
+class TestAnalysisCacheService:
+    """AnalysisCacheServiceのテスト"""
+
+    def test_get_missing_returns_none(self, cache_service):
+        """未保存のキーはNoneを返す"""
+        assert cache_service.get("video123", {"mode": "single"}) is None
+
+    def test_set_and_get(self, cache_service):
+        """保存した結果を取得できる"""
+        result = {"video_id": "video123", "tempo": 120}
+        cache_service.set("video123", {"mode": "single"}, result)
+
+        assert cache_service.get("video123", {"mode": "single"}) == result
+
+    def test_params_change_misses(self, cache_service):
+        """パラメータが変わると別エントリになる"""
+        cache_service.set("video123", {"threshold": 0.3}, {"tempo": 120})
+
+        assert cache_service.get("video123", {"threshold": 0.35}) is None
+
+    def test_key_ignores_dict_order(self, cache_service):
+        """パラメータの順序はキーに影響しない"""
+        key1 = cache_service.make_key("video123", {"a": 1, "b": 2})
+        key2 = cache_service.make_key("video123", {"b": 2, "a": 1})
+        assert key1 == key2
+
+    def test_persisted_to_disk(self, cache_service, tmp_path):
+        """ディスクに保存され、別インスタンスからも読める"""
+        from app.services.analysis_cache import AnalysisCacheService
+
+        cache_service.set("video123", {"mode": "4tracks"}, {"tempo": 128})
+
+        with patch.dict("os.environ", {"ANISONG_CACHE_DIR": str(tmp_path)}):
+            other = AnalysisCacheService()
+        assert other.get("video123", {"mode": "4tracks"}) == {"tempo": 128}
+
+    def test_memory_lru_eviction(self, cache_service):
+        """メモリ上限を超えると古いエントリから破棄（ディスクには残る）"""
+        cache_service.max_memory_entries = 2
+        cache_service.set("a", {}, {"v": 1})
+        cache_service.set("b", {}, {"v": 2})
+        cache_service.get("a", {})  # aを最近使ったことにする
+        cache_service.set("c", {}, {"v": 3})
+
+        assert cache_service.make_key("b", {}) not in cache_service._memory
+        assert cache_service.make_key("a", {}) in cache_service._memory
+        assert cache_service.get("b", {}) == {"v": 2}
+
+    def test_broken_entry_is_discarded(self, cache_service):
+        """壊れたキャッシュファイルは無視して削除する"""
+        key = cache_service.make_key("video123", {})
+        path = cache_service.cache_dir / f"{key}.json"
+        path.write_text("{broken", encoding="utf-8")
+
+        assert cache_service.get("video123", {}) is None
+        assert not path.exists()
+
+    def test_invalidate(self, cache_service):
+        """動画単位でキャッシュを削除できる"""
+        cache_service.set("video123", {"mode": "single"}, {"v": 1})
+        cache_service.set("video123", {"mode": "4tracks"}, {"v": 2})
+        cache_service.set("video1234", {"mode": "single"}, {"v": 3})
+
+        assert cache_service.invalidate("video123") == 2
+        assert cache_service.get("video123", {"mode": "single"}) is None
+        assert cache_service.get("video1234", {"mode": "single"}) == {"v": 3}
+
+    def test_disk_eviction_lru(self, cache_service):
+        """ディスク容量の上限を超えると最後に使った時刻が古いエントリから削除"""
+        import os
+
+        result = {"notes": "x" * 1000}
+        for i, video_id in enumerate(["a", "b", "c"]):
+            cache_service.set(video_id, {}, result)
+            path = cache_service.cache_dir / f"{cache_service.make_key(video_id, {})}.json"
+            os.utime(path, (1000 + i, 1000 + i))
+        cache_service._memory.clear()
+        cache_service.get("a", {})  # aを最近使ったことにする
+
+        cache_service.max_disk_bytes = 2500
+        cache_service.set("d", {}, result)
+
+        assert cache_service.evict() == 0
+        remaining = sorted(p.stem.split("_")[0] for p in cache_service.cache_dir.glob("*.json"))
+        assert remaining == ["a", "d"]
+
+    def test_disk_disabled(self, tmp_path):
+        """容量0ならディスクに保存しない（メモリのみ）"""
+        from app.services.analysis_cache import AnalysisCacheService
+
+        with patch.dict("os.environ", {"ANISONG_CACHE_DIR": str(tmp_path), "ANISONG_CACHE_MAX_MB": "0"}):
+            service = AnalysisCacheService()
+        service.set("video123", {}, {"tempo": 120})
+
+        assert service.get("video123", {}) == {"tempo": 120}
+        assert list(tmp_path.glob("*.json")) == []
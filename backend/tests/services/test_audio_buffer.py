@@ -0,0 +1,145 @@
+"""
+AudioBuffer のテスト
+"""
+from unittest.mock import patch
+
+import numpy as np
+import pytest
+import soundfile as sf
+
+
+@pytest.fixture
+def stereo_wav(tmp_path):
+    """48kHzステレオのテスト音声"""
+    sr = 48000
+    t = np.arange(sr * 2) / sr
+    left = 0.3 * np.sin(2 * np.pi * 220 * t)
+    right = 0.3 * np.sin(2 * np.pi * 330 * t)
+    path = tmp_path / "stereo.wav"
+    sf.write(str(path), np.stack([left, right], axis=1), sr, subtype="PCM_16")
+    return path
+
+
+class TestAudioBuffer:
+    """AudioBufferのテスト"""
+
+    def test_mono_matches_librosa_load(self, stereo_wav):
+        """モノラル・リサンプル済みビューは librosa.load と同じ結果"""
+        import librosa
+        from app.services.audio_buffer import AudioBuffer
+
+        audio = AudioBuffer(stereo_wav)
+        for sr in (22050, 44100, None):
+            expected, _ = librosa.load(str(stereo_wav), sr=sr, mono=True)
+            np.testing.assert_array_equal(audio.mono(sr), expected)
+
+    def test_decodes_once(self, stereo_wav):
+        """複数のビューを取得してもデコードは1回だけ"""
+        from app.services import audio_buffer
+        from app.services.audio_buffer import AudioBuffer
+
+        audio = AudioBuffer(stereo_wav)
+        with patch.object(audio_buffer.sf, "read", wraps=sf.read) as mock_read:
+            audio.mono(22050)
+            audio.mono(44100)
+            assert audio.samples.shape == (2, 96000)
+            assert audio.mono(22050) is audio.mono(22050)
+
+        assert mock_read.call_count == 1
+
+    def test_lazy_decode(self, tmp_path):
+        """使われるまでデコードしない"""
+        from app.services.audio_buffer import AudioBuffer
+
+        audio = AudioBuffer(tmp_path / "missing.wav")
+        assert audio.name == "missing"
+
+    def test_from_samples(self):
+        """デコード済みの配列から作成"""
+        from app.services.audio_buffer import AudioBuffer
+
+        samples = np.ones(44100, dtype=np.float64)
+        audio = AudioBuffer(samples=samples, sample_rate=44100)
+
+        assert audio.samples.shape == (1, 44100)
+        assert audio.samples.dtype == np.float32
+        assert audio.duration == 1.0
+        assert audio.name == "audio"
+        assert len(audio.mono(22050)) == 22050
+
+    def test_compressed_audio_decoded_with_ffmpeg(self, tmp_path):
+        """soundfileで読めない形式はffmpegのパイプで指定のサンプルレートにデコード"""
+        from app.services import audio_buffer
+        from app.services.audio_buffer import AudioBuffer
+
+        path = tmp_path / "audio.webm"
+        path.write_bytes(b"not a wav file")
+        pcm = np.stack([np.full(22050, 0.25), np.full(22050, -0.25)], axis=1).astype(np.float32)
+
+        with patch.object(audio_buffer.subprocess, "run") as mock_run:
+            mock_run.return_value.returncode = 0
+            mock_run.return_value.stdout = pcm.tobytes()
+            audio = AudioBuffer(path, decode_sample_rate=22050)
+
+            assert audio.sample_rate == 22050
+            assert audio.samples.shape == (2, 22050)
+            np.testing.assert_array_equal(audio.mono(22050), np.zeros(22050, dtype=np.float32))
+
+        cmd = mock_run.call_args.args[0]
+        assert cmd[0] == "ffmpeg"
+        assert cmd[cmd.index("-ar") + 1] == "22050"
+        assert cmd[-1] == "-"
+
+    def test_requires_source(self):
+        """パスも配列もない場合はエラー"""
+        from app.services.audio_buffer import AudioBuffer
+
+        with pytest.raises(ValueError):
+            AudioBuffer()
+
+
+class TestSharedAudio:
+    """SharedAudio（共有メモリでのステム受け渡し）のテスト"""
+
+    def test_roundtrip_without_copy_in_pickle(self):
+        """pickleには波形を含めず、開くと同じ波形が読める"""
+        import pickle
+        from app.services.audio_buffer import SharedAudio
+
+        samples = np.linspace(-1, 1, 44100, dtype=np.float32)
+        shared = SharedAudio.create(samples, 44100)
+        try:
+            payload = pickle.dumps(shared)
+            assert len(payload) < 1024
+
+            restored = pickle.loads(payload)
+            with restored.open() as audio:
+                assert audio.sample_rate == 44100
+                np.testing.assert_array_equal(audio.mono(), samples)
+                assert len(audio.mono(22050)) == 22050
+        finally:
+            shared.unlink()
+
+    def test_unlink_removes_segment(self):
+        """unlink後は開けない（二重のunlinkはエラーにしない）"""
+        from app.services.audio_buffer import SharedAudio
+
+        shared = SharedAudio.create(np.zeros(100, dtype=np.float32), 44100)
+        shared.unlink()
+        shared.unlink()
+
+        with pytest.raises(FileNotFoundError):
+            with shared.open():
+                pass
+
+    def test_separator_cleanup_unlinks_shared_tracks(self):
+        """AudioSeparatorService.cleanup は共有メモリのステムも削除する"""
+        from app.services.audio_buffer import SharedAudio
+        from app.services.audio_separator import AudioSeparatorService
+
+        shared = SharedAudio.create(np.zeros(100, dtype=np.float32), 44100)
+        AudioSeparatorService().cleanup({"bass": shared})
+
+        with pytest.raises(FileNotFoundError):
+            with shared.open():
+                pass
@@ -1,6 +1,8 @@
 """
 AudioDownloaderサービスのテスト
 """
+import asyncio
+
 import pytest
 from unittest.mock import Mock, patch, MagicMock
 from pathlib import Path
@@ -14,17 +16,20 @@ class TestAudioDownloaderService:
         """音声ダウンロードが成功する"""
         from app.services.audio_downloader import AudioDownloaderService
 
-        mock_run.return_value = MagicMock(returncode=0, stderr="")
+        def run(cmd, **kwargs):
+            # -o のパスに元のストリームの拡張子でダミーファイルを作成
+            Path(cmd[cmd.index("-o") + 1].replace("%(ext)s", "webm")).write_bytes(b"audio")
+            return MagicMock(returncode=0, stderr="")
 
-        service = AudioDownloaderService()
+        mock_run.side_effect = run
 
-        # テンポラリディレクトリにダミーファイルを作成
-        with patch.object(Path, "exists", return_value=True):
-            result = service.download_audio("https://www.youtube.com/watch?v=test123")
+        service = AudioDownloaderService()
+        result = service.download_audio("https://www.youtube.com/watch?v=test123")
 
         assert result["success"] is True
-        assert result["file_path"] is not None
+        assert result["file_path"].endswith(".webm")
         assert result["error"] is None
+        service.release(result["file_path"])
 
     @patch("app.services.audio_downloader.subprocess.run")
     def test_download_audio_failure(self, mock_run):
@@ -77,3 +82,257 @@ class TestAudioDownloaderService:
         result = service.cleanup("/nonexistent/path/file.wav")
 
         assert result is False
+
+
+class TestDownloadCache:
+    """video_idごとのダウンロードキャッシュのテスト"""
+
+    @pytest.fixture
+    def service(self, tmp_path, monkeypatch):
+        from app.services.audio_downloader import AudioDownloaderService
+
+        monkeypatch.setenv("ANISONG_AUDIO_DIR", str(tmp_path / "audio"))
+        monkeypatch.setenv("ANISONG_AUDIO_CACHE_MAX_MB", "10")
+        return AudioDownloaderService()
+
+    @staticmethod
+    def fake_yt_dlp(size=1000, delay=0.0, calls=None):
+        """-o のパスにファイルを書き出すyt-dlpの代わり"""
+        import time
+
+        def run(cmd, **kwargs):
+            if calls is not None:
+                calls.append(cmd[-1])
+            time.sleep(delay)
+            output = Path(cmd[cmd.index("-o") + 1].replace("%(ext)s", "webm"))
+            output.write_bytes(b"\0" * size)
+            return MagicMock(returncode=0, stderr="")
+        return run
+
+    def test_second_download_uses_cache(self, service):
+        """同じ動画の2回目はダウンロードしない"""
+        calls = []
+        with patch("app.services.audio_downloader.subprocess.run", side_effect=self.fake_yt_dlp(calls=calls)):
+            first = service.download_audio("https://youtu.be/abc", video_id="abc")
+            service.release(first["file_path"])
+            second = service.download_audio("https://youtu.be/abc", video_id="abc")
+
+        assert first["success"] and second["success"]
+        assert first["file_path"] == second["file_path"]
+        assert Path(second["file_path"]).name == "abc.webm"
+        assert len(calls) == 1
+
+        # キャッシュのファイルは解放しても削除しない
+        service.release(second["file_path"])
+        assert Path(second["file_path"]).exists()
+
+    def test_sections_cached_separately(self, service):
+        """区間指定はその区間だけをダウンロードし、曲全体とは別にキャッシュする"""
+        commands = []
+
+        def run(cmd, **kwargs):
+            commands.append(cmd)
+            return self.fake_yt_dlp()(cmd, **kwargs)
+
+        with patch("app.services.audio_downloader.subprocess.run", side_effect=run):
+            chorus = service.download_audio("https://youtu.be/abc", video_id="abc", section=(30.0, 60.5))
+            full = service.download_audio("https://youtu.be/abc", video_id="abc")
+            again = service.download_audio("https://youtu.be/abc", video_id="abc", section=(30.0, 60.5))
+
+        assert Path(chorus["file_path"]).name == "abc~30000-60500.webm"
+        assert Path(full["file_path"]).name == "abc.webm"
+        assert again["file_path"] == chorus["file_path"]
+        assert len(commands) == 2
+        section_args = commands[0][commands[0].index("--download-sections") + 1]
+        assert section_args == "*30.0-60.5"
+        assert "--download-sections" not in commands[1]
+        for r in (chorus, full, again):
+            service.release(r["file_path"])
+
+    def test_concurrent_downloads_fetch_once(self, service):
+        """同じ動画を同時にダウンロードしても取得は1回"""
+        from concurrent.futures import ThreadPoolExecutor
+
+        calls = []
+        with patch(
+            "app.services.audio_downloader.subprocess.run",
+            side_effect=self.fake_yt_dlp(delay=0.2, calls=calls),
+        ):
+            with ThreadPoolExecutor(max_workers=4) as pool:
+                results = list(pool.map(
+                    lambda _: service.download_audio("https://youtu.be/abc", video_id="abc"), range(4)
+                ))
+
+        assert len(calls) == 1
+        assert {r["file_path"] for r in results} == {results[0]["file_path"]}
+        for r in results:
+            service.release(r["file_path"])
+
+    @pytest.mark.asyncio
+    async def test_progress_download_uses_cache(self, service):
+        """進捗付きダウンロードも同じキャッシュを使う"""
+        with patch("app.services.audio_downloader.subprocess.run", side_effect=self.fake_yt_dlp()):
+            result = service.download_audio("https://youtu.be/abc", video_id="abc")
+        service.release(result["file_path"])
+
+        with patch("app.services.audio_downloader.asyncio.create_subprocess_exec") as mock_exec:
+            events = [
+                e async for e in service.download_audio_with_progress_async("https://youtu.be/abc", video_id="abc")
+            ]
+
+        mock_exec.assert_not_called()
+        assert events[-1]["stage"] == "complete"
+        assert events[-1]["file_path"] == result["file_path"]
+        service.release(events[-1]["file_path"])
+
+    def test_evicts_lru_but_keeps_files_in_use(self, service):
+        """容量を超えたら古いものから削除するが、使用中のファイルは残す"""
+        import os
+        import time
+
+        with patch("app.services.audio_downloader.subprocess.run", side_effect=self.fake_yt_dlp(size=4000)):
+            in_use = service.download_audio("https://youtu.be/a", video_id="a")["file_path"]
+            old = service.download_audio("https://youtu.be/b", video_id="b")["file_path"]
+            service.release(old)
+            past = time.time() - 100
+            os.utime(in_use, (past, past))
+            os.utime(old, (past + 10, past + 10))
+
+            service.cache_max_bytes = 5000
+            new = service.download_audio("https://youtu.be/c", video_id="c")["file_path"]
+
+        assert Path(in_use).exists()
+        assert not Path(old).exists()
+        assert Path(new).exists()
+        service.release(in_use)
+        service.release(new)
+
+    def test_release_deletes_uncached_file(self, service):
+        """キャッシュを使わずにダウンロードしたファイルは解放時に削除"""
+        with patch("app.services.audio_downloader.subprocess.run", side_effect=self.fake_yt_dlp()):
+            result = service.download_audio("https://youtu.be/abc")
+
+        assert Path(result["file_path"]).parent == service.temp_dir
+        assert service.release(result["file_path"]) is True
+        assert not Path(result["file_path"]).exists()
+
+
+class TestAudioFormat:
+    """保存形式（native / wav）のテスト"""
+
+    @patch("app.services.audio_downloader.subprocess.run")
+    def test_native_keeps_stream(self, mock_run, monkeypatch):
+        """nativeではWAVに変換せず、ビットレート上限付きで音声ストリームを選ぶ"""
+        from app.services.audio_downloader import AudioDownloaderService
+
+        monkeypatch.setenv("ANISONG_AUDIO_FORMAT", "native")
+        monkeypatch.setenv("ANISONG_AUDIO_MAX_ABR", "128")
+        mock_run.return_value = MagicMock(returncode=1, stderr="error")
+
+        service = AudioDownloaderService()
+        service.download_audio("https://www.youtube.com/watch?v=test123")
+
+        cmd = mock_run.call_args.args[0]
+        assert "-x" not in cmd
+        assert "bestaudio[acodec=opus][abr<=128]" in cmd[cmd.index("-f") + 1]
+        assert service.get_params() == {"audio_format": "native", "max_abr": 128}
+
+    @patch("app.services.audio_downloader.subprocess.run")
+    def test_wav_converts(self, mock_run, monkeypatch):
+        """wavでは従来どおりWAVに変換する"""
+        from app.services.audio_downloader import AudioDownloaderService
+
+        monkeypatch.setenv("ANISONG_AUDIO_FORMAT", "wav")
+        mock_run.return_value = MagicMock(returncode=1, stderr="error")
+
+        AudioDownloaderService().download_audio("https://www.youtube.com/watch?v=test123")
+
+        cmd = mock_run.call_args.args[0]
+        assert cmd[cmd.index("-x"):cmd.index("-x") + 3] == ["-x", "--audio-format", "wav"]
+
+
+FAKE_YT_DLP = """#!{python}
+import sys, time, os
+args = sys.argv[1:]
+output = args[args.index("-o") + 1].replace("%(ext)s", "webm")
+with open(os.environ["FAKE_YT_DLP_PID"], "w") as f:
+    f.write(str(os.getpid()))
+for percent in (10, 50):
+    print(f"{{percent}}.0%", flush=True)
+    time.sleep(float(os.environ.get("FAKE_YT_DLP_DELAY", "0")))
+with open(output, "wb") as f:
+    f.write(b"audio")
+print("100.0%", flush=True)
+"""
+
+
+class TestAsyncDownload:
+    """asyncio版ダウンロードのテスト"""
+
+    @pytest.fixture
+    def service(self, tmp_path, monkeypatch):
+        """PATH上のyt-dlpを偽物に差し替えたサービス"""
+        import os
+        import sys
+        from app.services.audio_downloader import AudioDownloaderService
+
+        bin_dir = tmp_path / "bin"
+        bin_dir.mkdir()
+        script = bin_dir / "yt-dlp"
+        script.write_text(FAKE_YT_DLP.format(python=sys.executable))
+        script.chmod(0o755)
+        monkeypatch.setenv("PATH", f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+        monkeypatch.setenv("FAKE_YT_DLP_PID", str(tmp_path / "pid"))
+        monkeypatch.setenv("ANISONG_AUDIO_DIR", str(tmp_path / "audio"))
+        monkeypatch.setenv("ANISONG_AUDIO_CACHE_MAX_MB", "10")
+        return AudioDownloaderService()
+
+    @pytest.mark.asyncio
+    async def test_progress_and_cache(self, service):
+        """進捗を返して完了し、2回目はキャッシュを使う"""
+        events = [e async for e in service.download_audio_with_progress_async("https://youtu.be/abc", "abc")]
+
+        assert [e["progress"] for e in events if e["stage"] == "download"] == [0, 10, 50, 100]
+        assert events[-1]["stage"] == "complete"
+        assert Path(events[-1]["file_path"]).read_bytes() == b"audio"
+        service.release(events[-1]["file_path"])
+
+        again = [e async for e in service.download_audio_with_progress_async("https://youtu.be/abc", "abc")]
+        assert [e["stage"] for e in again] == ["complete"]
+        service.release(again[-1]["file_path"])
+
+    @pytest.mark.asyncio
+    async def test_cancel_kills_process(self, service, tmp_path, monkeypatch):
+        """キャンセル（クライアント切断）するとyt-dlpを終了させる"""
+        import os
+
+        monkeypatch.setenv("FAKE_YT_DLP_DELAY", "30")
+
+        async def consume():
+            async for event in service.download_audio_with_progress_async("https://youtu.be/abc", "abc"):
+                if event["progress"] == 10:
+                    started.set()
+
+        started = asyncio.Event()
+        task = asyncio.create_task(consume())
+        await asyncio.wait_for(started.wait(), timeout=10)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+        pid = int((tmp_path / "pid").read_text())
+        with pytest.raises(ProcessLookupError):
+            os.kill(pid, 0)
+        # ロックも解放されている
+        assert service._lock_for("abc").acquire(blocking=False)
+
+    @pytest.mark.asyncio
+    async def test_timeout(self, service, monkeypatch):
+        """タイムアウトしたらエラーを返す"""
+        monkeypatch.setenv("FAKE_YT_DLP_DELAY", "30")
+        service.timeout = 0.5
+
+        events = [e async for e in service.download_audio_with_progress_async("https://youtu.be/abc")]
+
+        assert events[-1]["stage"] == "error"
+        assert "タイムアウト" in events[-1]["message"]
@@ -46,51 +46,48 @@ class TestAudioSeparatorService:
             assert result["success"] is False
             assert "not found" in result["error"].lower()
 
-    @patch("app.services.audio_separator.torchaudio")
-    @patch("app.services.audio_separator.apply_model")
+    @patch("app.services.audio_separator.get_stem_cache_service")
     @patch("app.services.audio_separator.pretrained")
-    @patch("app.services.audio_separator.torch")
-    def test_separate_success(self, mock_torch, mock_pretrained, mock_apply, mock_torchaudio):
-        """楽器分離が成功"""
-        import tempfile
-        import os
-
-        # テンポラリファイルを作成
-        with tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as f:
-            temp_path = f.name
-            f.write(b"dummy audio data")
-
-        try:
-            mock_torch.backends.mps.is_available.return_value = False
-            mock_torch.cuda.is_available.return_value = False
-
-            # モデルのモック
-            mock_model = MagicMock()
-            mock_model.sources = ["drums", "bass", "other", "vocals"]
-            mock_pretrained.get_model.return_value = mock_model
+    def test_separate_success(self, mock_pretrained, mock_get_stem_cache, tmp_path, monkeypatch):
+        """楽器分離が成功し、区間ごとの分離結果を順にステムのWAVに書き出す"""
+        import numpy as np
+        import soundfile as sf
+        from app.services.audio_separator import AudioSeparatorService
 
-            # 音声読み込みのモック
-            mock_wav = MagicMock()
-            mock_wav.shape = [2, 44100]
-            mock_wav.unsqueeze.return_value = mock_wav
-            mock_wav.to.return_value = mock_wav
-            mock_torchaudio.load.return_value = (mock_wav, 44100)
+        monkeypatch.setenv("ANISONG_SEPARATED_DIR", str(tmp_path / "separated"))
+        mock_get_stem_cache.return_value.enabled = False
 
-            # 分離結果のモック
-            mock_sources = MagicMock()
-            mock_sources.__getitem__ = lambda self, idx: MagicMock()
-            mock_apply.return_value = mock_sources
+        # モデルのモック
+        mock_model = MagicMock()
+        mock_model.sources = ["drums", "bass", "other", "vocals"]
+        mock_pretrained.get_model.return_value = mock_model
 
-            from app.services.audio_separator import AudioSeparatorService
+        audio_path = tmp_path / "song.wav"
+        sf.write(str(audio_path), np.zeros((1000, 2), dtype=np.float32), 44100)
 
-            service = AudioSeparatorService()
-            result = service.separate(temp_path)
+        # 2区間に分けて分離結果を返す（ステムごとに値を変える）
+        def fake_chunks(wav, profile=None):
+            assert tuple(wav.shape) == (2, 1000)
+            for offset, length in ((0, 600), (600, 400)):
+                yield offset, {
+                    name: np.full((2, length), (i + 1) * 0.1 + offset / 10000, dtype=np.float32)
+                    for i, name in enumerate(mock_model.sources)
+                }
 
-            # 成功を確認（モックなので実際のファイルは生成されない）
-            assert mock_apply.called
+        service = AudioSeparatorService()
+        service.iter_separated_chunks = fake_chunks
+        result = service.separate(str(audio_path))
 
-        finally:
-            os.unlink(temp_path)
+        assert result["success"] is True
+        assert set(result["tracks"]) == set(mock_model.sources)
+        for i, name in enumerate(mock_model.sources):
+            data, sr = sf.read(result["tracks"][name], dtype="float32", always_2d=True)
+            assert sr == 44100
+            assert data.shape == (1000, 2)
+            np.testing.assert_allclose(data[:600], (i + 1) * 0.1, atol=1e-4)
+            np.testing.assert_allclose(data[600:], (i + 1) * 0.1 + 0.06, atol=1e-4)
+        service.cleanup(result["tracks"])
+        assert not any(Path(p).exists() for p in result["tracks"].values())
 
     def test_cleanup(self):
         """クリーンアップが動作"""
@@ -108,3 +105,172 @@ class TestAudioSeparatorService:
             # 存在しないファイルのクリーンアップ
             service.cleanup({"test": "/nonexistent/file.wav"})
             # エラーが出ないことを確認
+
+
+class TestChunkedSeparation:
+    """区間分離のテスト"""
+
+    @pytest.fixture
+    def service(self, tmp_path, monkeypatch):
+        """入力をそのまま各ステムとして返すモデルに差し替えたサービス"""
+        import numpy as np
+        from app.services.audio_separator import AudioSeparatorService
+
+        monkeypatch.setenv("ANISONG_SEPARATED_DIR", str(tmp_path))
+        service = AudioSeparatorService()
+        service.device = "cpu"
+        model = MagicMock()
+        model.sources = ["drums", "bass", "other", "vocals"]
+        service._models = {"htdemucs": model}
+        service.segment_lengths = []
+
+        def fake_apply(segment, profile=None):
+            service.segment_lengths.append(segment.shape[-1])
+            x = segment.numpy()
+            return np.stack([x * (i + 1) for i in range(4)]).astype(np.float32)
+
+        service._apply = fake_apply
+        return service
+
+    def _wav(self, seconds):
+        import torch
+        t = torch.arange(int(44100 * seconds), dtype=torch.float32) / 44100
+        # 4倍してもクリップしない振幅
+        return 0.2 * torch.stack([torch.sin(2 * 3.14159 * 220 * t), torch.cos(2 * 3.14159 * 330 * t)])
+
+    def test_chunks_reassemble_input(self, service):
+        """重なり部分をクロスフェードしても元の長さ・波形に戻る"""
+        import numpy as np
+
+        service.chunk_seconds = 10
+        service.chunk_overlap = 1
+        wav = self._wav(35.5)
+
+        pieces = {name: [] for name in service.model.sources}
+        expected_offset = 0
+        for offset, chunk in service.iter_separated_chunks(wav):
+            assert offset == expected_offset
+            for name, audio in chunk.items():
+                pieces[name].append(audio)
+            expected_offset += chunk["drums"].shape[-1]
+
+        # 一度にDemucsに渡すのは1区間分だけ
+        assert max(service.segment_lengths) == 44100 * 10
+        assert len(service.segment_lengths) == 4
+
+        for i, name in enumerate(service.model.sources):
+            joined = np.concatenate(pieces[name], axis=-1)
+            np.testing.assert_allclose(joined, wav.numpy() * (i + 1), atol=1e-5)
+
+    def test_short_audio_single_pass(self, service):
+        """区間より短い音声は一度に分離"""
+        service.chunk_seconds = 60
+        wav = self._wav(5)
+
+        chunks = list(service.iter_separated_chunks(wav))
+
+        assert len(chunks) == 1
+        assert service.segment_lengths == [wav.shape[-1]]
+
+    def test_separate_writes_chunks(self, service, tmp_path):
+        """区間ごとにWAV・共有メモリへ書き出す"""
+        import numpy as np
+        import soundfile as sf
+        from app.services.audio_buffer import AudioBuffer
+
+        service.chunk_seconds = 3
+        service.chunk_overlap = 0.5
+        wav = self._wav(10)
+        audio = AudioBuffer(samples=wav.numpy(), sample_rate=44100)
+
+        result = service.separate(audio)
+        assert result["success"] is True
+        bass, sr = sf.read(result["tracks"]["bass"], dtype="float32")
+        assert sr == 44100
+        assert bass.shape == (wav.shape[-1], 2)
+        np.testing.assert_allclose(bass.T, wav.numpy() * 2, atol=1e-3)
+        service.cleanup(result["tracks"])
+
+        # テンポ検出で作られたモノラルのビューは分離の前に解放される
+        audio.mono(22050)
+        result = service.separate(audio, in_memory=True)
+        assert result["success"] is True
+        assert audio._mono_views == {}
+        try:
+            with result["tracks"]["vocals"].open() as stem:
+                np.testing.assert_allclose(stem.mono(), wav.numpy().mean(axis=0) * 4, atol=1e-5)
+        finally:
+            service.cleanup(result["tracks"])
+
+
+class TestSeparationProfiles:
+    """分離プロファイルのテスト"""
+
+    def test_default_profile_from_env(self, monkeypatch):
+        """環境変数で既定のプロファイルを変更できる"""
+        from app.services.audio_separator import AudioSeparatorService
+
+        monkeypatch.setenv("ANISONG_DEMUCS_PROFILE", "fast")
+        service = AudioSeparatorService()
+
+        assert service.default_profile == "fast"
+        assert service.get_params()["profile"] == "fast"
+        assert service.get_params("best")["model"] == "htdemucs_ft"
+
+    def test_unknown_profile(self):
+        """存在しないプロファイルはValueError"""
+        from app.services.audio_separator import AudioSeparatorService
+
+        with pytest.raises(ValueError):
+            AudioSeparatorService.resolve_profile("ultra")
+
+    @patch("app.services.audio_separator.apply_model")
+    @patch("app.services.audio_separator.pretrained")
+    def test_profile_settings_passed_to_demucs(self, mock_pretrained, mock_apply):
+        """プロファイルのモデル・シフト数・重なりでDemucsを実行する"""
+        import numpy as np
+        import torch
+        from app.services.audio_separator import AudioSeparatorService
+
+        mock_apply.return_value = torch.zeros(1, 4, 2, 100)
+        service = AudioSeparatorService()
+        service.device = "cpu"
+
+        sources = service._apply(torch.zeros(2, 100), "fast")
+
+        assert sources.shape == (4, 2, 100)
+        assert isinstance(sources, np.ndarray)
+        mock_pretrained.get_model.assert_called_once_with("htdemucs")
+        kwargs = mock_apply.call_args.kwargs
+        assert kwargs["shifts"] == 0
+        assert kwargs["overlap"] == 0.1
+
+    @patch("app.services.audio_separator.apply_model")
+    @patch("app.services.audio_separator.pretrained")
+    def test_threads_per_worker(self, mock_pretrained, mock_apply, monkeypatch):
+        """分離中はCPUワーカーごとに分け合ったスレッド数を使い、終わったら元に戻す"""
+        import torch
+        from app.services.audio_separator import AudioSeparatorService
+
+        monkeypatch.delenv("ANISONG_DEMUCS_THREADS", raising=False)
+        monkeypatch.setenv("ANISONG_CPU_WORKERS", "2")
+        monkeypatch.setattr("os.cpu_count", lambda: 8)
+        service = AudioSeparatorService()
+        service.device = "cpu"
+        assert service.threads == 4
+
+        used = []
+        mock_apply.side_effect = lambda *args, **kwargs: used.append(torch.get_num_threads()) or torch.zeros(1, 4, 2, 100)
+        previous = torch.get_num_threads()
+        service._apply(torch.zeros(2, 100), "balanced")
+
+        assert used == [4]
+        assert torch.get_num_threads() == previous
+
+    def test_profiles_differ(self):
+        """プロファイルごとに処理量が違い、fast / balanced はシフトなし（決定的）"""
+        from app.services.audio_separator import DEMUCS_PROFILES
+
+        assert DEMUCS_PROFILES["fast"]["overlap"] < DEMUCS_PROFILES["balanced"]["overlap"]
+        assert DEMUCS_PROFILES["fast"]["shifts"] == DEMUCS_PROFILES["balanced"]["shifts"] == 0
+        assert DEMUCS_PROFILES["best"]["shifts"] >= 2
@@ -0,0 +1,155 @@
+"""
+BasicPitchServiceのテスト
+"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch
+
+import pytest
+
+
+def _fake_model_class(model_type_name: str, delay: float = 0.0):
+    """ロードに時間がかかるModelの代わり"""
+    from basic_pitch.inference import Model
+
+    class FakeModel:
+        MODEL_TYPES = Model.MODEL_TYPES
+
+        def __init__(self, model_path):
+            time.sleep(delay)
+            self.model_type = Model.MODEL_TYPES[model_type_name]
+            self.thread = threading.get_ident()
+
+    return FakeModel
+
+
+class TestModelReuse:
+    """ロード済みモデルの再利用のテスト"""
+
+    def test_concurrent_first_use_loads_once(self):
+        """複数スレッドから同時に使っても1回だけロードして共有する"""
+        from app.services.basic_pitch_service import BasicPitchService
+
+        service = BasicPitchService()
+        with patch("app.services.basic_pitch_service.Model", _fake_model_class("TENSORFLOW", delay=0.1)):
+            with ThreadPoolExecutor(max_workers=4) as pool:
+                models = list(pool.map(lambda _: service.model, range(8)))
+
+        assert service.load_count == 1
+        assert all(m is models[0] for m in models)
+
+    def test_tflite_model_is_thread_local(self):
+        """TFLite（スレッドセーフでない）はスレッドごとに別のインスタンスを使う"""
+        from app.services.basic_pitch_service import BasicPitchService
+
+        service = BasicPitchService()
+        with patch("app.services.basic_pitch_service.Model", _fake_model_class("TFLITE")):
+            main_model = service.model
+            assert service.model is main_model
+
+            def use_twice(_):
+                model = service.model
+                assert service.model is model
+                return model
+
+            with ThreadPoolExecutor(max_workers=1) as pool:
+                other_model = pool.submit(use_twice, None).result()
+
+        assert other_model is not main_model
+        assert other_model.thread != main_model.thread
+        assert service.load_count == 2
+
+    def test_repeated_transcription_reuses_model(self):
+        """続けて変換してもモデルのロードは1回（呼び出しごとに読み込まない）"""
+        from app.services.audio_buffer import AudioBuffer
+        from app.services.basic_pitch_service import BasicPitchService
+        from app.services.warmup import make_warmup_clip
+
+        service = BasicPitchService()
+        try:
+            service.model
+        except ValueError as e:
+            pytest.skip(f"Basic Pitch model unavailable: {e}")
+
+        audio = AudioBuffer(samples=make_warmup_clip(duration=2.0), sample_rate=44100)
+        for track_type in ("bass", "other"):
+            assert service.transcribe_track(audio, track_type, tempo=120.0)["success"]
+
+        assert service.load_count == 1
+
+
+def _reference_events_to_notes(service, note_events, confidence_threshold, tempo, resolution, drums=False):
+    """以前のノートごとのループでの変換（比較用）"""
+    notes = []
+    for event in note_events:
+        start_time, end_time, pitch, velocity = float(event[0]), float(event[1]), int(event[2]), float(event[3])
+        if velocity < confidence_threshold:
+            continue
+        if drums:
+            end_time = min(end_time, start_time + 0.05)
+            pitch = 36 if pitch < 40 else 38 if pitch < 50 else 42 if pitch < 60 else 49
+        if tempo > 0:
+            start_time = service.quantize_time(start_time, tempo, resolution)
+            if not drums:
+                end_time = service.quantize_time(end_time, tempo, resolution)
+                if end_time <= start_time:
+                    end_time = start_time + 60.0 / tempo * resolution
+        notes.append({
+            "pitch": pitch,
+            "start": round(start_time, 3),
+            "end": round(end_time, 3),
+            "velocity": min(127, max(1, int(velocity * 127))),
+            "confidence": round(velocity, 2),
+        })
+    notes.sort(key=lambda n: n["start"])
+    return notes
+
+
+def _random_events(count, seed=0):
+    """Basic Pitchのnote_eventsと同じ形式のランダムなイベント"""
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    starts = rng.uniform(0, 60, count)
+    # 丸めの境界（x.xxx5）ちょうどの時間・信頼度も混ぜる
+    starts[::7] = np.round(starts[::7], 3) + 0.0005
+    ends = starts + rng.choice([0.01, 0.05, 0.1, 0.3, 1.0], count)
+    pitches = rng.integers(21, 109, count)
+    velocities = rng.uniform(0, 1, count).astype(np.float32)
+    velocities[::5] = np.float32(0.125)
+    return [
+        (float(s), float(e), int(p), v, None)
+        for s, e, p, v in zip(starts, ends, pitches, velocities)
+    ]
+
+
+class TestEventsToNotes:
+    """note_eventsのまとめての変換のテスト"""
+
+    @pytest.mark.parametrize("tempo", [0, 120.0, 97.3, 143.55])
+    @pytest.mark.parametrize("drums", [False, True])
+    def test_same_as_per_note_loop(self, tempo, drums):
+        """ノートごとのループと同じノート・除外数になる"""
+        from app.services.basic_pitch_service import BasicPitchService
+
+        service = BasicPitchService()
+        events = _random_events(2000, seed=int(tempo))
+        resolution = 0.125 if drums else 0.25
+
+        notes, filtered_count = service._events_to_notes(
+            events, confidence_threshold=0.35, tempo=tempo, resolution=resolution, drums=drums
+        )
+
+        expected = _reference_events_to_notes(service, events, 0.35, tempo, resolution, drums)
+        notes = notes.to_dicts()
+        assert notes == expected
+        assert filtered_count == len(events) - len(expected)
+        assert all(type(n["pitch"]) is int and type(n["velocity"]) is int for n in notes)
+
+    def test_empty_events(self):
+        """イベントがなければ空のリスト"""
+        from app.services.basic_pitch_service import BasicPitchService
+
+        notes, filtered_count = BasicPitchService()._events_to_notes([], 0.3, 120.0, 0.25)
+        assert len(notes) == 0 and filtered_count == 0
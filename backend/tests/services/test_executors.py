@@ -0,0 +1,69 @@
+"""
+エグゼキューター（ブロッキング処理の実行先）のテスト
+"""
+import threading
+import pytest
+
+
+def _current_thread_info() -> tuple:
+    """実行スレッドの名前とCPUワーカーかどうかを返す"""
+    from app.services.executors import in_cpu_worker
+
+    return threading.current_thread().name, in_cpu_worker()
+
+
+def _nested_task() -> tuple:
+    """ワーカー内からさらにCPU処理を投げる"""
+    from app.services.executors import run_cpu_task
+
+    return run_cpu_task(_current_thread_info)
+
+
+class TestExecutors:
+    """executorsモジュールのテスト"""
+
+    @pytest.mark.asyncio
+    async def test_run_in_thread_uses_io_pool(self):
+        """I/O処理はスレッドプールで実行される"""
+        from app.services.executors import run_in_thread
+
+        name, in_worker = await run_in_thread(_current_thread_info)
+        assert name.startswith("anisong-io")
+        assert in_worker is False
+
+    def test_run_cpu_task_runs_in_worker(self):
+        """CPU処理はワーカーで実行される（テストではスレッドワーカー）"""
+        from app.services.executors import run_cpu_task, in_cpu_worker
+
+        name, in_worker = run_cpu_task(_current_thread_info)
+        assert name.startswith("anisong-cpu")
+        assert in_worker is True
+        assert in_cpu_worker() is False
+
+    def test_nested_cpu_task_runs_inline(self):
+        """ワーカー内から投げた処理はデッドロックせずその場で実行される"""
+        from app.services.executors import run_cpu_task
+
+        name, in_worker = run_cpu_task(_nested_task)
+        assert name.startswith("anisong-cpu")
+        assert in_worker is True
+
+    def test_run_cpu_task_propagates_exception(self):
+        """ワーカーでの例外は呼び出し元に伝わる"""
+        from app.services.executors import run_cpu_task
+
+        def fail():
+            raise ValueError("boom")
+
+        with pytest.raises(ValueError, match="boom"):
+            run_cpu_task(fail)
+
+    def test_start_cpu_workers_reports_ready(self):
+        """すべてのワーカーの初期化完了を待って結果を返す"""
+        from app.services.executors import start_cpu_workers
+
+        reports = start_cpu_workers(timeout=5)
+
+        assert len(reports) == 1
+        assert "pid" in reports[0]
+        assert reports[0]["warmup"] is None
@@ -0,0 +1,128 @@
+"""
+JobManagerのテスト
+"""
+import asyncio
+import pytest
+from unittest.mock import patch
+
+
+async def _producer(gate: asyncio.Event = None):
+    """進捗イベントを返すプロデューサー"""
+    yield {"stage": "download", "progress": 30, "message": "ダウンロード中..."}
+    if gate:
+        await gate.wait()
+    yield {"stage": "complete", "progress": 100, "message": "解析完了", "data": {"tempo": 120}}
+
+
+async def _wait_finished(job, timeout: float = 1.0):
+    """ジョブの完了を待つ"""
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not job.finished:
+        assert asyncio.get_running_loop().time() < deadline
+        await asyncio.sleep(0.01)
+
+
+class TestJobManager:
+    """JobManagerのテスト"""
+
+    @pytest.mark.asyncio
+    async def test_submit_returns_queued_job(self):
+        """投入直後はqueuedで、ワーカーが処理すると完了する"""
+        from app.services.job_queue import JobManager
+
+        manager = JobManager()
+        job = manager.submit("analyze-4tracks", "video123", _producer)
+        assert job.status == "queued"
+        assert manager.get(job.id) is job
+
+        await _wait_finished(job)
+        assert job.status == "completed"
+        assert job.progress == 100
+        assert job.result == {"tempo": 120}
+        await manager.shutdown()
+
+    @pytest.mark.asyncio
+    async def test_progress_is_tracked(self):
+        """実行中のステージと進捗が反映される"""
+        from app.services.job_queue import JobManager
+
+        manager = JobManager()
+        gate = asyncio.Event()
+        job = manager.submit("analyze-4tracks", "video123", lambda: _producer(gate))
+        await asyncio.sleep(0.01)
+
+        assert job.status == "running"
+        assert job.stage == "download"
+        assert job.progress == 30
+
+        gate.set()
+        await _wait_finished(job)
+        await manager.shutdown()
+
+    @pytest.mark.asyncio
+    async def test_error_event_marks_failed(self):
+        """errorイベントでfailedになる"""
+        from app.services.job_queue import JobManager
+
+        async def failing():
+            yield {"stage": "error", "progress": 0, "message": "動画が見つかりません", "status_code": 404}
+
+        manager = JobManager()
+        job = manager.submit("analyze", "video123", failing)
+        await _wait_finished(job)
+
+        assert job.status == "failed"
+        assert job.status_code == 404
+        assert job.error == "動画が見つかりません"
+        await manager.shutdown()
+
+    @pytest.mark.asyncio
+    async def test_worker_limit(self):
+        """同時実行数はワーカー数までに制限される"""
+        from app.services.job_queue import JobManager
+
+        with patch.dict("os.environ", {"ANISONG_JOB_WORKERS": "1"}):
+            manager = JobManager()
+        gate = asyncio.Event()
+        job1 = manager.submit("analyze", "video1", lambda: _producer(gate))
+        job2 = manager.submit("analyze", "video2", lambda: _producer(gate))
+        await asyncio.sleep(0.01)
+
+        assert job1.status == "running"
+        assert job2.status == "queued"
+
+        gate.set()
+        await _wait_finished(job2)
+        await manager.shutdown()
+
+    @pytest.mark.asyncio
+    async def test_queue_full_raises(self):
+        """キューが満杯なら投入を拒否する"""
+        from app.services.job_queue import JobManager, JobQueueFullError
+
+        with patch.dict("os.environ", {"ANISONG_JOB_WORKERS": "1", "ANISONG_JOB_QUEUE_SIZE": "1"}):
+            manager = JobManager()
+        gate = asyncio.Event()
+        manager.submit("analyze", "video1", lambda: _producer(gate))
+        await asyncio.sleep(0.01)  # 1件目をワーカーが取り出す
+        manager.submit("analyze", "video2", lambda: _producer(gate))
+
+        with pytest.raises(JobQueueFullError):
+            manager.submit("analyze", "video3", lambda: _producer(gate))
+
+        gate.set()
+        await manager.shutdown()
+
+    @pytest.mark.asyncio
+    async def test_expired_jobs_are_purged(self):
+        """TTLを過ぎた完了ジョブは取得できない"""
+        from app.services.job_queue import JobManager
+
+        manager = JobManager()
+        job = manager.submit("analyze", "video123", _producer)
+        await _wait_finished(job)
+
+        manager.result_ttl = 0
+        job.finished_at -= 1
+        assert manager.get(job.id) is None
+        await manager.shutdown()
@@ -191,3 +191,329 @@ class TestChordDetectionInternal:
         # Cメジャーとして検出されるはず
         assert len(chords) > 0
         assert chords[0]["chord"] == "C"
+
+    @pytest.mark.parametrize("window_size", [0.5, 0.3, 0.7])
+    def test_same_as_window_scan(self, window_size):
+        """ウィンドウごとに全ノートを走査する以前の実装と同じコード進行になる"""
+        import numpy as np
+        from app.services.magenta import CHORD_PATTERNS, PITCH_CLASSES, MagentaService
+
+        rng = np.random.default_rng(int(window_size * 10))
+        starts = np.round(rng.uniform(0, 60, 1500) * 4) / 4
+        notes = [
+            {
+                "pitch": int(p),
+                "start": float(s),
+                "end": float(s + d),
+                "velocity": int(v),
+            }
+            for s, d, p, v in zip(
+                starts,
+                rng.choice([0.25, 0.5, 1.0, 2.0], len(starts)),
+                rng.integers(36, 84, len(starts)),
+                rng.integers(1, 128, len(starts)),
+            )
+        ]
+
+        # 以前の実装（ウィンドウごとに全ノートを走査、ルート × パターンを順に採点）
+        expected = []
+        current_time = 0
+        end_time = max(n["end"] for n in notes)
+        while current_time < end_time:
+            window_notes = [
+                n for n in notes if n["start"] < current_time + window_size and n["end"] > current_time
+            ]
+            counts = {}
+            for note in window_notes:
+                counts[note["pitch"] % 12] = counts.get(note["pitch"] % 12, 0) + note["velocity"]
+            best_score, best_chord = 0, None
+            for root in range(12):
+                for chord_type, intervals in CHORD_PATTERNS.items():
+                    score = sum(counts.get((root + i) % 12, 0) for i in intervals)
+                    if score > best_score:
+                        best_score, best_chord = score, PITCH_CLASSES[root] + chord_type
+            if best_chord and (not expected or expected[-1]["chord"] != best_chord):
+                expected.append({"time": round(current_time, 2), "chord": best_chord})
+            current_time += window_size
+
+        chords = MagentaService().extract_chords_from_notes(notes, window_size=window_size)
+        assert chords == expected
+        assert len(chords) > 10
+
+
+class TestChordsFromAudio:
+    """音声から直接コード進行を推定するテスト"""
+
+    @staticmethod
+    def _progression_clip(seconds=16.0, sr=22050):
+        """C → Am → F → G を2秒ずつ繰り返す合成音声（クリック音・メロディ付き）"""
+        import numpy as np
+
+        rng = np.random.default_rng(0)
+        t = np.arange(int(seconds * sr)) / sr
+        triads = np.array([
+            [261.63, 329.63, 392.00],  # C
+            [220.00, 261.63, 329.63],  # Am
+            [174.61, 220.00, 261.63],  # F
+            [196.00, 246.94, 293.66],  # G
+        ])
+        freqs = triads[(t / 2).astype(int) % 4]
+        harmony = 0.1 * sum(
+            np.sin(2 * np.pi * freqs[:, i] * t) + 0.4 * np.sin(4 * np.pi * freqs[:, i] * t)
+            for i in range(3)
+        )
+        clicks = 0.2 * np.exp(-(t % 0.5) * 200) * np.sin(2 * np.pi * 1000 * t)
+        melody_notes = 440.0 * 2 ** (rng.choice([0, 2, 3, 5, 7, 9, 10, 12], int(seconds / 0.5) + 1) / 12)
+        melody = 0.15 * np.sin(2 * np.pi * melody_notes[(t / 0.5).astype(int)] * t)
+        return (harmony + clicks + melody).astype(np.float32)
+
+    def test_progression(self):
+        """ビートごとのばらつきを抑えてコード進行どおりに推定する"""
+        from app.services.audio_buffer import AudioBuffer
+        from app.services.magenta import MagentaService
+
+        audio = AudioBuffer(samples=self._progression_clip(), sample_rate=22050)
+        result = MagentaService().extract_chords_from_audio(audio, offset=30.0)
+
+        assert result["success"]
+        assert [c["chord"] for c in result["chords"]] == ["C", "Am", "F", "G"] * 2
+        # コードは約2秒ごとに切り替わり、時刻にはoffsetが加算される
+        times = [c["time"] for c in result["chords"]]
+        assert times[0] == pytest.approx(30.0, abs=0.3)
+        assert all(abs((b - a) - 2.0) < 0.3 for a, b in zip(times, times[1:]))
+        assert result["duration"] == 46.0
+
+    def test_silence(self):
+        """無音ならコードなし"""
+        import numpy as np
+        from app.services.audio_buffer import AudioBuffer
+        from app.services.magenta import MagentaService
+
+        audio = AudioBuffer(samples=np.zeros(22050 * 4, dtype=np.float32), sample_rate=22050)
+        result = MagentaService().extract_chords_from_audio(audio)
+
+        assert result["success"]
+        assert result["chords"] == []
+
+    def test_audio_to_chords_file_not_found(self):
+        """ファイルがない場合はエラー"""
+        from app.services.magenta import MagentaService
+
+        result = MagentaService().audio_to_chords("/nonexistent/file.wav")
+
+        assert not result["success"]
+        assert "not found" in result["error"]
+
+
+def _run_4tracks(service, audio_path, **kwargs):
+    """4トラック変換を最後まで進めて complete / error の結果を返す"""
+    events = list(service.audio_to_4tracks_with_progress(audio_path, **kwargs))
+    assert events[-1]["stage"] in ("complete", "error")
+    return events[-1]["result"]
+
+
+class TestFourTrackDispatch:
+    """4トラック変換のCPUワーカー実行のテスト"""
+
+    @patch("app.services.magenta.get_librosa_transcriber")
+    @patch("app.services.magenta.get_audio_separator_service")
+    @patch("app.services.magenta.get_basic_pitch_service")
+    def test_stages_run_in_cpu_worker(self, mock_get_basic_pitch, mock_get_separator, mock_get_librosa, tmp_path):
+        """テンポ検出・分離・各トラック変換がCPUワーカーで実行される"""
+        import threading
+        from app.services.magenta import MagentaService
+
+        audio_path = tmp_path / "song.wav"
+        audio_path.write_bytes(b"dummy audio data")
+
+        threads = []
+
+        def record(result):
+            def _run(*args, **kwargs):
+                threads.append(threading.current_thread().name)
+                return result
+            return _run
+
+        basic_pitch = mock_get_basic_pitch.return_value
+        basic_pitch.detect_tempo.side_effect = record((120.0, []))
+        basic_pitch.transcribe_track.side_effect = record(
+            {"success": True, "notes": [{"pitch": 40, "start": 0.0, "end": 0.5, "velocity": 90}], "error": None}
+        )
+        mock_get_separator.return_value.separate.side_effect = record({
+            "success": True,
+            "tracks": {"drums": "d.wav", "bass": "b.wav", "other": "o.wav", "vocals": "v.wav"},
+            "error": None,
+        })
+        librosa = mock_get_librosa.return_value
+        librosa.extract_drums.side_effect = record({"success": True, "notes": [], "error": None})
+        librosa.extract_melody.side_effect = record({"success": False, "notes": [], "error": "pyin failed"})
+
+        service = MagentaService()
+        service.temp_dir = tmp_path
+        result = _run_4tracks(service, str(audio_path))
+
+        assert result["success"] is True
+        assert result["tempo"] == 120
+        assert set(result["tracks"]) == {"drums", "bass", "other", "melody"}
+        assert result["tracks"]["melody"]["error"] == "pyin failed"
+        assert len(result["tracks"]["bass"]["notes"]) == 1
+        assert len(threads) == 6
+        assert all(name.startswith("anisong-cpu") for name in threads)
+
+    @patch("app.services.magenta.get_librosa_transcriber")
+    @patch("app.services.magenta.get_audio_separator_service")
+    @patch("app.services.magenta.get_basic_pitch_service")
+    def test_offset_shifts_notes_to_song_time(self, mock_get_basic_pitch, mock_get_separator, mock_get_librosa, tmp_path):
+        """区間の音声を解析した場合、ノートの時刻は曲の先頭からの時刻で返す"""
+        from app.services.magenta import MagentaService
+
+        audio_path = tmp_path / "song.wav"
+        audio_path.write_bytes(b"dummy audio data")
+
+        basic_pitch = mock_get_basic_pitch.return_value
+        basic_pitch.detect_tempo.return_value = (120.0, [])
+        basic_pitch.transcribe_track.return_value = {
+            "success": True,
+            "notes": [{"pitch": 40, "start": 0.25, "end": 0.75, "velocity": 90}],
+            "error": None,
+        }
+        mock_get_separator.return_value.separate.return_value = {
+            "success": True,
+            "tracks": {"bass": "b.wav", "vocals": "v.wav"},
+            "error": None,
+        }
+        mock_get_librosa.return_value.extract_melody.return_value = {
+            "success": True,
+            "notes": [{"pitch": 64, "start": 1.0, "end": 1.5, "velocity": 80}],
+            "error": None,
+        }
+
+        service = MagentaService()
+        service.temp_dir = tmp_path
+        result = _run_4tracks(service, str(audio_path), offset=30.0)
+
+        assert result["tracks"]["bass"]["notes"].to_dicts() == [{"pitch": 40, "start": 30.25, "end": 30.75, "velocity": 90}]
+        assert result["tracks"]["melody"]["notes"].start[0] == 31.0
+        # MIDIファイルも曲の時刻で書き出す
+        parsed = service.parse_midi(result["tracks"]["bass"]["midi_path"])
+        assert parsed["notes"][0]["start"] == pytest.approx(30.25, abs=0.01)
+
+        # 同じ音声ファイル（キャッシュしたダウンロード）をもう一度解析しても前回のMIDIを上書きしない
+        again = _run_4tracks(service, str(audio_path), offset=30.0)
+        paths = {result["tracks"]["bass"]["midi_path"], again["tracks"]["bass"]["midi_path"]}
+        assert len(paths) == 2
+        assert all(Path(p).name.startswith("song-") and Path(p).exists() for p in paths)
+
+    @patch("app.services.magenta.get_librosa_transcriber")
+    @patch("app.services.magenta.get_audio_separator_service")
+    @patch("app.services.magenta.get_basic_pitch_service")
+    def test_stems_transcribed_in_parallel(self, mock_get_basic_pitch, mock_get_separator, mock_get_librosa, tmp_path, monkeypatch):
+        """各トラックは並列に変換され、1トラックの例外は他に影響しない"""
+        import time
+        from concurrent.futures import ThreadPoolExecutor
+        from app.services import executors
+        from app.services.magenta import MagentaService
+
+        pool = ThreadPoolExecutor(
+            max_workers=4,
+            thread_name_prefix="anisong-cpu",
+            initializer=executors._init_cpu_worker,
+            initargs=(False,),
+        )
+        monkeypatch.setattr(executors, "_cpu_executor", pool)
+
+        audio_path = tmp_path / "song.wav"
+        audio_path.write_bytes(b"dummy audio data")
+
+        def slow(result):
+            def _run(*args, **kwargs):
+                time.sleep(0.3)
+                return result
+            return _run
+
+        def crash(*args, **kwargs):
+            time.sleep(0.3)
+            raise RuntimeError("out of memory")
+
+        basic_pitch = mock_get_basic_pitch.return_value
+        basic_pitch.detect_tempo.return_value = (120.0, [])
+        basic_pitch.transcribe_track.side_effect = slow(
+            {"success": True, "notes": [{"pitch": 40, "start": 0.0, "end": 0.5, "velocity": 90}], "error": None}
+        )
+        mock_get_separator.return_value.separate.return_value = {
+            "success": True,
+            "tracks": {"drums": "d.wav", "bass": "b.wav", "other": "o.wav", "vocals": "v.wav"},
+            "error": None,
+        }
+        librosa = mock_get_librosa.return_value
+        librosa.extract_drums.side_effect = crash
+        librosa.extract_melody.side_effect = slow({"success": True, "notes": [], "error": None})
+
+        service = MagentaService()
+        service.temp_dir = tmp_path
+        start = time.monotonic()
+        try:
+            result = _run_4tracks(service, str(audio_path))
+        finally:
+            pool.shutdown(wait=True)
+        elapsed = time.monotonic() - start
+
+        # 直列なら1.2秒かかる
+        assert elapsed < 0.9
+        assert result["success"] is True
+        assert list(result["tracks"]) == ["drums", "bass", "other", "melody"]
+        assert "out of memory" in result["tracks"]["drums"]["error"]
+        assert len(result["tracks"]["bass"]["notes"]) == 1
+        assert len(result["tracks"]["other"]["notes"]) == 1
+        assert "error" not in result["tracks"]["melody"]
+
+    @patch("app.services.magenta.get_librosa_transcriber")
+    @patch("app.services.magenta.get_audio_separator_service")
+    @patch("app.services.magenta.get_basic_pitch_service")
+    def test_tracks_yielded_in_completion_order(self, mock_get_basic_pitch, mock_get_separator, mock_get_librosa, tmp_path, monkeypatch):
+        """変換が終わったトラックから順に track イベントが返る"""
+        import time
+        from concurrent.futures import ThreadPoolExecutor
+        from app.services import executors
+        from app.services.magenta import MagentaService
+
+        pool = ThreadPoolExecutor(
+            max_workers=4,
+            thread_name_prefix="anisong-cpu",
+            initializer=executors._init_cpu_worker,
+            initargs=(False,),
+        )
+        monkeypatch.setattr(executors, "_cpu_executor", pool)
+
+        audio_path = tmp_path / "song.wav"
+        audio_path.write_bytes(b"dummy audio data")
+
+        def delayed(seconds):
+            def _run(*args, **kwargs):
+                time.sleep(seconds)
+                return {"success": True, "notes": [], "error": None}
+            return _run
+
+        mock_get_basic_pitch.return_value.detect_tempo.return_value = (120.0, [])
+        mock_get_basic_pitch.return_value.transcribe_track.side_effect = delayed(0.1)
+        mock_get_separator.return_value.separate.return_value = {
+            "success": True,
+            "tracks": {"drums": "d.wav", "bass": "b.wav", "other": "o.wav", "vocals": "v.wav"},
+            "error": None,
+        }
+        mock_get_librosa.return_value.extract_drums.side_effect = delayed(0.0)
+        mock_get_librosa.return_value.extract_melody.side_effect = delayed(0.4)
+
+        service = MagentaService()
+        service.temp_dir = tmp_path
+        try:
+            events = list(service.audio_to_4tracks_with_progress(str(audio_path)))
+        finally:
+            pool.shutdown(wait=True)
+
+        track_order = [e["track"] for e in events if e["stage"] == "track"]
+        assert track_order[0] == "drums"
+        assert track_order[-1] == "melody"
+        assert events[-1]["stage"] == "complete"
+        assert list(events[-1]["result"]["tracks"]) == ["drums", "bass", "other", "melody"]
+        mock_get_separator.return_value.cleanup.assert_called_once()
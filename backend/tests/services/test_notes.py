@@ -0,0 +1,160 @@
+"""
+ノート列の共通処理のテスト
+"""
+import numpy as np
+import pytest
+
+
+def _reference_merge_by_pitch(notes, gap_threshold):
+    """以前のBasicPitchService.merge_notes（dictをピッチごとにまとめる実装、比較用）"""
+    pitch_groups = {}
+    for note in notes:
+        pitch_groups.setdefault(note["pitch"], []).append(note)
+
+    merged_notes = []
+    for group in pitch_groups.values():
+        group.sort(key=lambda n: n["start"])
+        current_note = None
+        for note in group:
+            if current_note is None:
+                current_note = note.copy()
+            elif note["start"] - current_note["end"] <= gap_threshold:
+                current_note["end"] = note["end"]
+                current_note["velocity"] = (current_note["velocity"] + note["velocity"]) // 2
+                current_note["confidence"] = max(current_note["confidence"], note["confidence"])
+            else:
+                merged_notes.append(current_note)
+                current_note = note.copy()
+        merged_notes.append(current_note)
+
+    merged_notes.sort(key=lambda n: n["start"])
+    return merged_notes
+
+
+def _reference_merge_adjacent(notes, gap_threshold):
+    """以前のLibrosaTranscriber._merge_nearby_notes（連続するノート同士、比較用）"""
+    notes = [note.copy() for note in notes]
+    merged = [notes[0]]
+    for note in notes[1:]:
+        prev = merged[-1]
+        if note["pitch"] == prev["pitch"] and note["start"] - prev["end"] <= gap_threshold:
+            prev["end"] = note["end"]
+            prev["velocity"] = max(prev["velocity"], note["velocity"])
+        else:
+            merged.append(note)
+    return merged
+
+
+def _random_notes(count, seed=0, confidence=True):
+    """開始時間順のランダムなノート（同じピッチのぶつ切りノートを多く含む）"""
+    rng = np.random.default_rng(seed)
+    starts = np.round(np.sort(rng.uniform(0, 30, count)) * 8) / 8
+    notes = []
+    for start in starts.tolist():
+        note = {
+            "pitch": int(rng.integers(60, 66)),
+            "start": start,
+            "end": start + float(rng.choice([0.125, 0.25, 0.5])),
+            "velocity": int(rng.integers(1, 128)),
+        }
+        if confidence:
+            note["confidence"] = round(float(rng.uniform(0.3, 1.0)), 2)
+        notes.append(note)
+    return notes
+
+
+class TestNoteArray:
+    """NoteArrayのテスト"""
+
+    def test_roundtrip(self):
+        """dictのリストに戻すと同じ値・同じ型になる（confidenceがなければキーも付けない）"""
+        from app.services.notes import NoteArray
+
+        notes = _random_notes(50) + _random_notes(5, confidence=False)
+        result = NoteArray.from_dicts(notes).to_dicts()
+
+        assert result == notes
+        assert all(type(n["pitch"]) is int and type(n["velocity"]) is int for n in result)
+
+    def test_sort_between_and_concatenate(self):
+        """開始時間順の並べ替え・時間範囲での取り出し・結合"""
+        from app.services.notes import NoteArray
+
+        notes = _random_notes(200, seed=1)
+        bass = NoteArray.from_dicts(notes[::2])
+        other = NoteArray.from_dicts(notes[1::2])
+
+        combined = NoteArray.concatenate([bass, other]).sort()
+        assert combined.to_dicts() == sorted(notes[::2] + notes[1::2], key=lambda n: n["start"])
+
+        window = combined.between(10.0, 10.5)
+        assert window.to_dicts() == [
+            n for n in combined.to_dicts() if n["start"] < 10.5 and n["end"] > 10.0
+        ]
+        assert len(NoteArray.concatenate([])) == 0
+
+    def test_shift(self):
+        """時刻をずらして小数点以下3桁に丸める（Pythonのroundと同じ結果）"""
+        from app.services.notes import NoteArray
+
+        notes = _random_notes(100, seed=2)
+        shifted = NoteArray.from_dicts(notes).shift(12.3456)
+
+        assert shifted.to_dicts() == [
+            {**n, "start": round(n["start"] + 12.3456, 3), "end": round(n["end"] + 12.3456, 3)}
+            for n in notes
+        ]
+
+    def test_pickle(self):
+        """CPUワーカーから返せる（pickleできる）"""
+        import pickle
+        from app.services.notes import NoteArray
+
+        notes = NoteArray.from_dicts(_random_notes(10))
+        assert pickle.loads(pickle.dumps(notes)).to_dicts() == notes.to_dicts()
+
+
+class TestMergeNotes:
+    """merge_notesのテスト"""
+
+    @pytest.mark.parametrize("seed", range(5))
+    @pytest.mark.parametrize("gap_threshold", [0.0, 0.15, 0.5])
+    def test_by_pitch_same_as_dict_merge(self, seed, gap_threshold):
+        """ピッチごとのマージはdictでの実装と同じ結果（ベロシティは順に平均、confidenceは最大）"""
+        from app.services.notes import NoteArray
+
+        notes = _random_notes(500, seed=seed)
+        merged = NoteArray.from_dicts(notes).merge(gap_threshold)
+
+        assert merged.to_dicts() == _reference_merge_by_pitch(notes, gap_threshold)
+
+    @pytest.mark.parametrize("seed", range(5))
+    def test_adjacent_same_as_dict_merge(self, seed):
+        """連続するノート同士のマージはdictでの実装と同じ結果（ベロシティは最大）"""
+        from app.services.notes import NoteArray
+
+        notes = _random_notes(500, seed=seed, confidence=False)
+        merged = NoteArray.from_dicts(notes).merge(0.08, velocity="max", by_pitch=False)
+
+        assert merged.to_dicts() == _reference_merge_adjacent(notes, 0.08)
+
+    def test_long_run(self):
+        """長くつながるノートも1つにまとめ、ベロシティを順に平均する"""
+        from app.services.notes import NoteArray
+
+        notes = [
+            {"pitch": 60, "start": i * 0.25, "end": i * 0.25 + 0.2, "velocity": 100 - i, "confidence": 0.5}
+            for i in range(40)
+        ]
+        merged = NoteArray.from_dicts(notes).merge(0.1).to_dicts()
+
+        assert merged == _reference_merge_by_pitch(notes, 0.1)
+        assert len(merged) == 1 and merged[0]["end"] == notes[-1]["end"]
+
+    def test_empty_and_single(self):
+        """0個・1個ならそのまま"""
+        from app.services.notes import NoteArray
+
+        assert len(NoteArray().merge(0.1)) == 0
+        single = NoteArray.from_dicts(_random_notes(1))
+        assert single.merge(0.1).to_dicts() == single.to_dicts()
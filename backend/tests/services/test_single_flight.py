@@ -0,0 +1,144 @@
+"""
+SingleFlightのテスト
+"""
+import asyncio
+import pytest
+
+
+async def _slow_producer(calls: list, gate: asyncio.Event):
+    """gateが開くまで途中で止まるプロデューサー"""
+    calls.append(1)
+    yield {"stage": "init", "progress": 0, "message": "start"}
+    await gate.wait()
+    yield {"stage": "complete", "progress": 100, "message": "done", "data": {"tempo": 120}}
+
+
+class TestSingleFlight:
+    """SingleFlightのテスト"""
+
+    @pytest.mark.asyncio
+    async def test_same_key_runs_once(self):
+        """同じキーの同時要求はプロデューサーを1回だけ実行する"""
+        from app.services.single_flight import SingleFlight
+
+        single_flight = SingleFlight()
+        calls = []
+        gate = asyncio.Event()
+
+        flight1 = single_flight.join("video123", lambda: _slow_producer(calls, gate))
+        flight2 = single_flight.join("video123", lambda: _slow_producer(calls, gate))
+        assert flight1 is flight2
+
+        results = asyncio.gather(flight1.result(), flight2.result())
+        await asyncio.sleep(0)
+        gate.set()
+        result1, result2 = await results
+
+        assert calls == [1]
+        assert result1["data"] == {"tempo": 120}
+        assert result2 is result1
+        assert not single_flight.is_running("video123")
+
+    @pytest.mark.asyncio
+    async def test_late_subscriber_receives_history(self):
+        """途中から合流した購読者もそれまでのイベントを受け取る"""
+        from app.services.single_flight import SingleFlight
+
+        single_flight = SingleFlight()
+        gate = asyncio.Event()
+
+        flight = single_flight.join("video123", lambda: _slow_producer([], gate))
+        await asyncio.sleep(0.01)  # initイベントまで進める
+        assert len(flight.events) == 1
+
+        late = single_flight.join("video123", lambda: _slow_producer([], gate))
+        gate.set()
+        stages = [event["stage"] async for event in late.subscribe()]
+
+        assert stages == ["init", "complete"]
+
+    @pytest.mark.asyncio
+    async def test_different_keys_run_separately(self):
+        """キーが違えば別々に実行する"""
+        from app.services.single_flight import SingleFlight
+
+        single_flight = SingleFlight()
+        calls = []
+        gate = asyncio.Event()
+        gate.set()
+
+        flight1 = single_flight.join("video123", lambda: _slow_producer(calls, gate))
+        flight2 = single_flight.join("video456", lambda: _slow_producer(calls, gate))
+        await asyncio.gather(flight1.result(), flight2.result())
+
+        assert flight1 is not flight2
+        assert calls == [1, 1]
+
+    @pytest.mark.asyncio
+    async def test_producer_exception_becomes_error_event(self):
+        """プロデューサーの例外はerrorイベントとして通知される"""
+        from app.services.single_flight import SingleFlight
+
+        async def failing_producer():
+            yield {"stage": "init", "progress": 0, "message": "start"}
+            raise RuntimeError("boom")
+
+        single_flight = SingleFlight()
+        result = await single_flight.join("video123", failing_producer).result()
+
+        assert result["stage"] == "error"
+        assert "boom" in result["message"]
+        assert not single_flight.is_running("video123")
+
+    @pytest.mark.asyncio
+    async def test_cancelled_when_all_subscribers_leave(self):
+        """購読者が全員抜けたら処理をキャンセルし、1人でも残っていれば続ける"""
+        from app.services.single_flight import SingleFlight
+
+        single_flight = SingleFlight()
+        gate = asyncio.Event()
+        flight = single_flight.join("video123", lambda: _slow_producer([], gate))
+
+        first = flight.subscribe()
+        second = flight.subscribe()
+        assert (await first.__anext__())["stage"] == "init"
+        assert (await second.__anext__())["stage"] == "init"
+
+        await first.aclose()
+        await asyncio.sleep(0)
+        assert not flight.task.cancelled()
+
+        await second.aclose()
+        with pytest.raises(asyncio.CancelledError):
+            await flight.task
+        assert flight.done
+        assert not single_flight.is_running("video123")
+
+    @pytest.mark.asyncio
+    async def test_reconnect_during_cancellation_starts_new_flight(self):
+        """キャンセル中に再接続した要求はキャンセルされた処理に合流せず、新しく開始する"""
+        from app.services.single_flight import SingleFlight
+
+        single_flight = SingleFlight()
+        calls = []
+        gate = asyncio.Event()
+        flight = single_flight.join("video123", lambda: _slow_producer(calls, gate))
+
+        subscriber = flight.subscribe()
+        assert (await subscriber.__anext__())["stage"] == "init"
+        await subscriber.aclose()
+
+        # キャンセルが_runに届く前（ページの再読み込み直後）に再接続
+        assert not single_flight.is_running("video123")
+        retry = single_flight.join("video123", lambda: _slow_producer(calls, gate))
+        assert retry is not flight
+
+        gate.set()
+        result = await retry.result()
+        assert result["stage"] == "complete"
+        assert calls == [1, 1]
+
+        # キャンセルされた処理の購読者にも最後にerrorイベントが届く
+        with pytest.raises(asyncio.CancelledError):
+            await flight.task
+        assert flight.events[-1]["stage"] == "error"
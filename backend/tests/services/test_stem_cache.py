@@ -0,0 +1,186 @@
+"""
+StemCacheService のテスト
+"""
+import os
+import time
+from unittest.mock import MagicMock, patch
+
+import numpy as np
+import pytest
+
+
+@pytest.fixture
+def stem_cache(tmp_path, monkeypatch):
+    """一時ディレクトリを使うキャッシュ"""
+    from app.services.stem_cache import StemCacheService
+
+    monkeypatch.setenv("ANISONG_STEM_CACHE_DIR", str(tmp_path / "stems"))
+    monkeypatch.setenv("ANISONG_STEM_CACHE_MAX_MB", "100")
+    return StemCacheService()
+
+
+def _stems(seconds=1.0, seed=0):
+    rng = np.random.default_rng(seed)
+    n = int(44100 * seconds)
+    return {
+        name: (0.1 * rng.standard_normal((2, n))).astype(np.float32)
+        for name in ("drums", "bass", "other", "vocals")
+    }
+
+
+def _store(stem_cache, key, stems):
+    writer = stem_cache.writer(key, list(stems), 44100, 2)
+    writer.write(stems)
+    writer.commit()
+
+
+class TestStemCacheService:
+    """StemCacheServiceのテスト"""
+
+    def test_key_depends_on_audio_and_params(self, stem_cache):
+        """音声または分離パラメータが変わるとキーが変わる"""
+        from app.services.audio_buffer import AudioBuffer
+
+        samples = np.zeros((2, 1000), dtype=np.float32)
+        audio = AudioBuffer(samples=samples, sample_rate=44100)
+        same = AudioBuffer(samples=samples.copy(), sample_rate=44100)
+        other = AudioBuffer(samples=samples + 0.1, sample_rate=44100)
+
+        key = stem_cache.make_key(audio, {"profile": "balanced"})
+        assert key == stem_cache.make_key(same, {"profile": "balanced"})
+        assert key != stem_cache.make_key(other, {"profile": "balanced"})
+        assert key != stem_cache.make_key(audio, {"profile": "fast"})
+
+    def test_roundtrip(self, stem_cache):
+        """保存したステムを区間ごとに読み出せる（±1.0を超える値も含めてfloat32のまま）"""
+        stems = _stems()
+        stems["drums"][:, :100] *= 30.0
+        _store(stem_cache, "key1", stems)
+
+        cached = stem_cache.open("key1")
+        try:
+            assert cached.stems == list(stems)
+            assert cached.length == 44100
+            pieces = {name: [] for name in stems}
+            for _, chunk in cached.iter_chunks(block_seconds=0.3):
+                for name, audio in chunk.items():
+                    pieces[name].append(audio)
+        finally:
+            cached.close()
+
+        assert np.abs(stems["drums"]).max() > 1.0
+        for name, expected in stems.items():
+            np.testing.assert_array_equal(np.concatenate(pieces[name], axis=-1), expected)
+
+    def test_old_flac_entry_discarded(self, stem_cache):
+        """以前の形式（24bit FLAC）のエントリは壊れたものとして削除し、分離し直させる"""
+        import json
+        import soundfile as sf
+
+        entry_dir = stem_cache.cache_dir / "old"
+        entry_dir.mkdir()
+        sf.write(str(entry_dir / "bass.flac"), np.zeros((100, 2)), 44100, subtype="PCM_24")
+        (entry_dir / "meta.json").write_text(json.dumps({"stems": ["bass"]}))
+
+        assert stem_cache.open("old") is None
+        assert not entry_dir.exists()
+
+    def test_miss_and_disabled(self, stem_cache):
+        """キャッシュがない場合・無効な場合はNone"""
+        assert stem_cache.open("missing") is None
+
+        stem_cache.max_bytes = 0
+        assert stem_cache.writer("key1", ["bass"], 44100, 2) is None
+
+    def test_abort_leaves_nothing(self, stem_cache):
+        """中止した書き込みはエントリにならない"""
+        writer = stem_cache.writer("key1", ["bass"], 44100, 2)
+        writer.write({"bass": np.zeros((2, 100), dtype=np.float32)})
+        writer.abort()
+
+        assert stem_cache.open("key1") is None
+        assert list(stem_cache.cache_dir.iterdir()) == []
+
+    def test_evicts_least_recently_used(self, stem_cache):
+        """容量を超えたら最後に使った時刻が古いエントリから削除"""
+        _store(stem_cache, "old", _stems(seed=1))
+        _store(stem_cache, "recent", _stems(seed=2))
+        entry_size = sum(p.stat().st_size for p in (stem_cache.cache_dir / "old").iterdir())
+
+        # "old" の方を最近使ったことにする
+        past = time.time() - 100
+        os.utime(stem_cache.cache_dir / "recent", (past, past))
+        os.utime(stem_cache.cache_dir / "old", (past + 50, past + 50))
+
+        stem_cache.max_bytes = int(entry_size * 1.5)
+        assert stem_cache.evict() == 1
+        assert stem_cache.open("recent") is None
+        cached = stem_cache.open("old")
+        assert cached is not None
+        cached.close()
+
+
+class TestSeparatorUsesStemCache:
+    """AudioSeparatorServiceからのキャッシュ利用のテスト"""
+
+    def test_second_separation_skips_demucs(self, stem_cache, tmp_path, monkeypatch):
+        """同じ音声の2回目の分離はDemucsを実行せずキャッシュから返す"""
+        from app.services.audio_buffer import AudioBuffer
+        from app.services.audio_separator import AudioSeparatorService
+
+        monkeypatch.setenv("ANISONG_SEPARATED_DIR", str(tmp_path / "separated"))
+        service = AudioSeparatorService()
+        model = MagicMock()
+        model.sources = ["drums", "bass", "other", "vocals"]
+        service._models = {"htdemucs": model}
+        calls = []
+
+        def fake_apply(segment, profile=None):
+            calls.append(segment.shape[-1])
+            x = segment.numpy()
+            return np.stack([x * 0.1 * (i + 1) for i in range(4)]).astype(np.float32)
+
+        service._apply = fake_apply
+        samples = _stems()["other"]
+        audio = AudioBuffer(samples=samples, sample_rate=44100)
+
+        with patch("app.services.audio_separator.get_stem_cache_service", return_value=stem_cache):
+            first = service.separate(audio, in_memory=True)
+            second = service.separate(AudioBuffer(samples=samples.copy(), sample_rate=44100), in_memory=True)
+
+        try:
+            assert first["success"] and second["success"]
+            assert len(calls) == 1
+            for name in model.sources:
+                with first["tracks"][name].open() as a, second["tracks"][name].open() as b:
+                    np.testing.assert_array_equal(a.mono(), b.mono())
+        finally:
+            service.cleanup(first["tracks"])
+            service.cleanup(second["tracks"])
+
+    def test_benchmark_skips_cache(self, stem_cache, tmp_path, monkeypatch):
+        """ベンチマークは同じ音声でも毎回Demucsを実行し、キャッシュに書き込まない"""
+        from app.services.audio_separator import AudioSeparatorService
+        from scripts.benchmark_separation import benchmark_profile, make_test_stems
+
+        monkeypatch.setenv("ANISONG_SEPARATED_DIR", str(tmp_path / "separated"))
+        service = AudioSeparatorService()
+        model = MagicMock()
+        model.sources = ["drums", "bass", "other", "vocals"]
+        service._models = {"htdemucs": model}
+        calls = []
+
+        def fake_apply(segment, profile=None):
+            calls.append(segment.shape[-1])
+            x = segment.numpy()
+            return np.stack([x * 0.25] * 4).astype(np.float32)
+
+        service._apply = fake_apply
+        stems = make_test_stems(seconds=1.0)
+
+        with patch("app.services.audio_separator.get_stem_cache_service", return_value=stem_cache):
+            results = [benchmark_profile(service, "fast", stems) for _ in range(2)]
+
+        assert all("error" not in r for r in results)
+        assert len(calls) == 2
+        assert list(stem_cache.cache_dir.iterdir()) == []
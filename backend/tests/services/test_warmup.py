@@ -0,0 +1,135 @@
+"""
+ウォームアップのテスト
+"""
+from unittest.mock import patch
+
+import pytest
+
+
+class TestWarmupStages:
+    """合成音声による各処理のウォームアップのテスト"""
+
+    def test_make_warmup_clip(self):
+        """ステレオのfloat32音声を作成"""
+        import numpy as np
+        from app.services.warmup import make_warmup_clip
+
+        clip = make_warmup_clip(duration=2.0, sample_rate=22050)
+
+        assert clip.shape == (2, 44100)
+        assert clip.dtype == np.float32
+        assert np.abs(clip).max() <= 1.0
+
+    @patch("app.services.audio_separator.get_audio_separator_service")
+    @patch("app.services.librosa_transcriber.get_librosa_transcriber")
+    @patch("app.services.basic_pitch_service.get_basic_pitch_service")
+    def test_failure_does_not_stop_other_stages(self, mock_get_basic_pitch, mock_get_librosa, mock_get_separator):
+        """1つの処理が失敗しても残りの処理は実行される"""
+        from app.services.warmup import warm_up_stages
+
+        mock_get_basic_pitch.return_value.detect_tempo.return_value = (120.0, [])
+        mock_get_basic_pitch.return_value.transcribe_track.side_effect = RuntimeError("model missing")
+        mock_get_librosa.return_value.extract_melody.return_value = {"success": True, "notes": [], "error": None}
+        mock_get_librosa.return_value.extract_drums.return_value = {"success": True, "notes": [], "error": None}
+        mock_get_separator.return_value.separate.return_value = {
+            "success": False, "tracks": {}, "error": "Separation failed",
+        }
+
+        report = warm_up_stages()
+
+        assert set(report) == {"tempo", "basic_pitch", "melody", "drums", "separate"}
+        assert report["tempo"]["ok"] is True
+        assert report["basic_pitch"] == {"ok": False, "seconds": report["basic_pitch"]["seconds"], "error": "model missing"}
+        assert report["melody"]["ok"] is True
+        assert report["separate"]["ok"] is False
+        mock_get_separator.return_value.cleanup.assert_called_once_with({})
+
+
+class TestWarmupService:
+    """準備状態の管理のテスト"""
+
+    def test_disabled_is_ready(self, monkeypatch):
+        """ウォームアップ無効なら最初から準備完了"""
+        from app.services.warmup import WarmupService
+
+        monkeypatch.delenv("ANISONG_WARMUP", raising=False)
+        service = WarmupService()
+
+        assert service.status == "disabled"
+        assert service.ready is True
+
+    @pytest.mark.asyncio
+    async def test_run_waits_for_workers(self, monkeypatch):
+        """ワーカーの初期化が終わるまで準備完了にならない"""
+        import asyncio
+        import threading
+        from app.services.warmup import WarmupService
+
+        monkeypatch.setenv("ANISONG_WARMUP", "1")
+        service = WarmupService()
+        assert service.ready is False
+
+        release = threading.Event()
+
+        def fake_start(timeout):
+            release.wait(5)
+            return [{"pid": 1, "models": {}, "warmup": {}}]
+
+        with patch("app.services.warmup.start_cpu_workers", fake_start):
+            task = asyncio.create_task(service.run())
+            await asyncio.sleep(0.05)
+            assert service.status == "warming"
+            assert service.ready is False
+
+            release.set()
+            await task
+
+        assert service.status == "ready"
+        assert service.ready is True
+        assert service.workers[0]["pid"] == 1
+
+    @pytest.mark.asyncio
+    async def test_timeout_marks_failed_but_ready(self, monkeypatch):
+        """ウォームアップが失敗してもトラフィックは受ける"""
+        from app.services.warmup import WarmupService
+
+        monkeypatch.setenv("ANISONG_WARMUP", "1")
+        service = WarmupService()
+
+        def fake_start(timeout):
+            raise TimeoutError("too slow")
+
+        with patch("app.services.warmup.start_cpu_workers", fake_start):
+            await service.run()
+
+        assert service.status == "failed"
+        assert service.error == "too slow"
+        assert service.ready is True
+
+
+class TestReadyEndpoint:
+    """/ready エンドポイントのテスト"""
+
+    def test_ready_when_disabled(self, client, monkeypatch):
+        """ウォームアップ無効なら200"""
+        from app.services.warmup import WarmupService
+
+        monkeypatch.delenv("ANISONG_WARMUP", raising=False)
+        with patch("app.main.get_warmup_service", return_value=WarmupService()):
+            response = client.get("/ready")
+
+        assert response.status_code == 200
+        assert response.json()["ready"] is True
+
+    def test_not_ready_while_warming(self, client, monkeypatch):
+        """ウォームアップ中は503"""
+        from app.services.warmup import WarmupService
+
+        monkeypatch.setenv("ANISONG_WARMUP", "1")
+        service = WarmupService()
+        service.status = "warming"
+        with patch("app.main.get_warmup_service", return_value=service):
+            response = client.get("/ready")
+
+        assert response.status_code == 503
+        assert response.json()["status"] == "warming"
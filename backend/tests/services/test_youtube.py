@@ -152,3 +152,282 @@ class TestYouTubeService:
         assert len(results) == 1
         assert results[0]["id"] == "video456"
         assert results[0]["title"] == "Video Title"
+
+
+def _video_item(video_id):
+    return {
+        "id": video_id,
+        "snippet": {
+            "title": f"Song {video_id}",
+            "channelTitle": "Test Channel",
+            "thumbnails": {"default": {"url": "https://example.com/thumb.jpg"}},
+            "publishedAt": "2024-01-01T00:00:00Z",
+        },
+        "contentDetails": {"duration": "PT3M"},
+    }
+
+
+class TestYouTubeCache:
+    """動画情報・検索結果のキャッシュとまとめて取得のテスト"""
+
+    @pytest.fixture
+    def youtube(self, monkeypatch):
+        monkeypatch.setenv("YOUTUBE_API_KEY", "test_key")
+        with patch("app.services.youtube.build") as mock_build:
+            mock_youtube = Mock()
+            mock_build.return_value = mock_youtube
+            yield mock_youtube
+
+    def test_repeat_lookups_use_cache(self, youtube):
+        """同じ動画・同じ検索の2回目はAPIを呼ばない"""
+        from app.services.youtube import YouTubeService
+
+        youtube.videos.return_value.list.return_value.execute.return_value = {"items": [_video_item("a")]}
+        youtube.search.return_value.list.return_value.execute.return_value = {"items": []}
+
+        service = YouTubeService()
+        assert service.get_video("a")["title"] == "Song a"
+        assert service.get_video("a")["title"] == "Song a"
+        service.search_music("query", limit=5)
+        service.search_music("query", limit=5)
+
+        assert youtube.videos.return_value.list.call_count == 1
+        assert youtube.search.return_value.list.call_count == 1
+
+    def test_get_videos_batches_missing_ids(self, youtube):
+        """キャッシュにない動画だけを50件ずつまとめて取得する"""
+        from app.services.youtube import YouTubeService
+
+        def list_videos(id, **kwargs):
+            request = Mock()
+            request.execute.return_value = {
+                # 存在しない動画は返ってこない
+                "items": [_video_item(video_id) for video_id in id.split(",") if video_id != "gone"]
+            }
+            return request
+
+        youtube.videos.return_value.list.side_effect = list_videos
+        service = YouTubeService()
+        service.get_video("v0")
+
+        ids = [f"v{i}" for i in range(60)] + ["gone"]
+        videos = service.get_videos(ids)
+
+        assert [v["id"] for v in videos] == ids[:60]
+        requested = [c.kwargs["id"].split(",") for c in youtube.videos.return_value.list.call_args_list]
+        assert requested[0] == ["v0"]
+        assert [len(r) for r in requested[1:]] == [50, 10]
+        assert "v0" not in requested[1]
+
+    def test_expired_entries_refetched(self, youtube, monkeypatch):
+        """有効期間を過ぎたら取得し直す"""
+        import time
+        from app.services.youtube import YouTubeService
+
+        youtube.videos.return_value.list.return_value.execute.return_value = {"items": [_video_item("a")]}
+        service = YouTubeService()
+        service.get_video("a")
+
+        now = time.time()
+        monkeypatch.setattr("app.services.youtube.time.time", lambda: now + service.video_ttl + 1)
+        service.get_video("a")
+
+        assert youtube.videos.return_value.list.call_count == 2
+
+    def test_disk_cache_survives_restart(self, youtube, tmp_path, monkeypatch):
+        """ディスクに保存した場合は別のインスタンスからも使える"""
+        from app.services.youtube import YouTubeService
+
+        monkeypatch.setenv("ANISONG_YOUTUBE_CACHE_DIR", str(tmp_path))
+        youtube.videos.return_value.list.return_value.execute.return_value = {"items": [_video_item("a")]}
+        YouTubeService().get_video("a")
+
+        video = YouTubeService().get_video("a")
+
+        assert video["title"] == "Song a"
+        assert youtube.videos.return_value.list.call_count == 1
+
+
+@pytest.fixture
+def stand_in_api(monkeypatch):
+    """
+    YouTube Data APIの代わりのローカルHTTPサーバー
+
+    /search と /videos に応答し、受けたリクエストを記録する。
+    server.fail_next に数を入れるとその回数だけ503を返す
+    """
+    import json
+    import threading
+    import time
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    from urllib.parse import parse_qs, urlparse
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # keep-alive
+
+        def do_GET(self):
+            server = self.server
+            url = urlparse(self.path)
+            params = {k: v[0] for k, v in parse_qs(url.query).items()}
+            with server.lock:
+                server.requests.append((url.path, params, self.client_address[1]))
+                fail = server.fail_next > 0
+                server.fail_next -= fail
+            time.sleep(server.delay)
+
+            if fail:
+                self._send(503, {"error": {"code": 503}})
+            elif url.path.endswith("/search"):
+                self._send(200, {"items": [{
+                    "id": {"videoId": f"{params['q']}-1"},
+                    "snippet": {
+                        "title": f"Song {params['q']}",
+                        "channelTitle": "Test Channel",
+                        "thumbnails": {"high": {"url": "https://example.com/thumb.jpg"}},
+                        "publishedAt": "2024-01-01T00:00:00Z",
+                    },
+                }]})
+            elif url.path.endswith("/videos"):
+                self._send(200, {"items": [_video_item(v) for v in params["id"].split(",") if v != "gone"]})
+            else:
+                self._send(404, {})
+
+        def _send(self, status, body):
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    server.lock = threading.Lock()
+    server.requests = []
+    server.fail_next = 0
+    server.delay = 0.0
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    monkeypatch.setenv("YOUTUBE_API_KEY", "test_key")
+    monkeypatch.setenv("ANISONG_YOUTUBE_API_URL", f"http://127.0.0.1:{server.server_address[1]}/youtube/v3")
+    monkeypatch.setenv("ANISONG_YOUTUBE_BACKOFF", "0.01")
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+class TestYouTubeAsync:
+    """async版（コネクションプール付きHTTPクライアント）のテスト"""
+
+    @pytest.mark.asyncio
+    async def test_search_and_get_video(self, stand_in_api):
+        """APIキー付きで検索・動画取得し、接続を使い回す"""
+        from app.services.youtube import YouTubeService
+
+        service = YouTubeService()
+        try:
+            results = await service.search_music_async("abc", limit=5)
+            video = await service.get_video_async("v1")
+            missing = await service.get_video_async("gone")
+        finally:
+            await service.aclose()
+
+        assert results[0]["id"] == "abc-1"
+        assert video["title"] == "Song v1"
+        assert missing is None
+        (search_path, search_params, port1), (_, _, port2), _ = stand_in_api.requests
+        assert search_path == "/youtube/v3/search"
+        assert search_params["key"] == "test_key"
+        assert search_params["maxResults"] == "5"
+        # keep-aliveで同じ接続（クライアント側ポート）を使う
+        assert port1 == port2
+
+    @pytest.mark.asyncio
+    async def test_concurrent_searches_overlap(self, stand_in_api):
+        """同時に来た検索は並行して処理される"""
+        import asyncio
+        import time
+        from app.services.youtube import YouTubeService
+
+        stand_in_api.delay = 0.3
+        service = YouTubeService()
+        started = time.perf_counter()
+        try:
+            results = await asyncio.gather(*(service.search_music_async(f"q{i}") for i in range(4)))
+        finally:
+            await service.aclose()
+        elapsed = time.perf_counter() - started
+
+        assert [r[0]["id"] for r in results] == [f"q{i}-1" for i in range(4)]
+        assert elapsed < 0.9
+
+    @pytest.mark.asyncio
+    async def test_retries_transient_errors(self, stand_in_api):
+        """503は再試行し、それでも失敗したらエラーにする"""
+        import httpx
+        from app.services.youtube import YouTubeService
+
+        service = YouTubeService()
+        try:
+            stand_in_api.fail_next = 2
+            results = await service.search_music_async("abc")
+            assert results[0]["id"] == "abc-1"
+            assert len(stand_in_api.requests) == 3
+
+            stand_in_api.fail_next = 3
+            with pytest.raises(httpx.HTTPStatusError):
+                await service.search_music_async("other")
+            assert await service.get_video_async("v1") is not None
+        finally:
+            await service.aclose()
+
+    @pytest.mark.asyncio
+    async def test_get_videos_async_batches(self, stand_in_api):
+        """キャッシュにない動画だけを50件ずつ取得し、同期版とキャッシュを共有する"""
+        from app.services.youtube import YouTubeService
+
+        service = YouTubeService()
+        try:
+            ids = [f"v{i}" for i in range(60)]
+            videos = await service.get_videos_async(ids)
+            again = await service.get_videos_async(ids[:10])
+        finally:
+            await service.aclose()
+
+        assert [v["id"] for v in videos] == ids
+        assert [v["id"] for v in again] == ids[:10]
+        assert sorted(len(p["id"].split(",")) for _, p, _ in stand_in_api.requests) == [10, 50]
+
+    @pytest.mark.asyncio
+    async def test_disk_cache_off_event_loop(self, stand_in_api, tmp_path, monkeypatch):
+        """ディスクキャッシュの読み書きはイベントループのスレッドで行わない"""
+        import threading
+        from app.services.youtube import TTLCache, YouTubeService
+
+        monkeypatch.setenv("ANISONG_YOUTUBE_CACHE_DIR", str(tmp_path))
+        disk_threads = []
+        original_path_for = TTLCache._path_for
+
+        def path_for(cache, key):
+            disk_threads.append(threading.current_thread())
+            return original_path_for(cache, key)
+
+        monkeypatch.setattr(TTLCache, "_path_for", path_for)
+        service = YouTubeService()
+        try:
+            await service.search_music_async("abc")
+            await service.get_video_async("v1")
+            # メモリから消えてもディスクから読める
+            service.cache._memory.clear()
+            video = await service.get_video_async("v1")
+        finally:
+            await service.aclose()
+
+        assert video["title"] == "Song v1"
+        assert len(stand_in_api.requests) == 2
+        assert disk_threads
+        assert threading.current_thread() not in disk_threads